@@ -11,7 +11,6 @@ from kivy.uix.textinput import TextInput
 from MysteryOnline.keyboard_listener import KeyboardListener
 from kivy.uix.button import Button
 from MysteryOnline.mopopup import MOPopup
-import threading
 
 
 class DownloadableCharactersScreen(Popup):
@@ -26,7 +25,8 @@ class DownloadableCharactersScreen(Popup):
         self.fill_popup()
 
     def fill_popup(self):
-        self.download_all_button.bind(on_press=lambda x: threading.Thread(target=self.download_all, args=()).start())
+        irc_connection = App.get_running_app().get_main_screen().manager.irc_connection
+        self.download_all_button.bind(on_press=lambda x: irc_connection.run_background(self.download_all))
         dlc_list = App.get_running_app().get_main_screen().character_list_for_dlc
         for text in dlc_list:
             arguments = text.split('#', 2)
@@ -34,7 +34,7 @@ class DownloadableCharactersScreen(Popup):
             link = arguments[1]
             ver = arguments[2]
             button = Button(text=char+" {version "+ver+"}", size_hint_y=None, height=50, width=self.width)
-            button.bind(on_press=lambda x: threading.Thread(target=self.download_character, args=(char, link, ver)).start())
+            button.bind(on_press=lambda x: irc_connection.run_background(self.download_character, char, link, ver))
             self.dlc_window.add_widget(button)
 
     def get_confirm_token(self, response):
@@ -160,9 +160,10 @@ class Character:
             Logger.error("Icons: The icons aren't loaded into memory")
             raise
 
-    def get_sprite(self, sprite_name):
+    def get_sprite(self, sprite_name, wait=True):
+        """Without wait, a sprite that isn't decoded yet comes back as a LoadingSprite."""
         try:
-            sprite = self.sprites[sprite_name]
+            sprite = self.sprites.get_sprite(sprite_name, wait)
             config = App.get_running_app().config
             if config.getdefaultint('other', 'nsfw_mode', 1) and sprite_name in self.nsfw_sprites:
                 sprite.set_nsfw()
@@ -0,0 +1,334 @@
+from MysteryOnline.exceptions import IncorrectMessageTypeError
+
+SEPARATOR = '#'
+
+# Version 1 is the plain '#'-delimited format every client understands
+PROTOCOL_VERSION = 2
+HELLO_TAG = 'MO'
+FRAGMENTS = 'fragments'
+DELTA = 'delta'
+CAPABILITIES = (FRAGMENTS, DELTA)
+# Announced by clients in location channel mode, which are always in the channel of their location
+ROOMS = 'rooms'
+# Announced by a state keeper, which sends joining users everyone's state in a snapshot
+SNAPSHOT = 'snapshot'
+SNAPSHOT_TAG = 'MOS'
+SNAPSHOT_SEPARATOR = '\t'
+# Every this many messages of a type a sender sends a full one, even if deltas are allowed
+KEYFRAME_INTERVAL = 20
+
+
+class MessageSchema:
+    """Wire layout of one message type: its prefix and its fields, in order.
+    The last field is allowed to contain the separator.
+    """
+
+    def __init__(self, message_type, prefix, fields, required=None):
+        self.message_type = message_type
+        self.prefix = prefix
+        self.fields = tuple(fields)
+        if required is None:
+            required = len(self.fields)
+        self.required = required
+        self.max_split = len(self.fields) - 1
+        # Set on a schema that can be delta encoded, and on its delta schema respectively
+        self.delta = None
+        self.base = None
+        self.volatile = 0
+
+    @property
+    def state_fields(self):
+        """How many leading fields a delta may leave out, the volatile ones at the end are always sent."""
+        return len(self.fields) - self.volatile
+
+
+class MessageCodec:
+    """Table-driven decoder/encoder for the '#'-delimited message format.
+
+    Prefixed messages are looked up by whatever comes before the first '#',
+    then their body is split exactly once. IC chat has no prefix, so it's
+    recognized by its field count. Anything else is handed to the fallback
+    schema as a single field.
+    """
+
+    def __init__(self):
+        self.schemas = {}
+        self.positional = None
+        self.fallback = None
+
+    def register(self, message_type, prefix, fields, required=None):
+        schema = MessageSchema(message_type, prefix, fields, required)
+        if prefix is None:
+            self.positional = schema
+        else:
+            self.schemas[prefix] = schema
+        return schema
+
+    def register_delta(self, base, prefix, volatile=0):
+        """Adds a compact form of base: '<prefix>#<number>#<mask>#<changed fields>#<volatile fields>'.
+        mask is a hex bitmask of the state fields that are present, the others are the same as
+        in the sender's previous message of that type. number counts the deltas since the sender's
+        last full message, so a receiver that missed one can tell.
+        """
+        schema = MessageSchema(base.message_type, prefix, base.fields)
+        schema.base = base
+        base.delta = schema
+        base.volatile = schema.volatile = volatile
+        self.schemas[prefix] = schema
+        return schema
+
+    def set_fallback(self, prefix):
+        self.fallback = self.schemas[prefix]
+
+    def get_schema(self, prefix):
+        if prefix is None:
+            return self.positional
+        return self.schemas[prefix]
+
+    def decode(self, line):
+        """Returns the schema that matched and the list of raw field values.
+        For a delta schema the fields that were left out are None.
+        """
+        prefix, sep, body = line.partition(SEPARATOR)
+        schema = self.schemas.get(prefix)
+        if schema is not None:
+            if schema.base is not None:
+                return schema, self.decode_delta(schema, line, body)
+            values = body.split(SEPARATOR, schema.max_split)
+            if len(values) < schema.required:
+                raise IncorrectMessageTypeError(line)
+            return schema, values
+        positional = self.positional
+        if positional is not None:
+            values = line.split(SEPARATOR, positional.max_split)
+            if len(values) > positional.max_split:
+                return positional, values
+        if self.fallback is None:
+            raise IncorrectMessageTypeError(line)
+        return self.fallback, [line]
+
+    def decode_delta(self, schema, line, body):
+        number, sep, body = body.partition(SEPARATOR)
+        mask, sep, rest = body.partition(SEPARATOR)
+        try:
+            number = int(number)
+            mask = int(mask, 16)
+        except ValueError:
+            raise IncorrectMessageTypeError(line)
+        state_fields = schema.state_fields
+        present = [i for i in range(state_fields) if mask & (1 << i)]
+        count = len(present) + schema.volatile
+        result = DeltaValues([None] * state_fields)
+        result.number = number
+        if count == 0:
+            return result
+        values = rest.split(SEPARATOR, count - 1)
+        if len(values) < count or mask >> state_fields:
+            raise IncorrectMessageTypeError(line)
+        for i, value in zip(present, values):
+            result[i] = value
+        result += values[len(present):]
+        return result
+
+    def encode(self, schema, values):
+        body = SEPARATOR.join(values)
+        if schema.prefix is None:
+            return body
+        return schema.prefix + SEPARATOR + body
+
+    def encode_delta(self, schema, values, previous, number):
+        """Encodes values with schema's delta form, leaving out state fields equal to previous.
+        number is how many deltas of schema this is since the last full message.
+        """
+        delta = schema.delta
+        mask = 0
+        changed = []
+        for i in range(delta.state_fields):
+            if values[i] != previous[i]:
+                mask |= 1 << i
+                changed.append(values[i])
+        fields = [str(number), "{:x}".format(mask)] + changed + list(values[delta.state_fields:])
+        return delta.prefix + SEPARATOR + SEPARATOR.join(fields)
+
+
+class DeltaEncoder:
+    """Remembers the last values sent per schema, and decides between a delta and a full message.
+
+    Encoding doesn't change what's remembered, commit does once the line has actually gone out,
+    so a line that couldn't be sent isn't taken as what the others last got from us.
+    """
+
+    def __init__(self, codec, keyframe_interval=KEYFRAME_INTERVAL):
+        self.codec = codec
+        self.keyframe_interval = keyframe_interval
+        self.previous = {}
+        self.since_keyframe = {}
+        self.pending = None
+
+    def encode(self, schema, values, allow_delta=True):
+        previous = self.previous.get(schema)
+        since_keyframe = self.since_keyframe.get(schema, 0)
+        keyframe = not allow_delta or previous is None or since_keyframe >= self.keyframe_interval
+        self.pending = (schema, values, keyframe)
+        if keyframe:
+            return self.codec.encode(schema, values)
+        return self.codec.encode_delta(schema, values, previous, since_keyframe + 1)
+
+    def commit(self):
+        """Remembers the values last encoded as sent."""
+        if self.pending is None:
+            return
+        schema, values, keyframe = self.pending
+        self.pending = None
+        self.previous[schema] = values
+        self.since_keyframe[schema] = 0 if keyframe else self.since_keyframe.get(schema, 0) + 1
+
+    def reset(self):
+        """The next message of each type is sent in full, e.g. because someone new has to be brought up to date."""
+        self.previous.clear()
+        self.since_keyframe.clear()
+        self.pending = None
+
+
+class DeltaValues(list):
+    """Field values of a delta, None for the ones that were left out."""
+
+    __slots__ = ('number',)
+
+
+class DeltaState:
+    """The receiving side: every sender's last full values per schema, used to fill in deltas,
+    with how many deltas of theirs led up to them since their last full message.
+    """
+
+    def __init__(self):
+        self.states = {}
+
+    def update(self, sender, schema, values):
+        """Returns the schema and full values to build the message from.
+        A delta without a previous message to go on, or that doesn't follow the last one we got,
+        raises IncorrectMessageTypeError; the sender's next full message brings us back in step.
+        """
+        base = schema.base
+        if base is None:
+            if len(values) == len(schema.fields):
+                self.states[(sender, schema)] = (values, 0)
+            return schema, values
+        key = (sender, base)
+        state_fields = schema.state_fields
+        if None in values[:state_fields]:
+            previous, number = self.states.get(key, (None, None))
+            if previous is None or values.number != number + 1:
+                # We missed a line of theirs, filling this one in would show stale state
+                self.states.pop(key, None)
+                raise IncorrectMessageTypeError("No state to apply a delta from {} to".format(sender))
+            full = [p if v is None else v for v, p in zip(values[:state_fields], previous)] + values[state_fields:]
+        else:
+            full = list(values)
+        self.states[key] = (full, values.number)
+        return base, full
+
+    def forget(self, sender):
+        for key in [key for key in self.states if key[0] == sender]:
+            del self.states[key]
+
+
+def encode_hello(version=PROTOCOL_VERSION, capabilities=CAPABILITIES):
+    """The capability announcement, e.g. 'MO 2 fragments'."""
+    return " ".join((HELLO_TAG, str(version), ",".join(capabilities)))
+
+
+def decode_hello(text):
+    """Returns (version, capabilities) for an announcement, None for anything else."""
+    parts = text.split(" ")
+    if len(parts) != 3 or parts[0] != HELLO_TAG:
+        return None
+    try:
+        version = int(parts[1])
+    except ValueError:
+        return None
+    return version, frozenset(cap for cap in parts[2].split(",") if cap)
+
+
+def encode_snapshot(entries, max_bytes):
+    """Packs (sender, line) pairs into as few 'MOS<tab>sender<tab>line...' notices of at most max_bytes as it can.
+    A pair that's too long for a notice of its own is sent by itself anyway.
+    """
+    notices = []
+    current = [SNAPSHOT_TAG]
+    size = len(SNAPSHOT_TAG)
+    for sender, line in entries:
+        if SNAPSHOT_SEPARATOR in line:
+            continue
+        entry_size = len(sender.encode('utf-8')) + len(line.encode('utf-8')) + 2
+        if len(current) > 1 and size + entry_size > max_bytes:
+            notices.append(SNAPSHOT_SEPARATOR.join(current))
+            current = [SNAPSHOT_TAG]
+            size = len(SNAPSHOT_TAG)
+        current += [sender, line]
+        size += entry_size
+    if len(current) > 1:
+        notices.append(SNAPSHOT_SEPARATOR.join(current))
+    return notices
+
+
+def decode_snapshot(text):
+    """Returns the (sender, line) pairs of a snapshot notice, None for anything else."""
+    parts = text.split(SNAPSHOT_SEPARATOR)
+    if parts[0] != SNAPSHOT_TAG or len(parts) % 2 != 1:
+        return None
+    return list(zip(parts[1::2], parts[2::2]))
+
+
+class PeerCapabilities:
+    """What the other channel members announced they understand.
+
+    Members that haven't announced anything are treated as protocol version 1 with no
+    capabilities, so an optional encoding is only used once everyone it reaches supports it.
+    Until the server has finished listing the members nothing counts as supported, as we
+    don't know yet who we'd reach.
+    """
+
+    def __init__(self, local=CAPABILITIES):
+        self.local = frozenset(local)
+        self.versions = {}
+        self.capabilities = {}
+        self.listed = False
+
+    def add(self, nick):
+        self.versions.setdefault(nick, 1)
+        self.capabilities.setdefault(nick, frozenset())
+
+    def update(self, nick, version, capabilities):
+        self.versions[nick] = version
+        self.capabilities[nick] = frozenset(capabilities)
+
+    def remove(self, nick):
+        self.versions.pop(nick, None)
+        self.capabilities.pop(nick, None)
+
+    def clear(self):
+        self.versions.clear()
+        self.capabilities.clear()
+        self.listed = False
+
+    def set_listed(self):
+        self.listed = True
+
+    def get_version(self, nick):
+        return self.versions.get(nick, 1)
+
+    def common(self, nick):
+        return self.local & self.capabilities.get(nick, frozenset())
+
+    def peer_supports(self, nick, capability):
+        return capability in self.common(nick)
+
+    def providers(self, capability):
+        """The members that announced capability, whether or not we support it ourselves."""
+        return [nick for nick, capabilities in self.capabilities.items() if capability in capabilities]
+
+    def channel_supports(self, capability):
+        if capability not in self.local or not self.listed:
+            return False
+        return all(capability in capabilities for capabilities in self.capabilities.values())
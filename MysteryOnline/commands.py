@@ -7,6 +7,7 @@ from kivy.app import App
 from kivy.core.window import Window
 from MysteryOnline.character import characters
 from MysteryOnline.mopopup import MOPopup
+from MysteryOnline.traffic import TrafficReplayer
 
 
 class CommandError(Exception):
@@ -167,6 +168,8 @@ class CommandProcessor:
 
             'random': CommandHandler('random', 'str:option'),
 
+            'replay': RegexCommandHandler('replay', ['path', 'speed'], r'(\S+)\s*(\S*)'),
+
             'help': CommandHandler('help')
         }
 
@@ -265,6 +268,31 @@ class CommandProcessor:
             print('no random option found')
             pass
 
+    def process_replay(self):
+        speed = self.command['speed']
+        try:
+            if speed == 'max':
+                speed = 0
+            elif speed:
+                speed = float(speed.rstrip('x'))
+            else:
+                speed = 1.0
+        except ValueError:
+            MOPopup("Command error", "Replay format is: /replay file [speed|max]", "OK").open()
+            return
+        irc_connection = App.get_running_app().get_user_handler().get_connection_manager().irc_connection
+        try:
+            replayer = TrafficReplayer(irc_connection, self.command['path'], speed, self.on_replay_finished)
+        except (OSError, ValueError) as e:
+            MOPopup("Replay error", "Couldn't read the recording: {}".format(e), "OK").open()
+            return
+        replayer.start()
+
+    def on_replay_finished(self, summary):
+        log = App.get_running_app().get_main_screen().log_window
+        log.add_entry("Replayed {lines} lines over {frames} frames. Frame time: mean {mean_ms:.1f}ms, "
+                      "p95 {p95_ms:.1f}ms, max {max_ms:.1f}ms, {slow_frames} slow frames.\n".format(**summary))
+
     def process_startim(self):
         Window.set_title("Sonata's Revenge")
 
@@ -7,6 +7,7 @@ from kivy.clock import Clock
 from kivy.app import App
 from MysteryOnline.user import User
 from MysteryOnline.character import characters
+from MysteryOnline.prefetch import sprite_prefetcher
 from random import randint, choice
 from functools import partial
 
@@ -84,6 +85,39 @@ class UserManagementInterface(ModalView):
         self.dismiss()
 
 
+class LatencyStatsInterface(ModalView):
+
+    DEFAULT_DUMP_FILE = 'execution_stats.json'
+
+    stats_label = ObjectProperty(None)
+
+    def __init__(self, **kwargs):
+        super(LatencyStatsInterface, self).__init__(**kwargs)
+        self.connection_manager = App.get_running_app().get_user_handler().get_connection_manager()
+
+    def refresh(self):
+        self.stats_label.text = self.format_stats()
+
+    def format_stats(self):
+        round_trip = self.connection_manager.get_round_trip_ms()
+        if round_trip is None:
+            round_trip_text = "Server round trip: not measured yet"
+        else:
+            round_trip_text = "Server round trip: {:.0f}ms".format(round_trip)
+        prefetch = sprite_prefetcher.get_stats()
+        if prefetch['hit_rate'] is None:
+            prefetch_text = "Sprite prefetch: no first posts yet"
+        else:
+            prefetch_text = "Sprite prefetch: {:.0%} of first posts ready ({} hit, {} missed)".format(
+                prefetch['hit_rate'], prefetch['hits'], prefetch['misses'])
+        return round_trip_text + "\n" + prefetch_text + "\n\n" + self.connection_manager.latency.format_table()
+
+    def save(self):
+        path = self.connection_manager.execution_stats_file or self.DEFAULT_DUMP_FILE
+        self.connection_manager.latency.dump(path)
+        self.stats_label.text = self.format_stats() + "\n\nSaved to {}".format(path)
+
+
 class DebugModeInterface(BoxLayout):
 
     def __init__(self, **kwargs):
@@ -99,6 +133,11 @@ class DebugModeInterface(BoxLayout):
         popup.ready()
         popup.open()
 
+    def open_latency_stats(self):
+        popup = LatencyStatsInterface()
+        popup.refresh()
+        popup.open()
+
     def create_user(self, username, character, location, sublocation, position):
         self.debug_mode.create_user(username, character, location, sublocation, position)
 
@@ -1,3 +1,9 @@
 #custom exceptions go here
 
 
+class IncorrectMessageTypeError(Exception):
+    pass
+
+
+class MessageTooLongError(Exception):
+    pass
@@ -0,0 +1,113 @@
+import time
+from collections import OrderedDict
+
+from MysteryOnline.codec import SEPARATOR
+from MysteryOnline.exceptions import MessageTooLongError
+
+FRAGMENT_PREFIX = 'f'
+# What's left of IRC's 512 byte line once the command, channel and the relaying server's prefix are added
+MAX_LINE_BYTES = 400
+MAX_FRAGMENTS = 32
+MAX_ID = 10000
+
+
+def split_chunks(text, max_bytes):
+    """Splits text into pieces of at most max_bytes of UTF-8, never inside a character."""
+    chunks = []
+    start = 0
+    size = 0
+    for i, char in enumerate(text):
+        char_size = len(char.encode('utf-8'))
+        if size + char_size > max_bytes:
+            chunks.append(text[start:i])
+            start = i
+            size = 0
+        size += char_size
+    chunks.append(text[start:])
+    return chunks
+
+
+class Fragmenter:
+    """Splits lines that don't fit in one IRC message into sequence-numbered fragments.
+
+    A fragment is 'f#<id>#<index>#<count>#<chunk>'; ids are per connection and wrap around.
+    Lines that fit are passed through unchanged.
+    """
+
+    def __init__(self, max_bytes=MAX_LINE_BYTES):
+        self.max_bytes = max_bytes
+        self.next_id = 0
+
+    def split(self, line):
+        if len(line.encode('utf-8')) <= self.max_bytes:
+            return [line]
+        msg_id = self.next_id
+        self.next_id = (self.next_id + 1) % MAX_ID
+        # Header room for the largest id, index and count
+        header_size = len(SEPARATOR.join((FRAGMENT_PREFIX, str(MAX_ID), str(MAX_FRAGMENTS), str(MAX_FRAGMENTS), '')))
+        chunks = split_chunks(line, self.max_bytes - header_size)
+        if len(chunks) > MAX_FRAGMENTS:
+            raise MessageTooLongError("{} fragments".format(len(chunks)))
+        return [SEPARATOR.join((FRAGMENT_PREFIX, str(msg_id), str(i), str(len(chunks)), chunk))
+                for i, chunk in enumerate(chunks)]
+
+
+def is_fragment(line):
+    return line.startswith(FRAGMENT_PREFIX + SEPARATOR)
+
+
+class Reassembler:
+    """Collects fragments per sender until a line is complete.
+
+    At most max_pending lines are held at once, the oldest partial line is dropped
+    to make room, and partial lines older than timeout seconds are discarded.
+    """
+
+    def __init__(self, max_pending=32, timeout=30):
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self.pending = OrderedDict()
+        self.completed = 0
+        self.expired = 0
+        self.rejected = 0
+
+    def add(self, sender, line):
+        """Returns the full line once its last fragment arrives, otherwise None."""
+        now = time.monotonic()
+        self.expire(now)
+        try:
+            prefix, msg_id, index, count, chunk = line.split(SEPARATOR, 4)
+            index, count = int(index), int(count)
+        except ValueError:
+            self.rejected += 1
+            return None
+        if not 0 <= index < count <= MAX_FRAGMENTS:
+            self.rejected += 1
+            return None
+        key = (sender, msg_id)
+        entry = self.pending.get(key)
+        if entry is None or entry['count'] != count:
+            if entry is None and len(self.pending) >= self.max_pending:
+                self.pending.popitem(last=False)
+                self.expired += 1
+            entry = {'count': count, 'chunks': {}, 'started': now}
+            self.pending[key] = entry
+        entry['chunks'][index] = chunk
+        if len(entry['chunks']) < count:
+            return None
+        del self.pending[key]
+        self.completed += 1
+        chunks = entry['chunks']
+        return ''.join(chunks[i] for i in range(count))
+
+    def expire(self, now):
+        while self.pending:
+            key, entry = next(iter(self.pending.items()))
+            if now - entry['started'] < self.timeout:
+                return
+            del self.pending[key]
+            self.expired += 1
+
+    def get_stats(self):
+        return {'pending': len(self.pending), 'completed': self.completed, 'expired': self.expired,
+                'rejected': self.rejected}
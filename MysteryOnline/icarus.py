@@ -1,18 +1,35 @@
 import json
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 # noinspection PyUnresolvedReferences
 from os.path import dirname, join
+from kivy.clock import Clock
 from kivy.event import EventDispatcher
 from kivy.logger import Logger
 from kivy.properties import AliasProperty, DictProperty
-from MysteryOnline.sprite import Sprite, NullSprite
+from MysteryOnline.sprite import Sprite, NullSprite, LoadingSprite
+from MysteryOnline.page_cache import page_cache
 import os
 
 # late import to prevent recursion
 CoreImage = None
+ImageLoader = None
+
+# Pages requested without waiting are decoded to pixels on these threads, the texture is made on the main thread
+page_decoder = ThreadPoolExecutor(max_workers=2, thread_name_prefix="mo-atlas")
+
+
+def decode_page(page):
+    return ImageLoader.load(page, nocache=True)
 
 
 class Icarus(EventDispatcher):
     """Modified version of Kivy's Atlas class.
+
+    The atlas is parsed once into an index of sprite name -> page, and pages are
+    decoded the first time one of their sprites is asked for. Decoded pages are
+    registered with the page cache, which unloads them again to stay in its budget.
+    get_sprite can also hand out a LoadingSprite and decode the page in the background.
     """
 
     textures = DictProperty({})
@@ -24,23 +41,39 @@ class Icarus(EventDispatcher):
 
     def __init__(self, filename):
         self._filename = filename
+        # sprite name -> page file, and page file -> {sprite name: region}
+        self.index = None
+        self.pages = {}
+        self.loaded_pages = set()
+        # page file -> callbacks waiting for it to be decoded in the background
+        self.pending_pages = {}
         super(Icarus, self).__init__()
 
     def __getitem__(self, key):
+        return self.get_sprite(key)
+
+    def get_sprite(self, key, wait=True):
+        """Unless wait is set, a sprite whose page isn't decoded yet comes back as a LoadingSprite
+        and the page is decoded in the background.
+        """
         if key in self.textures:
+            page = self.index.get(key) if self.index is not None else None
+            if page is not None:
+                page_cache.touch(self, page)
             return self.textures[key]
+        if not wait and (self.index is not None or self.load_index()):
+            page = self.index.get(key)
+            if page is not None:
+                self.load_page_async(page)
+                return LoadingSprite(key, self, page)
         self.load(key)
         return self.textures[key]
 
     def __contains__(self, item):
         return item in self.textures
 
-    def load(self, image_name):
-        # late import to prevent recursive import.
-        global CoreImage
-        if CoreImage is None:
-            from kivy.core.image import Image as CoreImage
-
+    def load_index(self):
+        """Reads the .atlas file, returns False if there's none to read."""
         # must be a name finished by .atlas ?
         filename = self._filename
         try:
@@ -50,39 +83,112 @@ class Icarus(EventDispatcher):
 
             Logger.debug('Atlas: Load <%s>' % filename)
         except AttributeError:
-            self.textures[image_name] = NullSprite(image_name)
-            return
+            return False
 
         try:
             with open(filename, 'r') as fd:
                 meta = json.load(fd)
         except FileNotFoundError:
-            self.textures[image_name] = NullSprite(image_name)
-            return
+            return False
         d = dirname(filename)
-        textures = {}
-        found = None
-        ids_found = None
+        self.index = {}
+        self.pages = {}
         for sub, ids in meta.items():
-            if image_name in ids:
-                found = sub
-                ids_found = ids
-        if found is None:
+            page = join(d, sub)
+            self.pages[page] = ids
+            # A name on several pages comes from the last one
+            for meta_id in ids:
+                self.index[meta_id] = page
+        return True
+
+    def load(self, image_name):
+        if self.index is None and not self.load_index():
+            self.textures[image_name] = NullSprite(image_name)
+            return
+        page = self.index.get(image_name)
+        if page is None:
             Logger.error('Icarus: ' + image_name + ' not found')
             # noinspection PyTypeChecker
             self.textures[image_name] = NullSprite(image_name)
             return
-        subfilename = join(d, found)
-        Logger.debug('Atlas: Load <%s>' % subfilename)
+        self.load_page(page)
+
+    def load_page(self, page):
+        # late import to prevent recursive import.
+        global CoreImage
+        if CoreImage is None:
+            from kivy.core.image import Image as CoreImage
+
+        Logger.debug('Atlas: Load <%s>' % page)
 
         # load the image
-        ci = CoreImage(subfilename)
-        atlas_texture = ci.texture
+        ci = CoreImage(page)
+        self.add_page(page, ci.texture)
+
+    def load_page_async(self, page):
+        global CoreImage, ImageLoader
+        if CoreImage is None:
+            from kivy.core.image import Image as CoreImage
+        if ImageLoader is None:
+            from kivy.core.image import ImageLoader
 
+        if page in self.pending_pages:
+            return
+        Logger.debug('Atlas: Load <%s> in the background' % page)
+        self.pending_pages[page] = []
+        future = page_decoder.submit(decode_page, page)
+        future.add_done_callback(lambda f: Clock.schedule_once(partial(self.on_page_decoded, page, f)))
+
+    def on_page_decoded(self, page, future, dt):
+        callbacks = self.pending_pages.pop(page, [])
+        # It may have been loaded the blocking way meanwhile
+        if page not in self.loaded_pages:
+            try:
+                self.add_page(page, CoreImage(future.result()).texture)
+            except Exception as e:
+                Logger.error('Icarus: Could not load {}: {}'.format(page, e))
+                # So whoever is waiting doesn't ask for it again and again
+                self.textures.update({name: NullSprite(name) for name in self.get_page_names(page)})
+        for callback in callbacks:
+            callback()
+
+    def when_page_loaded(self, page, callback):
+        """Calls callback once page has been decoded, right away if it already is."""
+        if page in self.loaded_pages:
+            callback()
+            return
+        self.load_page_async(page)
+        callbacks = self.pending_pages[page]
+        if callback not in callbacks:
+            callbacks.append(callback)
+
+    def get_page(self, key=None):
+        """The page key is on, the first page if key is None, or None if there's no such sprite."""
+        if self.index is None and not self.load_index():
+            return None
+        if key is None:
+            return next(iter(self.pages), None)
+        return self.index.get(key)
+
+    def is_page_loaded(self, page):
+        return page in self.loaded_pages
+
+    def get_page_names(self, page):
+        return [meta_id for meta_id in self.pages[page] if self.index[meta_id] == page]
+
+    def add_page(self, page, atlas_texture):
         # for all the uid, load the image, get the region, and put
         # it in our dict.
-        for meta_id, meta_coords in ids_found.items():
-            x, y, w, h = meta_coords
-            textures[meta_id] = Sprite(meta_id, atlas_texture.get_region(*meta_coords))
-
-        self.textures = textures
+        textures = {}
+        for meta_id, meta_coords in self.pages[page].items():
+            if self.index[meta_id] == page:
+                textures[meta_id] = Sprite(meta_id, atlas_texture.get_region(*meta_coords))
+        self.loaded_pages.add(page)
+        self.textures.update(textures)
+        # Decoded RGBA
+        page_cache.add(self, page, atlas_texture.width * atlas_texture.height * 4)
+
+    def unload_page(self, page):
+        names = self.get_page_names(page)
+        self.textures = {name: sprite for name, sprite in self.textures.items() if name not in names}
+        self.loaded_pages.discard(page)
@@ -158,8 +158,8 @@ class IconsLayout(BoxLayout):
         user_handler = App.get_running_app().get_user_handler()
         sprite_option = user_handler.get_chosen_sprite_option()
         sprite = char.get_sprite(sprite_name)
-        main_scr.sprite_settings.apply_post_processing(sprite, sprite_option)
-        sprite_texture = char.get_sprite(sprite_name).get_texture()
+        sprite = main_scr.sprite_settings.apply_post_processing(sprite, sprite_option)
+        sprite_texture = sprite.get_texture()
         sprite_size = sprite_texture.size
         # Can't use absolute position so it uses a workaround
         hover_x = self.right / Window.width
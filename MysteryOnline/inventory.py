@@ -9,7 +9,6 @@ from kivy.uix.image import AsyncImage
 from kivy.app import App
 from kivy.properties import ObjectProperty
 from kivy.core.audio import SoundLoader
-from MysteryOnline.mopopup import MOPopup
 import webbrowser
 import requests
 import urllib
@@ -199,12 +198,4 @@ class ItemCreator(Popup):
         self.description.pos_hint = {'center_x': 0.5}
 
     def create_item(self, name, description, image_link, user):
-        message_len = len(name) + len(description) + len(image_link) + len(user)
-        if message_len > 420:
-            error_popup = MOPopup("Character limit exceeded", "IRC has a character limit of roughly 500, please make"
-                                                              " sure your item's combined description, name, and image"
-                                                              " link don't exceed it.", "Close")
-            error_popup.size = (900, 200)
-            error_popup.open()
-            return
         self.inventory.add_item(name, description, image_link, user)
@@ -0,0 +1,101 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import irc.client
+import irc.client_aio
+from kivy.logger import Logger
+
+from MysteryOnline.irc_mo import IrcConnection
+
+CONNECT_TIMEOUT = 30
+
+
+class ThreadSafeAioConnection(irc.client_aio.AioConnection):
+    """asyncio transports may only be written to from the loop's thread,
+    so writes coming from the UI thread are scheduled onto the loop.
+    """
+
+    def send_raw(self, string):
+        transport = getattr(self, 'transport', None)
+        # disconnect closes the transport but doesn't clear it
+        if transport is None or transport.is_closing():
+            raise irc.client.ServerNotConnectedError("Not connected.")
+        # Validates the line here so MessageTooLong still reaches the caller
+        data = self._prep_message(string)
+        self.reactor.loop.call_soon_threadsafe(transport.write, data)
+
+
+class ThreadSafeAioReactor(irc.client_aio.AioReactor):
+    connection_class = ThreadSafeAioConnection
+
+
+class AioIrcConnection(IrcConnection):
+    """IrcConnection backed by irc.client_aio.
+
+    The event loop runs on its own thread for the lifetime of the connection, the
+    handlers keep the same surface as the Reactor backend and hand their results to
+    the UI through dispatch. Blocking work submitted with run_background shares the
+    loop's executor instead of getting a thread of its own.
+    """
+
+    def __init__(self, *args, **kwargs):
+        self.loop = None
+        self.loop_thread = None
+        self.executor = ThreadPoolExecutor(thread_name_prefix="mo-background")
+        kwargs['threaded'] = True
+        super(AioIrcConnection, self).__init__(*args, **kwargs)
+
+    def create_reactor(self):
+        self.loop = asyncio.new_event_loop()
+        self.loop.set_default_executor(self.executor)
+        self.loop_thread = threading.Thread(target=self.run_loop, name="irc-asyncio", daemon=True)
+        self.loop_thread.start()
+        return ThreadSafeAioReactor(loop=self.loop)
+
+    def run_loop(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    def connect(self, port):
+        connection = self.reactor.server()
+        return self.run_coroutine(connection.connect(self.server, port, self.username))
+
+    def reconnect(self):
+        self.rejoining = True
+        self.run_coroutine(self.connection.connect(self.server, self.port, self.username))
+
+    def close(self, message=""):
+        self.loop.call_soon_threadsafe(self.connection.disconnect, message)
+
+    def run_coroutine(self, coroutine):
+        """Runs coroutine on the loop and waits for it, connection failures come out as ServerConnectionError."""
+        future = asyncio.run_coroutine_threadsafe(coroutine, self.loop)
+        try:
+            return future.result(CONNECT_TIMEOUT)
+        except (OSError, asyncio.TimeoutError) as e:
+            raise irc.client.ServerConnectionError(str(e))
+
+    def process(self):
+        pass
+
+    def start_network_thread(self):
+        # The loop has been running since the reactor was created
+        self.running = True
+
+    def stop_network_thread(self):
+        self.running = False
+        self.loop.call_soon_threadsafe(self.loop.stop)
+
+    def run_on_network(self, func, *args):
+        self.loop.call_soon_threadsafe(func, *args)
+
+    def run_background(self, func, *args):
+        # Same pool the loop uses for run_in_executor
+        future = self.executor.submit(func, *args)
+        future.add_done_callback(self.log_background_error)
+
+    @staticmethod
+    def log_background_error(future):
+        if not future.cancelled() and future.exception() is not None:
+            Logger.warning('IRC: Background task failed: {}'.format(future.exception()))
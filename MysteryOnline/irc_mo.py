@@ -1,36 +1,44 @@
+import random
+import sys
+import threading
+import time
 import traceback
+from collections import deque
+from functools import partial
+from typing import TYPE_CHECKING
 
 import irc.client
-from MysteryOnline.mopopup import MOPopup
-from kivy.uix.textinput import TextInput
+import irc.strings
 from kivy.app import App
 from kivy.logger import Logger
 from kivy.clock import Clock
-from kivy.core.window import Window
 from kivy.utils import platform
-
-from MysteryOnline.character import characters
-from MysteryOnline.user import User
-from MysteryOnline.choice import ChoicePopup
 import re
 
-from MysteryOnline.mainscreen import MainScreen
-from MysteryOnline.user import CurrentUserHandler
+from MysteryOnline.codec import MessageCodec, PeerCapabilities, DeltaEncoder, DeltaState, FRAGMENTS, DELTA, \
+    ROOMS, SNAPSHOT, CAPABILITIES, encode_hello, decode_hello, decode_snapshot
+from MysteryOnline.fragment import Fragmenter, Reassembler, is_fragment
+from MysteryOnline.latency import LatencyTracker
+from MysteryOnline.prefetch import sprite_prefetcher
+from MysteryOnline.traffic import RECEIVED, SENT, PRIVATE_RECEIVED, PRIVATE_SENT
+from MysteryOnline.exceptions import IncorrectMessageTypeError, MessageTooLongError
 from jaraco.stream import buffer
 
-
-class ChannelConnectionError(Exception):
-    pass
+# Modules that need a window are imported where they're used, so the state keeper can run headless
+if TYPE_CHECKING:
+    from MysteryOnline.mainscreen import MainScreen
+    from MysteryOnline.user import CurrentUserHandler
 
 
-class IncorrectMessageTypeError(Exception):
+class ChannelConnectionError(Exception):
     pass
 
 
 class MessageFactory:
 
     def __init__(self):
-        pass
+        # Last known state of each sender, to rebuild delta encoded messages from
+        self.deltas = DeltaState()
 
     def build_chat_message(self, **kwargs):
         username = kwargs.get('username', None)
@@ -89,41 +97,88 @@ class MessageFactory:
         return result
 
     def build_from_irc(self, irc_message, username):
-        if irc_message.count('#') >= 8:
-            result = ChatMessage(username)
-        elif irc_message.startswith("sc#"):
-            result = IconMessage(username)
-        elif irc_message.startswith('c#'):
-            result = CharacterMessage(username)
-        elif irc_message.startswith('LOOC#'):
-            result = LOOCMessage(username)
-        elif irc_message.startswith('OOC#'):
-            result = OOCMessage(username)
-        elif irc_message.startswith('m#'):
-            result = MusicMessage(username)
-        elif irc_message.startswith('l#'):
-            result = LocationMessage(username)
-        elif irc_message.startswith('r#'):
-            result = RollMessage(username)
-        elif irc_message.startswith('i#'):
-            result = ItemMessage(username)
-        elif irc_message.startswith('cl#'):
-            result = ClearMessage(username)
-        elif irc_message.startswith('ch#'):
-            result = ChoiceMessage(username)
-        elif irc_message.startswith('ch2#'):
-            result = ChoiceReturnMessage(username)
-        else:
-            result = OOCMessage(username)
-        result.from_irc(irc_message)
+        schema, values = message_codec.decode(irc_message)
+        if schema.delta is not None or schema.base is not None:
+            schema, values = self.deltas.update(username, schema, values)
+        # Received messages get every attribute from set_fields, so __init__ and its defaults are skipped
+        message_type = schema.message_type
+        result = message_type.__new__(message_type)
+        result.sender = username
+        result.set_fields(values)
         return result
 
+    def forget_sender(self, username):
+        self.deltas.forget(username)
+
+
+class IrcMessage:
+    """Base for everything sent over the channel.
+
+    Subclasses describe their wire layout with prefix and fields, and convert
+    themselves to and from the raw field values with get_fields/set_fields.
+    Messages are created by the thousand, so every subclass lists its attributes
+    in __slots__. Once they pile up in a backlog, the fields in interned_fields
+    of the queued ones share one string per value.
+    """
+
+    __slots__ = ('sender',)
+
+    prefix = None
+    fields = ()
+    required_fields = None
+    # Types with a delta_prefix can also be sent with their unchanged leading fields left out,
+    # the last volatile_fields are always sent
+    delta_prefix = None
+    volatile_fields = 0
+    interned_fields = ()
+    schema = None
+    lane = 'control'
+    # Only the newest queued message of a coalescing type is sent, and only the newest per sender is executed
+    coalesce = False
+    # Only matters to users in the sender's location, goes to its location channel when those are in use
+    location_scoped = False
+    # Changes the sender's state, so it's never executed ahead of chat they sent before it
+    follows_chat = False
+    # What the user is told couldn't be sent when it's too long
+    description = 'message'
+
+    def get_fields(self):
+        raise NotImplementedError
+
+    def set_fields(self, values):
+        raise NotImplementedError
+
+    def intern_fields(self):
+        for name in self.interned_fields:
+            value = getattr(self, name)
+            if isinstance(value, str):
+                setattr(self, name, sys.intern(value))
 
-class ChatMessage:
+    def to_irc(self):
+        return message_codec.encode(self.schema, self.get_fields())
+
+    def from_irc(self, message):
+        schema, values = message_codec.decode(message)
+        if schema is not self.schema:
+            raise IncorrectMessageTypeError(message)
+        self.set_fields(values)
+
+
+class ChatMessage(IrcMessage):
+
+    __slots__ = ('location', 'sublocation', 'character', 'sprite', 'position', 'color_id', 'sprite_option', 'sfx_name',
+                 'content')
+    interned_fields = ('location', 'sublocation', 'character', 'sprite', 'position', 'color_id', 'sprite_option',
+                       'sfx_name')
+    lane = 'chat'
+    location_scoped = True
+    delta_prefix = 'dc'
+    volatile_fields = 2
+    fields = ('location', 'sublocation', 'character', 'sprite', 'position', 'color_id', 'sprite_option',
+              'sfx_name', 'content')
 
     def __init__(self, sender, **kwargs):
         # TODO Try to reduce the number of arguments
-        self.components = kwargs
         self.sender = sender
         self.content = kwargs.get('content')
         self.location = kwargs.get('location')
@@ -143,17 +198,16 @@ class ChatMessage:
             self.content = self.content.replace('\n', ' ')
             self.content = self.content.replace('\r', ' ')
 
-    def to_irc(self):
-        if self.components['sfx_name'] is None:
-            self.components['sfx_name'] = '0'
-        msg = "{0[location]}#{0[sublocation]}#{0[character]}#{0[sprite]}#" \
-              "{0[position]}#{0[color_id]}#{0[sprite_option]}#{0[sfx_name]}#{0[content]}".format(self.components)
-        return msg
+    def get_fields(self):
+        sfx_name = self.sfx_name
+        if sfx_name is None:
+            sfx_name = '0'
+        return [str(self.location), str(self.sublocation), str(self.character), str(self.sprite),
+                str(self.position), str(self.color_id), str(self.sprite_option), str(sfx_name), str(self.content)]
 
-    def from_irc(self, message):
-        arguments = tuple(message.split('#', 8))
+    def set_fields(self, values):
         self.location, self.sublocation, self.character, self.sprite, self.position, \
-            self.color_id, self.sprite_option, self.sfx_name, self.content = arguments
+            self.color_id, self.sprite_option, self.sfx_name, self.content = values
         if self.sfx_name == '0':
             self.sfx_name = None
 
@@ -165,7 +219,7 @@ class ChatMessage:
         if username == "default":
             user = App.get_running_app().get_user()
         else:
-            connection_manager.reschedule_ping()
+            connection_manager.note_activity()
             user = main_screen.users.get(username, None)
             if user is None:
                 connection_manager.on_join(username)
@@ -199,6 +253,7 @@ class ChatMessage:
 
         if self.need_to_notify(self.content, user_handler.get_user().username):
             App.get_running_app().flash_window()
+            from kivy.core.window import Window
             if not Window.focus:
                 App.get_running_app().notification("Mystery Online", "You've been mentioned by {0}!".format(user.username))
 
@@ -206,10 +261,19 @@ class ChatMessage:
         mention: str = "@{0}".format(username)
         return msg == mention or mention+" " in msg
 
-class IconMessage:
+class IconMessage(IrcMessage):
+
+    __slots__ = ('location', 'sublocation', 'character', 'sprite', 'position', 'sprite_option', 'dance')
+    interned_fields = ('location', 'sublocation', 'character', 'sprite', 'position', 'sprite_option', 'dance')
+    prefix = 'sc'
+    lane = 'icon'
+    coalesce = True
+    follows_chat = True
+    delta_prefix = 'ds'
+    fields = ('location', 'sublocation', 'character', 'sprite', 'position', 'sprite_option', 'dance')
+    required_fields = 6
 
     def __init__(self, sender, **kwargs):
-        self.components = kwargs
         self.sender = sender
         self.location = kwargs.get('location')
         self.sublocation = kwargs.get('sublocation')
@@ -219,23 +283,16 @@ class IconMessage:
         self.sprite_option = kwargs.get('sprite_option')
         self.dance = kwargs.get('dance')
 
-    def to_irc(self):
-        msg = "sc#{0[location]}#{0[sublocation]}#{0[character]}#{0[sprite]}#" \
-              "{0[position]}#{0[sprite_option]}#{0[dance]}".format(self.components)
-        return msg
+    def get_fields(self):
+        return [str(self.location), str(self.sublocation), str(self.character), str(self.sprite),
+                str(self.position), str(self.sprite_option), str(self.dance)]
 
-    def from_irc(self, message):
-        try:
-            arguments = message.split('#', 7)
-            arguments.remove("sc")
-            self.location, self.sublocation, self.character, self.sprite, self.position, \
-            self.sprite_option, self.dance = arguments
-        except ValueError:
-            arguments = message.split('#', 6)
-            arguments.remove("sc")
-            self.location, self.sublocation, self.character, self.sprite, self.position, \
-            self.sprite_option = arguments
-            self.dance = False
+    def set_fields(self, values):
+        if len(values) == 6:
+            # Older clients don't send the dance flag
+            values = values + [False]
+        self.location, self.sublocation, self.character, self.sprite, self.position, \
+            self.sprite_option, self.dance = values
 
     def execute(self, connection_manager, main_screen, user_handler):
         username = self.sender
@@ -243,7 +300,7 @@ class IconMessage:
         if username == "default":
             user = App.get_running_app().get_user()
         else:
-            connection_manager.reschedule_ping()
+            connection_manager.note_activity()
             user = main_screen.users.get(username, None)
             if user is None:
                 connection_manager.on_join(username)
@@ -255,7 +312,7 @@ class IconMessage:
             try:
                 option = int(self.sprite_option)
                 old_subloc = main_screen.sprite_window.subloc
-                if user.get_char().get_sprite(self.sprite).is_cg():
+                if user.get_char().get_sprite(self.sprite, wait=False).is_cg():
                     return # No nullposting for cgs!
                 user.set_sprite_option(option)
                 if username != "default" and user.get_dance() and local_user.get_subloc().name == self.sublocation and local_user.get_dance():
@@ -269,7 +326,11 @@ class IconMessage:
         else:
             main_screen.ooc_window.update_subloc(user.username, self.sublocation)
 
-class ChoiceMessage:
+class ChoiceMessage(IrcMessage):
+
+    __slots__ = ('text', 'options', 'list_of_users')
+    prefix = 'ch'
+    fields = ('text', 'options', 'list_of_users')
 
     def __init__(self, sender, text=None, options=None, list_of_users=None):
         if text is None:
@@ -278,20 +339,16 @@ class ChoiceMessage:
             options = 'Options'
         if list_of_users is None:
             list_of_users = 'everyone'
-        self.components = {'text': text, 'options': options, 'list_of_users': list_of_users}
         self.sender = sender
         self.text = text
         self.options = options
         self.list_of_users = list_of_users
 
-    def to_irc(self):
-        msg = "ch#{0[text]}#{0[options]}#{0[list_of_users]}".format(self.components)
-        return msg
+    def get_fields(self):
+        return [str(self.text), str(self.options), str(self.list_of_users)]
 
-    def from_irc(self, message):
-        arguments = message.split('#', 3)
-        arguments.remove('ch')
-        self.text, self.options, self.list_of_users = arguments
+    def set_fields(self, values):
+        self.text, self.options, self.list_of_users = values
 
     def execute(self, connection_manager, main_screen, user_handler):
         user = user_handler.get_user()
@@ -306,6 +363,7 @@ class ChoiceMessage:
         except KeyError:
             pass
         self.list_of_users = self.list_of_users.replace('@', '')
+        from MysteryOnline.choice import ChoicePopup
         if user.has_choice_popup:
             ChoicePopup('', self.sender, self.text, options, user_handler.get_user())
         elif self.list_of_users != 'everyone':
@@ -319,23 +377,23 @@ class ChoiceMessage:
         log.add_entry(self.sender+' gave '+self.list_of_users+' a choice.\n')
 
 
-class ChoiceReturnMessage:
+class ChoiceReturnMessage(IrcMessage):
+
+    __slots__ = ('questioner', 'whisper', 'selected_option')
+    prefix = 'ch2'
+    fields = ('questioner', 'whisper', 'selected_option')
 
     def __init__(self, sender, questioner=None, whisper=False, selected_option=None):
-        self.components = {'questioner': questioner, 'whisper': whisper, 'selected_option': selected_option}
         self.questioner = questioner
         self.whisper = whisper
         self.selected_option = selected_option
         self.sender = sender
 
-    def to_irc(self):
-        msg = "ch2#{0[questioner]}#{0[whisper]}#{0[selected_option]}".format(self.components)
-        return msg
+    def get_fields(self):
+        return [str(self.questioner), str(self.whisper), str(self.selected_option)]
 
-    def from_irc(self, message):
-        arguments = message.split('#')
-        arguments.remove('ch2')
-        self.questioner, self.whisper, self.selected_option = arguments
+    def set_fields(self, values):
+        self.questioner, self.whisper, self.selected_option = values
 
     def execute(self, connection_manager, main_screen, user_handler):
         log = main_screen.log_window
@@ -354,7 +412,15 @@ class ChoiceReturnMessage:
                 user_handler.send_message(self.selected_option)
 
 
-class CharacterMessage:
+class CharacterMessage(IrcMessage):
+
+    __slots__ = ('character', 'character_link', 'version')
+    interned_fields = ('character',)
+    prefix = 'c'
+    coalesce = True
+    follows_chat = True
+    fields = ('character', 'link', 'version')
+    required_fields = 1
 
     def __init__(self, sender, character=None, link=None, version=None):
         self.sender = sender
@@ -362,17 +428,17 @@ class CharacterMessage:
         self.character_link = link
         self.version = version
 
-    def to_irc(self):
-        msg = "c#{0}#{1}#{2}".format(self.character, self.character_link, self.version)
-        return msg
+    def get_fields(self):
+        return [str(self.character), str(self.character_link), str(self.version)]
 
-    def from_irc(self, message):
-        arguments = message.split('#', 3)
-        self.character = arguments[1]
-        if len(arguments) > 2: #If it works...
-            self.character_link = arguments[2]
-        if len(arguments) > 3:
-            self.version = arguments[3]
+    def set_fields(self, values):
+        self.character = values[0]
+        if len(values) > 1:
+            self.character_link = values[1]
+        else:
+            self.character_link = None
+        if len(values) > 2:
+            self.version = values[2]
         else:
             self.version = ''
 
@@ -380,21 +446,27 @@ class CharacterMessage:
         connection_manager.update_char(main_screen, self.character, self.sender, self.character_link, self.version)
 
 
-class LocationMessage:
+class LocationMessage(IrcMessage):
+
+    __slots__ = ('location',)
+    interned_fields = ('location',)
+    prefix = 'l'
+    coalesce = True
+    follows_chat = True
+    fields = ('location',)
 
     def __init__(self, sender, location=None):
         self.sender = sender
         self.location = location
 
-    def to_irc(self):
-        msg = "l#{0}".format(self.location)
-        return msg
+    def get_fields(self):
+        return [str(self.location)]
 
-    def from_irc(self, message):
-        arguments = message.split('#', 1)
-        self.location = arguments[1]
+    def set_fields(self, values):
+        self.location, = values
 
-    def execute(self, connection_manager, main_screen, user_handler: CurrentUserHandler):
+    def execute(self, connection_manager, main_screen, user_handler: 'CurrentUserHandler'):
+        from MysteryOnline.user import User
         username = self.sender
         loc = self.location
         if username not in main_screen.users:
@@ -412,9 +484,15 @@ class LocationMessage:
             main_screen.ooc_window.update_subloc(user.username, "Missingno")
         user.set_loc(loc, True)
         main_screen.ooc_window.update_loc(user.username, loc)
+        connection_manager.prefetch_sprites(user)
         main_screen.sprite_window.refresh_sub()
 
-class OOCMessage:
+class OOCMessage(IrcMessage):
+
+    __slots__ = ('content',)
+    prefix = 'OOC'
+    lane = 'ooc'
+    fields = ('content',)
 
     def __init__(self, sender, content=None):
         self.sender = sender
@@ -428,23 +506,24 @@ class OOCMessage:
             self.content = self.content.replace('\n', ' ')
             self.content = self.content.replace('\r', ' ')
 
-    def to_irc(self):
-        msg = "OOC#{0}".format(self.content)
-        return msg
-
-    def from_irc(self, message):
-        try:
-            arguments = message.split('#', 1)
-            self.content = arguments[1]
-        except IndexError:
-            self.content = message
+    def get_fields(self):
+        return [str(self.content)]
 
+    def set_fields(self, values):
+        self.content, = values
         self.remove_line_breaks()
 
     def execute(self, connection_manager, main_screen, user_handler):
         main_screen.ooc_window.update_ooc(self.content, self.sender)
 
-class LOOCMessage:
+class LOOCMessage(IrcMessage):
+
+    __slots__ = ('location', 'content')
+    interned_fields = ('location',)
+    prefix = 'LOOC'
+    lane = 'ooc'
+    location_scoped = True
+    fields = ('location', 'content')
 
     def __init__(self, sender, location=None, content=None):
         self.sender = sender
@@ -459,26 +538,19 @@ class LOOCMessage:
             self.content = self.content.replace('\n', ' ')
             self.content = self.content.replace('\r', ' ')
 
-    def to_irc(self):
-        msg = "LOOC#{0}#{1}".format(self.location, self.content)
-        return msg
-
-    def from_irc(self, message):
-        try:
-            arguments = message.split('#', 2)
-            self.location = arguments[1]
-            self.content = arguments[2]
-        except IndexError:
-            self.content = message
+    def get_fields(self):
+        return [str(self.location), str(self.content)]
 
+    def set_fields(self, values):
+        self.location, self.content = values
         self.remove_line_breaks()
 
-    def execute(self, connection_manager, main_screen, user_handler: CurrentUserHandler):
+    def execute(self, connection_manager, main_screen, user_handler: 'CurrentUserHandler'):
         username = self.sender
         if username == "default":
             user = App.get_running_app().get_user()
         else:
-            connection_manager.reschedule_ping()
+            connection_manager.note_activity()
             user = main_screen.users.get(username, None)
             if user is None:
                 connection_manager.on_join(username)
@@ -487,29 +559,35 @@ class LOOCMessage:
             main_screen.ooc_window.update_ooc(self.content, self.sender, True)
 
 
-class MusicMessage:
+class MusicMessage(IrcMessage):
+
+    __slots__ = ('track_name', 'url')
+    prefix = 'm'
+    description = 'music link'
+    fields = ('track_name', 'url')
+    required_fields = 1
 
     def __init__(self, sender, track_name=None, url=None):
         self.sender = sender
         self.track_name = track_name
         self.url = url
 
-    def to_irc(self):
-        if self.track_name is None:
-            self.track_name = "0"
-        if self.url is None:
-            self.url = "0"
-        msg = "m#{0}#{1}".format(self.track_name, self.url)
-        return msg
-
-    def from_irc(self, message):
-        arguments = message.split('#', 2)
-        self.track_name = arguments[1]
+    def get_fields(self):
+        track_name = self.track_name
+        if track_name is None:
+            track_name = "0"
+        url = self.url
+        if url is None:
+            url = "0"
+        return [str(track_name), str(url)]
+
+    def set_fields(self, values):
+        self.track_name = values[0]
         if self.track_name == "0":
             self.track_name = None
-        try:
-            self.url = arguments[2]
-        except IndexError:
+        if len(values) > 1:
+            self.url = values[1]
+        else:
             self.url = None
         if self.url == "0":
             self.url = None
@@ -531,19 +609,21 @@ class MusicMessage:
                                                            self.track_name)
 
 
-class RollMessage:
+class RollMessage(IrcMessage):
+
+    __slots__ = ('roll',)
+    prefix = 'r'
+    fields = ('roll',)
 
     def __init__(self, sender, roll=None):
         self.sender = sender
         self.roll = roll
 
-    def to_irc(self):
-        msg = "r#{0}".format(self.roll)
-        return msg
+    def get_fields(self):
+        return [str(self.roll)]
 
-    def from_irc(self, message):
-        arguments = message.split('#', 1)
-        self.roll = arguments[1]
+    def set_fields(self, values):
+        self.roll, = values
 
     def execute(self, connection_manager, main_screen, user_handler):
         username = self.sender
@@ -556,7 +636,12 @@ class RollMessage:
         main_screen.log_window.add_entry("{} rolled {}.\n".format(username, self.roll))
 
 
-class ItemMessage:
+class ItemMessage(IrcMessage):
+
+    __slots__ = ('item',)
+    prefix = 'i'
+    description = 'item'
+    fields = ('item',)
 
     def __init__(self, sender, item=None):
         self.sender = sender
@@ -570,13 +655,11 @@ class ItemMessage:
             self.item = self.item.replace('\n', ' ')
             self.item = self.item.replace('\r', ' ')
 
-    def to_irc(self):
-        msg = "i#{0}".format(self.item)
-        return msg
+    def get_fields(self):
+        return [str(self.item)]
 
-    def from_irc(self, message):
-        arguments = message.split('#', 1)
-        self.item = arguments[1]
+    def set_fields(self, values):
+        self.item, = values
 
     def execute(self, connection_manager, main_screen, user_handler):
         item_string = self.item
@@ -595,19 +678,23 @@ class ItemMessage:
         main_screen.log_window.add_entry("{} presented {}{}.\n".format(username, dcdi[0], entry_text))
 
 
-class ClearMessage:
+class ClearMessage(IrcMessage):
+
+    __slots__ = ('location',)
+    interned_fields = ('location',)
+    prefix = 'cl'
+    fields = ('location',)
+    follows_chat = True
 
     def __init__(self, sender, location=None):
         self.sender = sender
         self.location = location
 
-    def to_irc(self):
-        msg = "cl#{0}".format(self.location)
-        return msg
+    def get_fields(self):
+        return [str(self.location)]
 
-    def from_irc(self, message):
-        arguments = message.split('#', 1)
-        self.location = arguments[1]
+    def set_fields(self, values):
+        self.location, = values
 
     def execute(self, connection_manager, main_screen, user_handler):
         # TODO Make it work only for the person who is currently speaking
@@ -620,27 +707,281 @@ class ClearMessage:
             return None
 
 
+message_codec = MessageCodec()
+for message_class in (ChatMessage, IconMessage, ChoiceMessage, ChoiceReturnMessage, CharacterMessage,
+                      LocationMessage, OOCMessage, LOOCMessage, MusicMessage, RollMessage, ItemMessage, ClearMessage):
+    message_class.schema = message_codec.register(message_class, message_class.prefix, message_class.fields,
+                                                  message_class.required_fields)
+    if message_class.delta_prefix is not None:
+        message_codec.register_delta(message_class.schema, message_class.delta_prefix, message_class.volatile_fields)
+# Lines that don't look like any known message are shown as OOC
+message_codec.set_fallback(OOCMessage.prefix)
+# What a state keeper hands out, each user's location first so the rest applies to the right place
+SNAPSHOT_TYPES = (LocationMessage, CharacterMessage, IconMessage)
+SNAPSHOT_PREFIXES = frozenset(message_type.prefix for message_type in SNAPSHOT_TYPES)
+
+
 class MessageQueue:
-    """Standard First-In-First-Out queue for irc messages.
+    """First-In-First-Out queue for irc messages, split into priority lanes.
+
+    Control messages are served first, then OOC/LOOC, nullposts and finally IC chat,
+    so a backlog of chat waiting on the text box doesn't hold up anything else.
+    Messages that follow chat are held back while chat their sender sent before them
+    is still queued, as that chat would otherwise put back the sender's older state.
+    Each lane holds at most max_depth messages (0 means unbounded); on overflow
+    either the oldest queued message or the incoming one is dropped.
+    A coalescing message is skipped when a newer one of the same type from the same
+    sender is queued behind it.
+    Interning costs more than decoding, so it's only done for messages queued behind
+    at least share_depth others, which are the ones that stay around.
     """
 
-    def __init__(self):
-        self.messages = []
+    LANES = ('control', 'ooc', 'icon', 'chat')
+    NON_CHAT_LANES = ('control', 'ooc', 'icon')
+    DROP_OLDEST = 'drop_oldest'
+    DROP_NEWEST = 'drop_newest'
+    SHARE_DEPTH = 16
+
+    def __init__(self, max_depth=500, overflow=DROP_OLDEST, share_depth=SHARE_DEPTH):
+        if overflow not in (self.DROP_OLDEST, self.DROP_NEWEST):
+            raise ValueError("Unknown overflow policy: {}".format(overflow))
+        self.max_depth = max_depth
+        self.overflow = overflow
+        self.share_depth = share_depth
+        self.lanes = {lane: deque() for lane in self.LANES}
+        self.enqueued = dict.fromkeys(self.LANES, 0)
+        self.dropped = dict.fromkeys(self.LANES, 0)
+        self.high_water = dict.fromkeys(self.LANES, 0)
+        self.elided = dict.fromkeys(self.LANES, 0)
+        self.latest = {}
+        # sender -> how many of their chat messages have been queued and taken out so far
+        self.chat_queued = {}
+        self.chat_taken = {}
+        # sender -> (chat count to wait for, message) for messages held behind their chat
+        self.held = {}
 
     def is_empty(self):
-        return self.messages == []
+        return not any(self.lanes.values()) and not self.held
 
     def enqueue(self, msg):
-        self.messages.insert(0, msg)
+        lane = msg.lane
+        messages = self.lanes[lane]
+        if self.max_depth and len(messages) >= self.max_depth:
+            self.dropped[lane] += 1
+            if self.overflow == self.DROP_NEWEST:
+                return
+            self.note_taken(messages.popleft())
+        if len(messages) >= self.share_depth:
+            msg.intern_fields()
+        sender = msg.sender
+        if lane == 'chat':
+            self.chat_queued[sender] = self.chat_queued.get(sender, 0) + 1
+        if msg.follows_chat and self.chat_taken.get(sender, 0) < self.chat_queued.get(sender, 0):
+            self.held.setdefault(sender, deque()).append((self.chat_queued[sender], msg))
+        else:
+            messages.append(msg)
+        if msg.coalesce:
+            self.latest[(type(msg), sender)] = msg
+        self.enqueued[lane] += 1
+        if len(messages) > self.high_water[lane]:
+            self.high_water[lane] = len(messages)
+
+    def put_back(self, msg):
+        """Returns a message to the head of its lane, e.g. when it can't be displayed yet."""
+        self.lanes[msg.lane].appendleft(msg)
+        if msg.lane == 'chat':
+            sender = msg.sender
+            taken = self.chat_taken.get(sender, 0)
+            if taken:
+                self.chat_taken[sender] = taken - 1
+            else:
+                # Their counts were started afresh when it was taken, count it as queued again
+                # ahead of everything they queued since
+                self.chat_queued[sender] = self.chat_queued.get(sender, 0) + 1
+                if sender in self.held:
+                    self.held[sender] = deque((count + 1, held) for count, held in self.held[sender])
+        if msg.coalesce:
+            self.latest.setdefault((type(msg), msg.sender), msg)
+
+    def note_taken(self, msg):
+        if msg.lane != 'chat':
+            return
+        sender = msg.sender
+        taken = self.chat_taken.get(sender, 0) + 1
+        if taken == self.chat_queued.get(sender, 0) and sender not in self.held:
+            # Nothing of theirs is waiting, start counting afresh
+            self.chat_queued.pop(sender, None)
+            self.chat_taken.pop(sender, None)
+        else:
+            self.chat_taken[sender] = taken
+
+    def is_superseded(self, msg):
+        """True for a coalescing message with a newer one of its kind queued behind it."""
+        if not msg.coalesce:
+            return False
+        key = (type(msg), msg.sender)
+        latest = self.latest.get(key)
+        if latest is not None and latest is not msg:
+            self.elided[msg.lane] += 1
+            return True
+        self.latest.pop(key, None)
+        return False
+
+    def is_released(self, sender, lanes):
+        chat_count, msg = self.held[sender][0]
+        return msg.lane in lanes and self.chat_taken.get(sender, 0) >= chat_count
+
+    def dequeue_held(self, lanes):
+        for sender in list(self.held):
+            while sender in self.held and self.is_released(sender, lanes):
+                held = self.held[sender]
+                msg = held.popleft()[1]
+                if not held:
+                    del self.held[sender]
+                if not self.is_superseded(msg):
+                    return msg
+        return None
+
+    def dequeue(self, lanes=LANES):
+        # Held messages go first, right after the chat they were waiting for
+        msg = self.dequeue_held(lanes)
+        if msg is not None:
+            return msg
+        for lane in lanes:
+            messages = self.lanes[lane]
+            while messages:
+                msg = messages.popleft()
+                if not self.is_superseded(msg):
+                    self.note_taken(msg)
+                    return msg
+        return None
+
+    def count_held(self, lane):
+        return sum(1 for held in self.held.values() for _, msg in held if msg.lane == lane)
+
+    def size(self, lane=None):
+        if lane is not None:
+            return len(self.lanes[lane]) + self.count_held(lane)
+        return sum(len(messages) for messages in self.lanes.values()) + sum(len(held) for held in self.held.values())
+
+    def has_messages(self, lanes=LANES):
+        return any(self.lanes[lane] for lane in lanes) or any(self.is_released(sender, lanes) for sender in self.held)
+
+    def get_stats(self):
+        return {lane: {'depth': self.size(lane), 'enqueued': self.enqueued[lane],
+                       'dropped': self.dropped[lane], 'high_water': self.high_water[lane],
+                       'elided': self.elided[lane]}
+                for lane in self.LANES}
+
+
+class TokenBucket:
+    """Allows rate sends per second on average and bursts of up to burst sends.
+    A rate of 0 disables the limit.
+    """
 
-    def dequeue(self):
-        try:
-            return self.messages.pop()
-        except IndexError:
-            return None
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self.tokens = self.burst
+        self.last_refill = time.monotonic()
+
+    def refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.last_refill) * self.rate)
+        self.last_refill = now
+
+    def take(self):
+        if self.rate <= 0:
+            return True
+        self.refill()
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+    def spend(self, count):
+        """Charges for sends that went out without asking, e.g. the extra fragments of a long message."""
+        if self.rate > 0:
+            self.tokens -= count
+
+    def wait_time(self):
+        """Seconds until the next token is available."""
+        if self.rate <= 0:
+            return 0
+        self.refill()
+        if self.tokens >= 1:
+            return 0
+        return (1 - self.tokens) / self.rate
+
+
+class OutboundQueue:
+    """First-In-First-Out queue for messages waiting on the rate limiter.
+
+    A message whose class sets coalesce supersedes the queued message of the same class,
+    which is then skipped instead of sent. Entries are [msg, args, time queued].
+    """
 
-    def size(self):
-        return len(self.messages)
+    def __init__(self):
+        self.entries = deque()
+        self.pending = {}
+        self.live = 0
+        self.sent = 0
+        self.coalesced = 0
+        self.high_water = 0
+        self.total_latency = 0.0
+        self.max_latency = 0.0
+
+    def is_empty(self):
+        return self.live == 0
+
+    def put(self, msg, args=()):
+        entry = [msg, args, time.monotonic()]
+        if msg.coalesce:
+            superseded = self.pending.get(type(msg))
+            if superseded is not None:
+                superseded[0] = None
+                self.live -= 1
+                self.coalesced += 1
+            self.pending[type(msg)] = entry
+        self.entries.append(entry)
+        self.live += 1
+        if self.live > self.high_water:
+            self.high_water = self.live
+
+    def put_back(self, entry):
+        """Returns an entry that couldn't be sent to the head of the queue, unless it's been superseded."""
+        msg = entry[0]
+        if msg.coalesce:
+            if type(msg) in self.pending:
+                self.coalesced += 1
+                return
+            self.pending[type(msg)] = entry
+        self.entries.appendleft(entry)
+        self.live += 1
+
+    def get(self):
+        while self.entries:
+            entry = self.entries.popleft()
+            msg = entry[0]
+            if msg is None:
+                continue
+            self.live -= 1
+            if self.pending.get(type(msg)) is entry:
+                del self.pending[type(msg)]
+            return entry
+        return None
+
+    def record_sent(self, entry):
+        latency = time.monotonic() - entry[2]
+        self.sent += 1
+        self.total_latency += latency
+        if latency > self.max_latency:
+            self.max_latency = latency
+
+    def get_stats(self):
+        average = self.total_latency / self.sent if self.sent else 0.0
+        return {'depth': self.live, 'sent': self.sent, 'coalesced': self.coalesced, 'high_water': self.high_water,
+                'avg_latency_ms': average * 1000, 'max_latency_ms': self.max_latency * 1000}
 
 
 class PrivateMessage:
@@ -657,37 +998,108 @@ class PrivateConversation:
 
 
 class PrivateMessageQueue:
-    """Standard First-In-First-Out queue for irc messages.
+    """First-In-First-Out queue for private messages, bounded like MessageQueue.
     """
-    def __init__(self):
-        self.private_messages = []
+    def __init__(self, max_depth=500, overflow=MessageQueue.DROP_OLDEST):
+        self.max_depth = max_depth
+        self.overflow = overflow
+        self.private_messages = deque()
+        self.enqueued = 0
+        self.dropped = 0
+        self.high_water = 0
 
     def enqueue(self, msg, sender):
         message = PrivateMessage(msg, sender, "no")
-        self.private_messages.insert(0, message)
+        self.put(message)
+
+    def put(self, message):
+        if self.max_depth and len(self.private_messages) >= self.max_depth:
+            self.dropped += 1
+            if self.overflow == MessageQueue.DROP_NEWEST:
+                return
+            self.private_messages.popleft()
+        self.private_messages.append(message)
+        self.enqueued += 1
+        if len(self.private_messages) > self.high_water:
+            self.high_water = len(self.private_messages)
 
     def dequeue(self):
         try:
-            return self.private_messages.pop()
+            return self.private_messages.popleft()
         except IndexError:
             return None
 
+    def size(self):
+        return len(self.private_messages)
+
+    def get_stats(self):
+        return {'depth': len(self.private_messages), 'enqueued': self.enqueued,
+                'dropped': self.dropped, 'high_water': self.high_water}
+
+
+# Common CHANNELLEN limit
+MAX_CHANNEL_LENGTH = 50
+
+
+def location_channel_name(channel, location_name):
+    """The channel for IC and LOOC in a location, e.g. '##mysteryonline-mansion_hall' for 'Mansion Hall'."""
+    slug = re.sub(r'[^0-9a-z]+', '_', location_name.lower()).strip('_')
+    return "{}-{}".format(channel, slug)[:MAX_CHANNEL_LENGTH]
+
 
 class IrcConnection:
 
-    def __init__(self, server, port, channel, username, password=None):
+    def __init__(self, server, port, channel, username, password=None, queue_depth=500,
+                 queue_overflow=MessageQueue.DROP_OLDEST, threaded=False, recorder=None, location_channels=False,
+                 state_keeper=None):
         irc.client.ServerConnection.buffer_class = buffer.LenientDecodingLineBuffer
-        self.reactor = irc.client.Reactor()
+        self.reactor = self.create_reactor()
         self.username = username
         self.server = server
+        self.port = port
         self.channel = channel
         self._joined = False
-        self.msg_q = MessageQueue()
-        self.p_msg_q = PrivateMessageQueue()
+        self.rejoining = False
+        self.msg_q = MessageQueue(queue_depth, queue_overflow)
+        self.p_msg_q = PrivateMessageQueue(queue_depth, queue_overflow)
         self.on_join_handler = None
         self.on_users_handler = None
         self.on_disconnect_handler = None
+        self.on_connected_handler = None
+        self.on_private_message_handler = None
         self.connection_manager = None
+        # Private messages are delivered when they arrive instead of being polled for every frame
+        self.private_message_trigger = Clock.create_trigger(self.deliver_private_messages)
+        # In threaded mode the reactor runs on its own thread and everything that
+        # touches the UI is handed over through self.incoming
+        self.threaded = threaded
+        self.network_thread = None
+        self.running = False
+        self.incoming = deque()
+        self.incoming_trigger = Clock.create_trigger(self.process_incoming)
+        self.message_factory = MessageFactory()
+        # Lines over the IRC limit go out as fragments and are put back together on arrival
+        self.fragmenter = Fragmenter()
+        self.reassembler = Reassembler()
+        self.private_reassembler = Reassembler()
+        # Optional TrafficRecorder that gets every raw line, muted drops outgoing lines during a replay
+        self.recorder = recorder
+        self.muted = False
+        # In location channel mode we also sit in the channel of our current location, IC and LOOC
+        # go there once everyone in the main channel does the same
+        self.location_channels = location_channels
+        self.location_name = None
+        self.location_channel = None
+        self.capabilities = CAPABILITIES + (ROOMS,) if location_channels else CAPABILITIES
+        # Filled in from the other members' capability announcements
+        self.peers = PeerCapabilities(self.capabilities)
+        # Only this nick is taken in as a state keeper, as a snapshot speaks for other users
+        self.state_keeper = state_keeper or None
+        # Whether the state keeper is here and announced itself, and who else is in the main channel,
+        # tracked on the network thread that takes the snapshots in
+        self.snapshot_providers = set()
+        self.members = set()
+        self.delta_encoder = DeltaEncoder(message_codec)
 
         if password is not None:
             if not password.strip():
@@ -695,44 +1107,144 @@ class IrcConnection:
 
         self.password = password
 
+        # Handlers go in before connecting, a backend with its own thread may see the welcome right away
+        events = ["welcome", "join", "quit", "pubmsg", "nicknameinuse", "namreply", "endofnames", "privnotice",
+                  "privmsg", "pong", "disconnect", "pubnotice"]
+        for e in events:
+            self.reactor.add_global_handler(e, getattr(self, "on_" + e))
+
         try:
-            self.connection = self.reactor.server().connect(self.server, port, username)
+            self.connection = self.connect(port)
         except irc.client.ServerConnectionError:
             Logger.warning('IRC: Could not connect to server')
             raise
 
-        events = ["welcome", "join", "quit", "pubmsg", "nicknameinuse", "namreply", "privnotice", "privmsg", "pong"]
-        for e in events:
-            self.connection.add_global_handler(e, getattr(self, "on_" + e))
+    def create_reactor(self):
+        return irc.client.Reactor()
+
+    def connect(self, port):
+        return self.reactor.server().connect(self.server, port, self.username)
+
+    def reconnect(self):
+        """Blocking, reopens the connection with the arguments it was first made with.
+        Called from a background thread, so the socket is replaced while holding the reactor's lock.
+        """
+        self.rejoining = True
+        with self.reactor.mutex:
+            self.connection.reconnect()
+
+    def close(self, message=""):
+        with self.reactor.mutex:
+            self.connection.disconnect(message)
 
     def set_connection_manager(self, connection_manager):
         self.connection_manager = connection_manager
 
-    def get_msg(self):
-        return self.msg_q.dequeue()
+    def get_msg(self, lanes=MessageQueue.LANES):
+        return self.msg_q.dequeue(lanes)
+
+    def has_msg(self, lanes=MessageQueue.LANES):
+        return self.msg_q.has_messages(lanes)
 
     def put_back_msg(self, msg):
-        self.msg_q.messages.append(msg)
+        self.msg_q.put_back(msg)
 
     def get_pm(self):
         return self.p_msg_q.dequeue()
 
-    def send_msg(self, msg):
+    def put_pm(self, message):
+        self.p_msg_q.put(message)
+        self.private_message_trigger()
+
+    def enqueue_pm(self, msg, sender):
+        self.p_msg_q.enqueue(msg, sender)
+        self.private_message_trigger()
+
+    def deliver_private_messages(self, *args):
+        if self.on_private_message_handler is not None:
+            self.on_private_message_handler()
+
+    def get_queue_stats(self):
+        return {'messages': self.msg_q.get_stats(), 'private_messages': self.p_msg_q.get_stats()}
+
+    def encode_msg(self, msg):
+        """Encodes msg for the channel, as a delta from our previous message of its type if everyone can read that."""
+        if msg.schema.delta is None:
+            return msg.to_irc()
+        return self.delta_encoder.encode(msg.schema, msg.get_fields(), self.peers.channel_supports(DELTA))
+
+    def send_message(self, msg, *args):
+        """Encodes msg and sends it where it belongs. Our delta state only moves on once it has
+        really gone out, not when sending failed or we're muted.
+        """
+        lines = self.send_msg(self.encode_msg(msg), self.get_target(msg), *args)
+        if not self.muted and msg.schema.delta is not None:
+            self.delta_encoder.commit()
+        return lines
+
+    def get_target(self, msg):
+        """The channel msg goes to, its location channel if every member of the main channel is in theirs."""
+        if msg.location_scoped and self.location_channel is not None and self.peers.channel_supports(ROOMS):
+            return self.location_channel
+        return self.channel
+
+    def send_msg(self, msg, target=None):
+        """Sends msg to the channel, or another channel of ours, returns how many lines it took."""
         if '\n' in msg:
-            messages = msg.splitlines()
-            new_msg = ""
-            for m in messages:
-                new_msg = new_msg + m
-            self.connection.privmsg(self.channel, new_msg)
-            return
-        self.connection.privmsg(self.channel, msg)
+            msg = "".join(msg.splitlines())
+        return self.send_lines(target or self.channel, msg)
 
     def send_private_msg(self, receiver, sender, msg):
         pm = PrivateMessage(msg, sender, receiver)
-        self.p_msg_q.private_messages.insert(0, pm)
-        if len(msg) > 480:  # controls the msg length so it doesn't crash
-            msg = (msg[:480] + '..')
-        self.connection.privmsg(receiver, msg)
+        self.put_pm(pm)
+        return self.send_lines(receiver, msg)
+
+    def send_lines(self, target, msg):
+        # Fragments would show up as garbage for anyone who doesn't understand them
+        to_channel = irc.client.is_channel(target)
+        if to_channel:
+            can_fragment = self.peers.channel_supports(FRAGMENTS)
+        else:
+            can_fragment = self.peers.peer_supports(target, FRAGMENTS)
+        if can_fragment:
+            lines = self.fragmenter.split(msg)
+        else:
+            lines = [msg]
+        if self.muted:
+            return len(lines)
+        for line in lines:
+            self.connection.privmsg(target, line)
+            if self.recorder is not None:
+                self.recorder.record(SENT if to_channel else PRIVATE_SENT, target, line)
+        return len(lines)
+
+    def get_fragment_stats(self):
+        return {'channel': self.reassembler.get_stats(), 'private': self.private_reassembler.get_stats()}
+
+    def send_capabilities(self):
+        """Tells the channel which protocol version and capabilities we support.
+        It goes out as a notice, which older clients ignore.
+        """
+        if not self.muted:
+            self.connection.notice(self.channel, encode_hello(capabilities=self.capabilities))
+
+    def join_location(self, location_name):
+        """Moves us to the channel of location_name in location channel mode, right away if we're
+        connected and otherwise once we've joined the main channel.
+        """
+        self.location_name = location_name
+        if not self.location_channels or not self._joined:
+            return
+        target = location_channel_name(self.channel, location_name)
+        if target == self.location_channel:
+            return
+        if self.location_channel is not None:
+            self.connection.part(self.location_channel)
+        self.location_channel = None
+        self.connection.join(target, self.password or "")
+
+    def is_main_channel(self, channel):
+        return channel.lower() == self.channel.lower()
 
     def send_mode(self, username, msg):
         self.connection.mode(username, msg)
@@ -744,7 +1256,62 @@ class IrcConnection:
         return self._joined
 
     def process(self):
-        self.reactor.process_once()
+        # Skips the frame instead of waiting while a reconnect holds the reactor
+        if not self.reactor.mutex.acquire(blocking=False):
+            return
+        try:
+            self.reactor.process_once()
+        finally:
+            self.reactor.mutex.release()
+
+    def start_network_thread(self):
+        self.running = True
+        self.network_thread = threading.Thread(target=self.run_network_thread, name="irc-reactor", daemon=True)
+        self.network_thread.start()
+
+    def stop_network_thread(self):
+        """Stops the reactor thread, waiting for it so nothing is handled after shutdown."""
+        self.running = False
+        if self.network_thread is not None and self.network_thread is not threading.current_thread():
+            self.network_thread.join(1)
+
+    def run_network_thread(self):
+        while self.running:
+            try:
+                # Blocks in select() until there's something to read
+                self.reactor.process_once(0.2)
+            except Exception:
+                Logger.warning(traceback.format_exc())
+
+    def run_background(self, func, *args):
+        """Runs blocking work such as downloads away from the UI thread."""
+        threading.Thread(target=func, args=args, daemon=True).start()
+
+    def run_on_network(self, func, *args):
+        """Runs func where incoming lines are decoded, on the reactor's thread if it has one."""
+        if not self.threaded:
+            func(*args)
+            return
+        with self.reactor.mutex:
+            self.reactor.scheduler.execute_after(0, partial(func, *args))
+
+    def close_recorder(self):
+        recorder, self.recorder = self.recorder, None
+        if recorder is not None:
+            recorder.close()
+
+    def dispatch(self, handler, *args):
+        """Runs handler on the UI thread, right away unless the reactor has its own thread."""
+        if not self.threaded:
+            handler(*args)
+            return
+        self.incoming.append((handler, args))
+        self.incoming_trigger()
+
+    def process_incoming(self, *args):
+        while self.incoming:
+            handler, handler_args = self.incoming.popleft()
+            handler(*handler_args)
 
     def on_welcome(self, c, e):
         if irc.client.is_channel(self.channel):
@@ -753,36 +1320,144 @@ class IrcConnection:
             raise ChannelConnectionError("Couldn't connect to {}".format(self.channel))
 
     def on_join(self, c, e):
-        self._joined = True
         nick = e.source.nick
+        if not self.is_main_channel(e.target):
+            self.dispatch(self.on_location_join, e.target, nick, c.nickname == nick)
+            return
         if c.nickname != nick:
-            self.on_join_handler(nick)
+            self.members.add(nick)
+            self.dispatch(self.add_peer, nick)
+            self.dispatch(self.on_join_handler, nick)
+        elif not self._joined:
+            self._joined = True
+            if self.rejoining:
+                # The resync after rejoining announces our capabilities along with our state
+                self.rejoining = False
+                self.dispatch(self.connection_manager.on_rejoined)
+            else:
+                self.dispatch(self.send_capabilities)
+                if self.on_connected_handler is not None:
+                    self.dispatch(self.on_connected_handler)
+            if self.location_name is not None:
+                self.dispatch(self.join_location, self.location_name)
+
+    def on_location_join(self, channel, nick, own):
+        if own:
+            if channel.lower() != location_channel_name(self.channel, self.location_name).lower():
+                # We moved on again before the server confirmed this one
+                self.connection.part(channel)
+                return
+            self.location_channel = channel
+        # Whoever just arrived has nothing to apply our deltas to, and neither does a room we just entered
+        self.delta_encoder.reset()
+
+    def add_peer(self, nick):
+        self.peers.add(nick)
+        # They have nothing to apply our deltas to yet
+        self.delta_encoder.reset()
+
+    def clear_peers(self):
+        self.peers.clear()
+        self.delta_encoder.reset()
 
     def on_quit(self, c, e):
         nick = e.source.nick
-        self.on_disconnect_handler(nick)
+        self.message_factory.forget_sender(nick)
+        self.snapshot_providers.discard(nick)
+        self.members.discard(nick)
+        self.dispatch(self.peers.remove, nick)
+        self.dispatch(self.on_disconnect_handler, nick)
 
     def on_pubmsg(self, c, e):
         msg = e.arguments[0]
-        message_factory = App.get_running_app().get_message_factory()
+        if self.recorder is not None:
+            self.recorder.record(RECEIVED, e.source.nick, msg)
+        self.receive_pubmsg(e.source.nick, msg)
+
+    def receive_pubmsg(self, nick, msg):
+        if is_fragment(msg):
+            msg = self.reassembler.add(nick, msg)
+            if msg is None:
+                return
         try:
-            message = message_factory.build_from_irc(msg, e.source.nick)
+            message = self.message_factory.build_from_irc(msg, nick)
         except IncorrectMessageTypeError:
             return
-        self.msg_q.enqueue(message)
+        self.dispatch(self.msg_q.enqueue, message)
 
     def on_namreply(self, c, e):
-        self.on_users_handler(e.arguments[2])
+        if not self.is_main_channel(e.arguments[1]):
+            return
+        for name in e.arguments[2].split():
+            name = name.lstrip("@+%&~")
+            if name != c.get_nickname():
+                self.members.add(name)
+                self.dispatch(self.add_peer, name)
+        self.dispatch(self.on_users_handler, e.arguments[2])
+
+    def on_endofnames(self, c, e):
+        if self.is_main_channel(e.arguments[0]):
+            self.dispatch(self.peers.set_listed)
+
+    def on_pubnotice(self, c, e):
+        hello = decode_hello(e.arguments[0])
+        if hello is not None:
+            self.receive_hello(e.source.nick, hello)
 
     def on_privnotice(self, c, e):
-        server_response = e.arguments[0]
-        Logger.info('IRC: {}'.format(server_response))
+        text = e.arguments[0]
+        # A state keeper introduces itself privately to users who joined after its announcement
+        hello = decode_hello(text)
+        if hello is not None:
+            self.receive_hello(e.source.nick, hello)
+            return
+        entries = decode_snapshot(text)
+        if entries is not None:
+            self.receive_snapshot(e.source.nick, entries)
+            return
+        Logger.info('IRC: {}'.format(text))
+
+    def is_state_keeper(self, nick):
+        return self.state_keeper is not None and irc.strings.lower(nick) == irc.strings.lower(self.state_keeper)
+
+    def receive_hello(self, nick, hello):
+        version, capabilities = hello
+        if SNAPSHOT in capabilities and self.is_state_keeper(nick):
+            self.snapshot_providers.add(nick)
+        else:
+            self.snapshot_providers.discard(nick)
+            # Anyone else claiming to keep state is taken as an ordinary client
+            capabilities = capabilities - {SNAPSHOT}
+        self.dispatch(self.peers.update, nick, version, capabilities)
+
+    def receive_snapshot(self, nick, entries):
+        """Takes in the state a keeper kept for us as if every user had just sent it.
+        Runs on the network thread, like everything else that decodes into the message factory.
+        Only state is taken, and only for users that are in the channel.
+        """
+        if nick not in self.snapshot_providers:
+            return
+        own_nick = self.connection.get_nickname()
+        for sender, line in entries:
+            if sender == own_nick or sender not in self.members:
+                continue
+            if line.partition('#')[0] in SNAPSHOT_PREFIXES:
+                self.receive_pubmsg(sender, line)
+
+    def has_state_keeper(self):
+        """True while the state keeper is in the channel and announced itself."""
+        return any(self.is_state_keeper(nick) for nick in self.peers.providers(SNAPSHOT))
 
     def on_nicknameinuse(self, c, e):
+        self.dispatch(self.pick_new_nickname, c)
+
+    def pick_new_nickname(self, c):
         if len(App.get_running_app().get_user().username) < 16:
             c.nick(App.get_running_app().get_user().username + '_')
             App.get_running_app().get_user().username += '_'
             return
+        from kivy.uix.textinput import TextInput
+        from MysteryOnline.mopopup import MOPopup
         temp_pop = MOPopup("Username in use", "Username in use, pick another one.", "OK")
         text_inp = TextInput(multiline=False, size_hint=(1, 0.4))
         temp_pop.box_lay.add_widget(text_inp)
@@ -795,44 +1470,167 @@ class IrcConnection:
 
     def on_privmsg(self, c, e):
         msg = e.arguments[0]
-        self.p_msg_q.enqueue(msg, e.source.nick)
+        if self.recorder is not None:
+            self.recorder.record(PRIVATE_RECEIVED, e.source.nick, msg)
+        self.receive_privmsg(e.source.nick, msg)
+
+    def receive_privmsg(self, nick, msg):
+        if is_fragment(msg):
+            msg = self.private_reassembler.add(nick, msg)
+            if msg is None:
+                return
+        self.dispatch(self.enqueue_pm, msg, nick)
 
     def on_pong(self, c, e):
-        self.connection_manager.receive_pong()
+        self.dispatch(self.connection_manager.receive_pong)
+
+    def on_disconnect(self, c, e):
+        self._joined = False
+        self.location_channel = None
+        # Whoever is still around announces again when we rejoin
+        self.snapshot_providers.clear()
+        self.members.clear()
+        self.dispatch(self.clear_peers)
+        if self.connection_manager is not None:
+            self.dispatch(self.connection_manager.on_connection_lost)
 
 
 class ConnectionManager:
 
-    def __init__(self, irc_connection):
+    JOIN_TIMEOUT = 30
+    # The server is pinged after PING_INTERVAL seconds without traffic and the connection
+    # counts as lost if no pong comes back within PONG_TIMEOUT, checked every WATCHDOG_INTERVAL
+    PING_INTERVAL = 15
+    PONG_TIMEOUT = 10
+    WATCHDOG_INTERVAL = 1
+
+    def __init__(self, irc_connection, update_budget_ms=4, reconnect_delay_min=1, reconnect_delay_max=60,
+                 outbox_size=100, send_rate=2, send_burst=5, join_announce_delay=1, execution_stats_file=''):
         self.irc_connection = irc_connection
         self.irc_connection.set_connection_manager(self)
         self.not_again_flag = False
-        self.ping_event = None
-        self.disconnected_event = None
-        self.reschedule_ping()
-
-    def reschedule_ping(self):
-        if self.ping_event is not None:
-            self.ping_event.cancel()
-        self.ping_event = Clock.schedule_interval(self.ping, 15)
-
-    def ping(self, dt):
+        # Liveness is tracked with timestamps that one watchdog timer looks at
+        self.last_activity = time.monotonic()
+        self.ping_sent_at = None
+        self.round_trip_time = None
+        self.update_budget = update_budget_ms / 1000.0
+        self.budget_exhausted_frames = 0
+        # Reconnection, messages sent while it's going on wait in the outbox
+        self.reconnecting = False
+        self.reconnect_attempts = 0
+        self.reconnect_delay_min = reconnect_delay_min
+        self.reconnect_delay_max = reconnect_delay_max
+        self.reconnect_event = None
+        self.join_timeout_event = None
+        self.outbox = deque(maxlen=outbox_size)
+        # Outgoing messages are paced by a token bucket, one per server connection
+        self.send_bucket = TokenBucket(send_rate, send_burst)
+        self.send_queue = OutboundQueue()
+        self.send_event = None
+        # Joins arriving within join_announce_delay of each other are answered with one state announcement
+        self.pending_joins = 0
+        self.announce_trigger = Clock.create_trigger(self.announce_state, join_announce_delay)
+        # Execution time histograms per message type, shown in the debug menu
+        self.latency = LatencyTracker()
+        self.execution_stats_file = execution_stats_file
+        self.watchdog_event = Clock.schedule_interval(self.check_liveness, self.WATCHDOG_INTERVAL)
+
+    def note_activity(self):
+        self.last_activity = time.monotonic()
+
+    def check_liveness(self, dt):
+        if self.reconnecting:
+            return
+        now = time.monotonic()
+        if self.ping_sent_at is not None:
+            if now - self.ping_sent_at >= self.PONG_TIMEOUT:
+                self.ping_sent_at = None
+                self.get_disconnected()
+        elif now - self.last_activity >= self.PING_INTERVAL:
+            self.ping()
+
+    def ping(self):
+        self.ping_sent_at = time.monotonic()
         try:
             self.irc_connection.send_ping()
         except irc.client.ServerNotConnectedError:
+            self.ping_sent_at = None
             self.get_disconnected()
-        self.disconnected_event = Clock.schedule_once(self.get_disconnected, 10)
 
     def get_disconnected(self, *args):
+        if self.reconnecting:
+            return
         if self.not_again_flag is False:
-            self.ping_event.cancel()
-            popup = MOPopup("Disconnected", "Seems you might be disconnected from IRC :(", "Okay.")
+            from MysteryOnline.mopopup import MOPopup
+            popup = MOPopup("Disconnected", "Seems you might be disconnected from IRC :(\nTrying to reconnect...",
+                            "Okay.")
             popup.create_button("Don't show this again", False, btn_command=self.set_flag())
             popup.size = 800 / 2, 600 / 3
             popup.pos_hint = {'top': 1}
             popup.background_color = [0, 0, 0, 0]
             popup.open()
-            # TODO Implement reconnection strategy
+        self.on_connection_lost()
+
+    def on_connection_lost(self):
+        if self.reconnecting:
+            return
+        Logger.warning('IRC: Connection lost')
+        self.reconnecting = True
+        self.ping_sent_at = None
+        if self.send_event is not None:
+            self.send_event.cancel()
+            self.send_event = None
+        # Hangs up on a connection that stopped answering pings, no-op if the server already closed it
+        self.irc_connection.close("Reconnecting")
+        self.schedule_reconnect()
+
+    def schedule_reconnect(self, *args):
+        """Waits a jittered, exponentially growing delay so clients dropped together don't come back together."""
+        delay = min(self.reconnect_delay_max, self.reconnect_delay_min * 2 ** self.reconnect_attempts)
+        delay = random.uniform(delay / 2, delay)
+        self.reconnect_attempts += 1
+        Logger.info('IRC: Reconnecting in {:.1f}s (attempt {})'.format(delay, self.reconnect_attempts))
+        self.reconnect_event = Clock.schedule_once(self.reconnect, delay)
+
+    def reconnect(self, dt):
+        # Opening the socket blocks, so it's done away from the UI thread
+        self.irc_connection.run_background(self.try_reconnect)
+
+    def try_reconnect(self):
+        try:
+            self.irc_connection.reconnect()
+        except irc.client.ServerConnectionError as e:
+            Logger.warning('IRC: Reconnect failed: {}'.format(e))
+            Clock.schedule_once(self.schedule_reconnect)
+            return
+        Clock.schedule_once(self.wait_for_join)
+
+    def wait_for_join(self, dt):
+        self.join_timeout_event = Clock.schedule_once(self.on_join_timeout, self.JOIN_TIMEOUT)
+
+    def on_join_timeout(self, dt):
+        Logger.warning('IRC: No join after reconnecting')
+        self.irc_connection.close("Reconnecting")
+        self.schedule_reconnect()
+
+    def on_rejoined(self):
+        if self.join_timeout_event is not None:
+            self.join_timeout_event.cancel()
+        Logger.info('IRC: Reconnected after {} attempt(s)'.format(self.reconnect_attempts))
+        self.reconnecting = False
+        self.reconnect_attempts = 0
+        # The resync below covers anyone who joined while we were away
+        self.announce_trigger.cancel()
+        self.pending_joins = 0
+        main_scr = App.get_running_app().get_main_screen()
+        main_scr.log_window.add_entry("Reconnected.\n")
+        self.send_state()
+        pending = list(self.outbox)
+        self.outbox.clear()
+        for msg in pending:
+            self.send_msg(msg)
+        self.flush_send_queue()
+        self.note_activity()
 
     def set_flag(self):
         self.not_again_flag = not self.not_again_flag
@@ -841,26 +1639,107 @@ class ConnectionManager:
         App.get_running_app().stop()
 
     def receive_pong(self):
-        if self.disconnected_event is not None:
-            self.disconnected_event.cancel()
+        now = time.monotonic()
+        if self.ping_sent_at is not None:
+            self.round_trip_time = now - self.ping_sent_at
+            self.ping_sent_at = None
+        self.last_activity = now
+
+    def get_round_trip_ms(self):
+        """Round trip to the server measured by the last answered ping, None until one was."""
+        if self.round_trip_time is None:
+            return None
+        return self.round_trip_time * 1000
 
     def send_msg(self, msg, *args):
-        try:
-            irc_message = msg.to_irc()
-            self.irc_connection.send_msg(irc_message, *args)
-        except irc.client.ServerNotConnectedError:
-            self.get_disconnected()
-        self.reschedule_ping()
+        if self.reconnecting:
+            self.outbox.append(msg)
+            return
+        self.send_queue.put(msg, args)
+        if self.send_event is None:
+            self.flush_send_queue()
+
+    def flush_send_queue(self, *args):
+        """Sends queued messages while the token bucket allows, then waits for the next token."""
+        self.send_event = None
+        sent = False
+        while not self.reconnecting and not self.send_queue.is_empty():
+            if not self.send_bucket.take():
+                self.send_event = Clock.schedule_once(self.flush_send_queue, self.send_bucket.wait_time())
+                break
+            entry = self.send_queue.get()
+            msg, msg_args = entry[0], entry[1]
+            try:
+                lines = self.irc_connection.send_message(msg, *msg_args)
+            except irc.client.ServerNotConnectedError:
+                self.send_queue.put_back(entry)
+                self.get_disconnected()
+                break
+            except (MessageTooLongError, irc.client.MessageTooLong) as e:
+                Logger.warning('IRC: Dropped a message that was too long to send: {}'.format(e))
+                self.report_too_long(msg)
+                continue
+            self.send_bucket.spend(lines - 1)
+            self.send_queue.record_sent(entry)
+            sent = True
+        if sent:
+            self.note_activity()
+
+    def report_too_long(self, msg):
+        from MysteryOnline.mopopup import MOPopup
+        popup = MOPopup("Not sent", "Your {} was too long to send. Someone in the channel uses an older version "
+                                    "that can't receive long lines, please shorten it.".format(msg.description), "OK")
+        popup.size = (900, 200)
+        popup.open()
+
+    def get_send_stats(self):
+        return self.send_queue.get_stats()
 
     def send_local(self, msg):
         self.irc_connection.msg_q.enqueue(msg)
 
+    def join_location(self, location_name):
+        try:
+            self.irc_connection.join_location(location_name)
+        except irc.client.ServerNotConnectedError:
+            self.get_disconnected()
+
     def update_chat(self, dt):
-        msg = self.irc_connection.get_msg()
-        if msg is not None:
-            main_scr = App.get_running_app().get_main_screen()
-            user_handler = App.get_running_app().get_user_handler()
+        """Executes queued messages until the frame's time budget runs out.
+        IC chat goes through the text box one post at a time, so at most one is taken per frame.
+        Every execute is timed per message type, and the whole frame as 'update_chat'.
+        """
+        main_scr = App.get_running_app().get_main_screen()
+        lanes = MessageQueue.LANES
+        if main_scr.text_box.is_displaying_msg:
+            # Chat would only be put back, leave it queued so it doesn't skew the timings
+            lanes = MessageQueue.NON_CHAT_LANES
+        msg = self.irc_connection.get_msg(lanes)
+        if msg is None:
+            # Nothing to do this frame, warm up the sprites of whoever is likely to post next
+            sprite_prefetcher.update()
+            return
+        user_handler = App.get_running_app().get_user_handler()
+        frame_start = time.perf_counter()
+        deadline = frame_start + self.update_budget
+        while msg is not None:
+            start = time.perf_counter()
             msg.execute(self, main_scr, user_handler)
+            end = time.perf_counter()
+            self.latency.record(type(msg).__name__, end - start)
+            if msg.lane == 'chat':
+                lanes = MessageQueue.NON_CHAT_LANES
+            if end >= deadline:
+                if self.irc_connection.has_msg(lanes):
+                    self.budget_exhausted_frames += 1
+                break
+            msg = self.irc_connection.get_msg(lanes)
+        self.latency.record('update_chat', time.perf_counter() - frame_start)
+
+    def dump_execution_stats(self):
+        if self.execution_stats_file:
+            self.latency.dump(self.execution_stats_file)
+            Logger.info('Stats: Message execution times written to {}'.format(self.execution_stats_file))
 
     def update_music(self, track_name, url=None):
         message_factory = App.get_running_app().get_message_factory()
@@ -868,6 +1747,7 @@ class ConnectionManager:
         self.send_msg(message)
 
     def update_char(self, main_scr, char, username, char_link, version):
+        from MysteryOnline.character import characters
         main_scr.ooc_window.update_char(username, char)
         user = App.get_running_app().get_user()
         if username == user.username:
@@ -880,6 +1760,23 @@ class ConnectionManager:
         main_scr.users[username].get_char().load_without_icons()
         main_scr.users[username].remove()
         main_scr.add_character_to_dlc_list(char, char_link, version)
+        self.prefetch_sprites(main_scr.users[username])
+
+    def prefetch_sprites(self, user):
+        """Has the sprites of user warmed up in the background if they're in our location."""
+        our_user = App.get_running_app().get_user()
+        our_loc = our_user.get_loc()
+        char = user.get_char()
+        if user is our_user or our_loc is None or user.get_loc() is None or char is None or char.sprites is None:
+            return
+        if user.get_loc().get_name() == our_loc.get_name():
+            sprite_prefetcher.want(user.username, char.sprites, user.current_sprite)
+
+    def prefetch_location(self):
+        """Has the sprites of everyone in our location warmed up, for when we've just moved."""
+        main_scr = App.get_running_app().get_main_screen()
+        for user in main_scr.users.values():
+            self.prefetch_sprites(user)
 
     def on_join(self, username):
         main_scr: MainScreen = App.get_running_app().get_main_screen()
@@ -887,12 +1784,33 @@ class ConnectionManager:
         user = user_handler.get_user()
         if user.username == username:
             return
+        from MysteryOnline.user import User
         if username not in main_scr.users:
             main_scr.users[username] = User(username)
             main_scr.ooc_window.add_user(main_scr.users[username])
         main_scr.log_window.add_entry("{} has joined.\n".format(username))
+        # A state keeper hands newcomers everyone's state, ours included
+        if self.irc_connection.has_state_keeper():
+            return
+        self.pending_joins += 1
+        self.announce_trigger()
+
+    def announce_state(self, dt):
+        Logger.debug('IRC: Announcing state to {} new user(s)'.format(self.pending_joins))
+        self.pending_joins = 0
+        self.send_state()
+
+    def send_state(self):
+        """Sends our capabilities, location, character and current nullpost so other users can place us."""
+        user_handler: CurrentUserHandler = App.get_running_app().get_user_handler()
+        user = user_handler.get_user()
         loc = user_handler.get_current_loc().name
         message_factory = App.get_running_app().get_message_factory()
+        if not self.reconnecting:
+            try:
+                self.irc_connection.send_capabilities()
+            except irc.client.ServerNotConnectedError:
+                self.get_disconnected()
         loc_message = message_factory.build_location_message(loc)
         self.send_msg(loc_message)
         char = user.get_char()
@@ -906,6 +1824,7 @@ class ConnectionManager:
         main_scr = App.get_running_app().get_main_screen()
         main_scr.log_window.add_entry("{} has disconnected.\n".format(username))
         main_scr.ooc_window.delete_user(username)
+        sprite_prefetcher.forget(username)
         try:
             main_scr.users[username].remove()
             del main_scr.users[username]
@@ -913,12 +1832,13 @@ class ConnectionManager:
             pass
 
     def on_join_users(self, users):
+        from MysteryOnline.user import User
         main_scr = App.get_running_app().get_main_screen()
         user = App.get_running_app().get_user()
         users = users.split()
         for u in users:
             if u == "@" + user.username:
                 continue
-            if u != user.username:
+            if u != user.username and u not in main_scr.users:
                 main_scr.users[u] = User(u)
                 main_scr.ooc_window.add_user(main_scr.users[u])
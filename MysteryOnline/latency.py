@@ -0,0 +1,87 @@
+import json
+from bisect import bisect_left
+from collections import deque
+
+# Upper bounds of the histogram buckets in milliseconds, the last one catches everything slower
+BUCKETS_MS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, float('inf'))
+
+
+def bucket_label(index):
+    if index == len(BUCKETS_MS) - 1:
+        return ">{:g}ms".format(BUCKETS_MS[-2])
+    return "<={:g}ms".format(BUCKETS_MS[index])
+
+
+class RollingHistogram:
+    """Bucketed durations of the last window samples. Adding a sample is O(1)."""
+
+    def __init__(self, window=1000):
+        self.samples = deque(maxlen=window)
+        self.counts = [0] * len(BUCKETS_MS)
+        self.window_sum = 0.0
+        self.total = 0
+
+    def add(self, seconds):
+        ms = seconds * 1000
+        bucket = bisect_left(BUCKETS_MS, ms)
+        if len(self.samples) == self.samples.maxlen:
+            old_ms, old_bucket = self.samples[0]
+            self.counts[old_bucket] -= 1
+            self.window_sum -= old_ms
+        self.samples.append((ms, bucket))
+        self.counts[bucket] += 1
+        self.window_sum += ms
+        self.total += 1
+
+    def percentile(self, fraction):
+        """Upper bound of the bucket the percentile falls in, the slowest sample for the last bucket."""
+        rank = fraction * len(self.samples)
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if count and seen >= rank:
+                if index == len(BUCKETS_MS) - 1:
+                    return max(ms for ms, bucket in self.samples)
+                return BUCKETS_MS[index]
+        return 0.0
+
+    def get_stats(self):
+        count = len(self.samples)
+        return {'total': self.total, 'window': count,
+                'mean_ms': self.window_sum / count if count else 0.0,
+                'max_ms': max(ms for ms, bucket in self.samples) if count else 0.0,
+                'p50_ms': self.percentile(0.5), 'p95_ms': self.percentile(0.95), 'p99_ms': self.percentile(0.99),
+                'buckets': {bucket_label(i): c for i, c in enumerate(self.counts) if c}}
+
+
+class LatencyTracker:
+    """Rolling execution time histograms, one per name (usually a message type)."""
+
+    def __init__(self, window=1000):
+        self.window = window
+        self.histograms = {}
+
+    def record(self, name, seconds):
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            histogram = self.histograms[name] = RollingHistogram(self.window)
+        histogram.add(seconds)
+
+    def get_stats(self):
+        return {name: histogram.get_stats() for name, histogram in self.histograms.items()}
+
+    def format_table(self):
+        stats = self.get_stats()
+        if not stats:
+            return "Nothing recorded yet."
+        lines = ["{:<20} {:>8} {:>8} {:>8} {:>8} {:>9}".format("", "count", "mean", "p95", "p99", "max")]
+        # Slowest first, that's what you open this for
+        for name in sorted(stats, key=lambda n: stats[n]['p95_ms'], reverse=True):
+            s = stats[name]
+            lines.append("{:<20} {:>8} {:>6.2f}ms {:>6.2f}ms {:>6.2f}ms {:>7.2f}ms".format(
+                name, s['total'], s['mean_ms'], s['p95_ms'], s['p99_ms'], s['max_ms']))
+        return "\n".join(lines)
+
+    def dump(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.get_stats(), f, indent=2, sort_keys=True)
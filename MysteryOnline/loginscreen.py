@@ -5,8 +5,11 @@ from MysteryOnline import get_version, get_dev
 from MysteryOnline.character import characters
 from MysteryOnline.character_select import CharacterSelect
 from MysteryOnline.irc_mo import IrcConnection, ConnectionManager
+from MysteryOnline.irc_aio import AioIrcConnection
+from MysteryOnline.traffic import TrafficRecorder
 from kivy.app import App
 from kivy.clock import Clock
+from kivy.logger import Logger
 from kivy.config import ConfigParser
 from kivy.properties import StringProperty, ObjectProperty
 from kivy.uix.screenmanager import Screen
@@ -49,6 +52,33 @@ if not config.has_option("IRC Server name", "irc_server_port"):
 
 irc_server_port = config.get("IRC Server name", "irc_server_port")
 
+NETWORK_DEFAULTS = {
+    'queue_depth': '500',
+    'queue_overflow': 'drop_oldest',
+    'update_budget_ms': '4',
+    'threaded_network': 'False',
+    'backend': 'reactor',
+    'reconnect_delay_min': '1',
+    'reconnect_delay_max': '60',
+    'outbox_size': '100',
+    'send_rate': '2',
+    'send_burst': '5',
+    'join_announce_delay': '1',
+    'record_traffic': '',
+    'execution_stats_file': '',
+    'location_channels': 'False',
+    'state_keeper': '',
+}
+
+if not config.has_section("Network"):
+    config.add_section("Network")
+    dirty = True
+
+for option, default in NETWORK_DEFAULTS.items():
+    if not config.has_option("Network", option):
+        config.set("Network", option, default)
+        dirty = True
+
 if dirty:
     with open('irc_channel_name.ini', "w+") as configfile:
         config.write(configfile)
@@ -59,6 +89,7 @@ PORT = int(irc_server_port)
  and that does the job.'''
 CHANNEL = channel_in_config
 PASSWORD = password_in_config
+NETWORK = config["Network"]
 
 
 class LoginScreen(Screen):
@@ -93,10 +124,37 @@ class LoginScreen(Screen):
 
     def create_irc_connection(self):
         user_handler = App.get_running_app().get_user_handler()
-        connection = IrcConnection(self.server, self.port, self.channel, self.username, self.password)
-        user_handler.set_connection_manager(ConnectionManager(connection))
+        if NETWORK.get('backend') == 'asyncio':
+            connection_class = AioIrcConnection
+        else:
+            connection_class = IrcConnection
+        connection = connection_class(self.server, self.port, self.channel, self.username, self.password,
+                                    queue_depth=NETWORK.getint('queue_depth'),
+                                    queue_overflow=NETWORK.get('queue_overflow'),
+                                    threaded=NETWORK.getboolean('threaded_network'),
+                                    recorder=self.create_traffic_recorder(),
+                                    location_channels=NETWORK.getboolean('location_channels'),
+                                    state_keeper=NETWORK.get('state_keeper'))
+        connection_manager = ConnectionManager(connection,
+                                               update_budget_ms=NETWORK.getfloat('update_budget_ms'),
+                                               reconnect_delay_min=NETWORK.getfloat('reconnect_delay_min'),
+                                               reconnect_delay_max=NETWORK.getfloat('reconnect_delay_max'),
+                                               outbox_size=NETWORK.getint('outbox_size'),
+                                               send_rate=NETWORK.getfloat('send_rate'),
+                                               send_burst=NETWORK.getint('send_burst'),
+                                               join_announce_delay=NETWORK.getfloat('join_announce_delay'),
+                                               execution_stats_file=NETWORK.get('execution_stats_file').strip())
+        user_handler.set_connection_manager(connection_manager)
         self.manager.irc_connection = connection
 
+    @staticmethod
+    def create_traffic_recorder():
+        path = NETWORK.get('record_traffic').strip()
+        if not path:
+            return None
+        Logger.info('IRC: Recording traffic to {}'.format(path))
+        return TrafficRecorder(path)
+
     def set_current_user(self):
         config = ConfigParser()
         config.read('mysteryonline.ini')
@@ -53,6 +53,7 @@ import MysteryOnline.settings_types
 from MysteryOnline.mopopup import MOPopup
 from MysteryOnline.mopopup import MOPopupYN
 from MysteryOnline.location import location_manager
+from MysteryOnline.page_cache import page_cache, DEFAULT_BUDGET_MB, MB
 from os import listdir
 
 from MysteryOnline.commands import command_processor
@@ -82,7 +83,10 @@ class MainScreenManager(ScreenManager):
 
         self.set_handlers()
         self.main_screen.user = App.get_running_app().get_user()
-        Clock.schedule_interval(self.process_irc, 1.0 / 60.0)
+        if self.irc_connection.threaded:
+            self.irc_connection.start_network_thread()
+        else:
+            Clock.schedule_interval(self.process_irc, 1.0 / 60.0)
         self.popup_.open()
 
     def set_handlers(self):
@@ -90,6 +94,10 @@ class MainScreenManager(ScreenManager):
         self.irc_connection.on_join_handler = connection_manager.on_join
         self.irc_connection.on_users_handler = connection_manager.on_join_users
         self.irc_connection.on_disconnect_handler = connection_manager.on_disconnect
+        self.irc_connection.on_connected_handler = self.on_irc_joined
+
+    def on_irc_joined(self):
+        self.connected = True
 
     def on_connected(self, *args):
         """Called when MO connects to the IRC channel"""
@@ -114,7 +122,6 @@ class MainScreenManager(ScreenManager):
 
     def process_irc(self, dt):
         self.irc_connection.process()
-        self.connected = self.irc_connection.is_connected()
 
 
 class MysteryOnlineApp(App):
@@ -137,12 +144,18 @@ class MysteryOnlineApp(App):
         msm = MainScreenManager()
         self.keyboard_listener = KeyboardListener()
         location_manager.load_locations()
+        self.on_sprite_memory_change()
+        self.config.add_callback(self.on_sprite_memory_change, 'display', 'sprite_memory_mb')
         return msm
 
+    def on_sprite_memory_change(self, *args):
+        page_cache.set_budget(int(self.config.getfloat('display', 'sprite_memory_mb') * MB))
+
     def build_config(self, config):
         config.setdefaults('display', {
             'resolution': '1366x768',
             'rpg_mode': 0,
+            'sprite_memory_mb': DEFAULT_BUDGET_MB,
         })
         config.setdefaults('sound', {
             'blip_volume': 100,
@@ -245,6 +258,12 @@ class MysteryOnlineApp(App):
             pass
         if self.main_screen:
             self.main_screen.on_stop()
+        connection_manager = self.user_handler.get_connection_manager() if self.user_handler else None
+        if connection_manager is not None:
+            connection_manager.dump_execution_stats()
+            # The network thread goes first so nothing is recorded into a closed file
+            connection_manager.irc_connection.stop_network_thread()
+            connection_manager.irc_connection.close_recorder()
         config.write()
         super(MysteryOnlineApp, self).on_stop()
         App.get_running_app().get_main_screen().ooc_window.music_tab.reset_music()
@@ -14,6 +14,7 @@ from MysteryOnline.debug_mode import DebugModePopup
 from kivy.uix.dropdown import DropDown
 from kivy.uix.button import Button
 from MysteryOnline.character import characters
+from MysteryOnline.page_cache import page_cache
 
 
 class RightClickMenu(ModalView):
@@ -175,6 +176,7 @@ class MainScreen(Screen):
     def on_new_char(self, char):
         try:
             self.msg_input.readonly = False
+            page_cache.set_pins('user', [char.sprites_path])
             self.icons_layout.load_icons(char)
             self.set_first_sprite(char)
             user_handler = App.get_running_app().get_user_handler()
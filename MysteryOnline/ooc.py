@@ -6,7 +6,6 @@ from datetime import datetime
 
 import requests
 import urllib
-from irc.client import MessageTooLong
 from kivy.app import App
 from kivy.clock import Clock
 from kivy.core.audio import SoundLoader
@@ -79,29 +78,20 @@ class MusicTab(TabbedPanelItem):
         if self.hide_title and sender == 'Default':
             track_name = "Hidden track"
         if url is None:
-            if len(self.url_input.text) > 400:
-                popup = MOPopup("Warning", "URL too long", "OK")
-                popup.open()
-                return
             url = self.url_input.text
         if track_name is not None:
             main_screen.music_name_display.text = "Playing: {}".format(track_name)
         else:
             main_screen.music_name_display.text = "Playing: URL Track"
-        try:
-            if send_to_all:
-                self.url_input.text = ""
-                connection_manager = App.get_running_app().get_user_handler().get_connection_manager()
-                connection_manager.update_music(track_name, url)
-                main_screen.log_window.add_entry("You changed the music.\n")
-            if not any(s in url.lower() for s in ('mp3', 'wav', 'ogg', 'flac', 'watch')):  # watch is for yt links
-                Logger.warning("Music: The file you tried to play doesn't appear to contain music.")
-                self.is_loading_music = False
-                return
-        except MessageTooLong:
+        if send_to_all:
             self.url_input.text = ""
-            temp_pop = MOPopup("Error playing music", "Link too long", "OK")
-            temp_pop.open()
+            connection_manager = App.get_running_app().get_user_handler().get_connection_manager()
+            connection_manager.update_music(track_name, url)
+            main_screen.log_window.add_entry("You changed the music.\n")
+        if not any(s in url.lower() for s in ('mp3', 'wav', 'ogg', 'flac', 'watch')):  # watch is for yt links
+            Logger.warning("Music: The file you tried to play doesn't appear to contain music.")
+            self.is_loading_music = False
+            return
 
         def play_song(root):
             config_ = App.get_running_app().config
@@ -194,7 +184,7 @@ class MusicTab(TabbedPanelItem):
                 else:
                     main_scr.music_name_display.text = "Playing: " + songtitle
 
-        threading.Thread(target=play_song, args=(self,), daemon=True).start()
+        main_screen.manager.irc_connection.run_background(play_song, self)
 
     def music_stop(self, local=True):
         if self.track is not None:
@@ -288,7 +278,8 @@ class OOCWindow(TabbedPanel):
         if self.chat.irc is None:
             self.chat.irc = main_scr.manager.irc_connection
         self.chat.username = main_scr.user.username
-        Clock.schedule_interval(self.update_private_messages, 1.0 / 60.0)
+        self.chat.irc.on_private_message_handler = self.update_private_messages
+        self.update_private_messages()
         self.user_list.bind(minimum_height=self.user_list.setter('height'))
 
     def on_blip_volume_change(self, s, k, v):
@@ -381,28 +372,32 @@ class OOCWindow(TabbedPanel):
                 return True
         return False
 
-    def update_private_messages(self, *args):  # Acts on arrival of PMs
+    def update_private_messages(self, *args):  # Acts on arrival of PMs, delivers everything that's queued
         main_scr = App.get_running_app().get_main_screen()
         irc = main_scr.manager.irc_connection
         pm = irc.get_pm()
-        if pm is not None:
-            if pm.sender != self.chat.username:
-                if not self.muted_sender(pm, self.muted_users):
-                    if not self.chat.pm_window_open_flag:
-                        for btn in self.pm_buttons:
-                            if pm.sender == btn.id:
-                                btn.background_normal = 'atlas://data/images/defaulttheme/button_pressed'
-                                break
-                        if not self.chat.pm_flag and not self.chat.pm_window_open_flag:
-                            pm_notif = SoundLoader.load('sounds/general/codeccall.mp3')
-                            App.get_running_app().play_sound(pm_notif, volume=self.pm_notif_volume)
-                            App.get_running_app().flash_window()
-                            if not Window.focus:
-                                App.get_running_app().notification("Mystery Online",
-                                                                   "You've got a PM from {0}".format(pm.sender))
-                    self.chat.pm_flag = True
-                    self.chat.build_conversation(pm.sender)
-                    self.chat.update_conversation(pm.sender, pm.msg)
+        while pm is not None:
+            self.deliver_private_message(pm)
+            pm = irc.get_pm()
+
+    def deliver_private_message(self, pm):
+        if pm.sender == self.chat.username or self.muted_sender(pm, self.muted_users):
+            return
+        if not self.chat.pm_window_open_flag:
+            for btn in self.pm_buttons:
+                if pm.sender == btn.id:
+                    btn.background_normal = 'atlas://data/images/defaulttheme/button_pressed'
+                    break
+            if not self.chat.pm_flag and not self.chat.pm_window_open_flag:
+                pm_notif = SoundLoader.load('sounds/general/codeccall.mp3')
+                App.get_running_app().play_sound(pm_notif, volume=self.pm_notif_volume)
+                App.get_running_app().flash_window()
+                if not Window.focus:
+                    App.get_running_app().notification("Mystery Online",
+                                                       "You've got a PM from {0}".format(pm.sender))
+        self.chat.pm_flag = True
+        self.chat.build_conversation(pm.sender)
+        self.chat.update_conversation(pm.sender, pm.msg)
 
     def mute_user(self, user, btn):
         if user in self.muted_users:
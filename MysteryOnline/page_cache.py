@@ -0,0 +1,65 @@
+from collections import OrderedDict
+
+MB = 1024 * 1024
+DEFAULT_BUDGET_MB = 1024
+
+
+class PageCache:
+    """Keeps track of the decoded atlas pages of every character, least recently used first.
+
+    Pages are keyed by (atlas filename, page). Once they add up to more than budget bytes the
+    least recently used ones are unloaded from their atlas, except pages of pinned atlases.
+    Pins are grouped by reason, such as the local user's character or what's on screen, so
+    each group can be replaced on its own.
+    """
+
+    def __init__(self, budget=DEFAULT_BUDGET_MB * MB):
+        self.budget = budget
+        self.entries = OrderedDict()
+        self.size = 0
+        self.pins = {}
+        self.pinned = frozenset()
+        self.evicted = 0
+
+    def add(self, atlas, page, size):
+        key = (atlas.filename, page)
+        old = self.entries.pop(key, None)
+        if old is not None:
+            self.size -= old[1]
+        self.entries[key] = (atlas, size)
+        self.size += size
+        self.evict(keep=key)
+
+    def touch(self, atlas, page):
+        key = (atlas.filename, page)
+        if key in self.entries:
+            self.entries.move_to_end(key)
+
+    def set_pins(self, reason, filenames):
+        self.pins[reason] = frozenset(filenames)
+        self.pinned = frozenset().union(*self.pins.values())
+        self.evict()
+
+    def set_budget(self, budget):
+        self.budget = budget
+        self.evict()
+
+    def evict(self, keep=None):
+        if self.size <= self.budget:
+            return
+        for key in list(self.entries):
+            if self.size <= self.budget:
+                return
+            if key == keep or key[0] in self.pinned:
+                continue
+            atlas, size = self.entries.pop(key)
+            self.size -= size
+            self.evicted += 1
+            atlas.unload_page(key[1])
+
+    def get_stats(self):
+        return {'pages': len(self.entries), 'bytes': self.size, 'budget': self.budget, 'evicted': self.evicted,
+                'pinned_pages': sum(1 for key in self.entries if key[0] in self.pinned)}
+
+
+page_cache = PageCache()
@@ -0,0 +1,72 @@
+from collections import OrderedDict
+from functools import partial
+
+DEFAULT_MAX_IN_FLIGHT = 1
+
+
+class SpritePrefetcher:
+    """Warms the atlas pages of characters that are likely to post soon, so their first post
+    doesn't wait for a page to be decoded.
+
+    Users that pick a character in our location, move into it, or are there when we arrive are
+    wanted; their pages are started on idle frames, at most max_in_flight at a time so the decoder
+    pool keeps room for sprites that are on screen. The first time a wanted user is displayed
+    counts as a hit if their sprite was ready, and as a miss if it was still loading.
+    """
+
+    def __init__(self, max_in_flight=DEFAULT_MAX_IN_FLIGHT):
+        self.max_in_flight = max_in_flight
+        # (atlas filename, page) -> atlas, oldest wish first
+        self.wanted = OrderedDict()
+        self.in_flight = set()
+        # username -> (atlas filename, page) we warmed for them
+        self.expected = {}
+        self.started = 0
+        self.completed = 0
+        self.hits = 0
+        self.misses = 0
+
+    def want(self, username, atlas, sprite_name=None):
+        """Queues the page of sprite_name, the atlas's first page if we don't know which sprite they use."""
+        page = atlas.get_page(sprite_name)
+        if page is None:
+            return
+        key = (atlas.filename, page)
+        self.expected[username] = key
+        if key not in self.in_flight and not atlas.is_page_loaded(page):
+            self.wanted[key] = atlas
+            self.wanted.move_to_end(key)
+
+    def forget(self, username):
+        self.expected.pop(username, None)
+
+    def update(self):
+        """Starts queued pages while there's room, called on frames with nothing else to do."""
+        while self.wanted and len(self.in_flight) < self.max_in_flight:
+            key, atlas = self.wanted.popitem(last=False)
+            if atlas.is_page_loaded(key[1]):
+                continue
+            self.in_flight.add(key)
+            self.started += 1
+            atlas.when_page_loaded(key[1], partial(self.on_page_loaded, key))
+
+    def on_page_loaded(self, key):
+        self.in_flight.discard(key)
+        self.completed += 1
+
+    def note_displayed(self, username, sprite):
+        if self.expected.pop(username, None) is None:
+            return
+        if sprite.is_loading():
+            self.misses += 1
+        else:
+            self.hits += 1
+
+    def get_stats(self):
+        first_posts = self.hits + self.misses
+        return {'queued': len(self.wanted), 'in_flight': len(self.in_flight), 'started': self.started,
+                'completed': self.completed, 'hits': self.hits, 'misses': self.misses,
+                'hit_rate': self.hits / first_posts if first_posts else None}
+
+
+sprite_prefetcher = SpritePrefetcher()
@@ -8,9 +8,13 @@ from kivy.utils import escape_markup
 from kivy.uix.image import Image
 from kivy.uix.label import Label
 
+from MysteryOnline.codec import FRAGMENTS
 from MysteryOnline.irc_mo import PrivateConversation
 from MysteryOnline.character import characters
 
+# Longer private messages go out in fragments, which only clients that announced them put back together
+MAX_UNFRAGMENTED_PM_LENGTH = 400
+
 
 class PrivateMessageScreen(ModalView):
     pm_body = ObjectProperty(None)
@@ -143,13 +147,18 @@ class PrivateMessageScreen(ModalView):
     def refocus_text(self, *args):
         self.text_box.focus = True
 
+    def can_send(self, receiver, text):
+        if text == "":
+            return False
+        return len(text) <= MAX_UNFRAGMENTED_PM_LENGTH or self.irc.peers.peer_supports(receiver, FRAGMENTS)
+
     def send_pm(self):
         sender = self.username
         user = App.get_running_app().get_user()
         self.avatar = Image(source=user.get_char().avatar, size_hint_x=None, width=60)
         if self.current_conversation is not None:
-            if self.text_box.text != "" and len(self.text_box.text) <= 400:
-                    receiver = self.current_conversation.username
+            receiver = self.current_conversation.username
+            if self.can_send(receiver, self.text_box.text):
                     self.irc.send_private_msg(receiver, sender, self.text_box.text)
                     msg = self.text_box.text
                     if 'www.' in msg or 'http://' in msg or 'https://' in msg:
@@ -7,10 +7,12 @@ from kivy.uix.widget import Widget
 from kivy.uix.button import Button
 from kivy.uix.dropdown import DropDown
 from kivy.config import ConfigParser
+from kivy.graphics.texture import Texture
 
 from MysteryOnline.location import SubLocation
+from MysteryOnline.page_cache import page_cache
+from MysteryOnline.prefetch import sprite_prefetcher
 from MysteryOnline.sprite_organizer import SpriteOrganizer
-import copy
 
 
 class NullSprite:
@@ -33,16 +35,19 @@ class NullSprite:
     def is_spoiler(self):
         return False
 
+    def is_loading(self):
+        return False
+
     def get_name(self):
         return self.name
 
-    def get_texture(self):
-        texture = self.return_spoiler_texture()
+    def get_texture(self, flipped=False):
+        texture = self.return_spoiler_texture(flipped)
         return texture
 
-    def return_spoiler_texture(self):
+    def return_spoiler_texture(self, flipped=False):
         spoiler_sprite = self.load_dummy_character_sprite('4')
-        return spoiler_sprite.get_texture()
+        return spoiler_sprite.get_texture(flipped)
 
     def load_dummy_character_sprite(self, sprite_name):
         from MysteryOnline.character import characters
@@ -51,30 +56,93 @@ class NullSprite:
         return red_herring.get_sprite(sprite_name)
 
 
+class LoadingSprite(NullSprite):
+    """Stands in for a sprite whose atlas page is still being decoded. It keeps the flags the
+    character sets, so a CG is treated as one before its page is in.
+    """
+
+    placeholder = None
+
+    def __init__(self, name, atlas, page):
+        super(LoadingSprite, self).__init__(name)
+        self.atlas = atlas
+        self.page = page
+        self.nsfw = False
+        self.spoiler = False
+        self.cg = False
+
+    def is_loading(self):
+        return True
+
+    def when_ready(self, callback):
+        self.atlas.when_page_loaded(self.page, callback)
+
+    def set_nsfw(self):
+        self.nsfw = True
+
+    def unset_nsfw(self):
+        self.nsfw = False
+
+    def is_nsfw(self):
+        return self.nsfw
+
+    def set_spoiler(self):
+        self.spoiler = True
+
+    def unset_spoiler(self):
+        self.spoiler = False
+
+    def is_spoiler(self):
+        return self.spoiler
+
+    def set_cg(self):
+        self.cg = True
+
+    def is_cg(self):
+        return self.cg
+
+    def get_texture(self, flipped=False):
+        if LoadingSprite.placeholder is None:
+            texture = Texture.create(size=(1, 1), colorfmt='rgba')
+            texture.blit_buffer(b'\x00\x00\x00\x00', colorfmt='rgba', bufferfmt='ubyte')
+            LoadingSprite.placeholder = texture
+        return LoadingSprite.placeholder
+
+
 class Sprite:
 
     def __init__(self, name, texture):
         self.name = name
         self.texture = texture
+        # A region over the same GPU texture with mirrored coordinates, made the first time it's needed
+        self.flipped_texture = None
         self.nsfw = False
         self.spoiler = False
         self.cg = False
 
-    def get_texture(self):
-        texture = self.texture
+    def get_texture(self, flipped=False):
         if self.is_nsfw():
-            texture = self.return_nsfw_texture()
+            return self.return_nsfw_texture(flipped)
         elif self.is_spoiler():
-            texture = self.return_spoiler_texture()
-        return copy.copy(texture)
-
-    def return_nsfw_texture(self):
+            return self.return_spoiler_texture(flipped)
+        if flipped:
+            return self.get_flipped_texture()
+        return self.texture
+
+    def get_flipped_texture(self):
+        if self.flipped_texture is None:
+            texture = self.texture
+            self.flipped_texture = texture.get_region(0, 0, texture.width, texture.height)
+            self.flipped_texture.flip_horizontal()
+        return self.flipped_texture
+
+    def return_nsfw_texture(self, flipped=False):
         spoiler_sprite = self.load_dummy_character_sprite('5')
-        return spoiler_sprite.get_texture()
+        return spoiler_sprite.get_texture(flipped)
 
-    def return_spoiler_texture(self):
+    def return_spoiler_texture(self, flipped=False):
         spoiler_sprite = self.load_dummy_character_sprite('4')
-        return spoiler_sprite.get_texture()
+        return spoiler_sprite.get_texture(flipped)
 
     def load_dummy_character_sprite(self, sprite_name):
         from MysteryOnline.character import characters
@@ -115,6 +183,9 @@ class Sprite:
     def is_spoiler(self):
         return self.spoiler
 
+    def is_loading(self):
+        return False
+
     def set_cg(self):
         try:
             self.cg = True
@@ -125,6 +196,19 @@ class Sprite:
         return self.cg
 
 
+class FlippedSprite:
+    """The mirror image of a sprite. Everything but the texture comes from the sprite itself."""
+
+    def __init__(self, sprite):
+        self.sprite = sprite
+
+    def __getattr__(self, name):
+        return getattr(self.sprite, name)
+
+    def get_texture(self, flipped=False):
+        return self.sprite.get_texture(not flipped)
+
+
 class SpriteSettings(BoxLayout):
     check_flip_h = ObjectProperty(None)
     pos_btn = ObjectProperty(None)
@@ -132,31 +216,22 @@ class SpriteSettings(BoxLayout):
 
     def __init__(self, **kwargs):
         super(SpriteSettings, self).__init__(**kwargs)
-        self.functions = {"flip_h": self.flip_sprite}
         self.activated = []
-        self.flipped = []
         self.pos_drop = None
         self.subloc_drop = None
         self.create_pos_drop()
         self.create_subloc_drop()
 
     def apply_post_processing(self, sprite, setting):
-        try:
-            if setting == 0:
-                if sprite not in self.flipped:
-                    self.flip_sprite(sprite.texture)
-                    self.flipped.append(sprite)
-            else:
-                if sprite in self.flipped:
-                    self.flip_sprite(sprite.texture)
-                    self.flipped.remove(sprite)
-        except AttributeError:
-            pass
+        """Returns how sprite should be shown with setting, mirrored for 0. The sprite itself is left
+        alone, so everyone else showing it keeps their own orientation.
+        """
+        if isinstance(sprite, FlippedSprite):
+            sprite = sprite.sprite
+        if setting == 0 and sprite is not None:
+            return FlippedSprite(sprite)
         return sprite
 
-    def flip_sprite(self, sprite_texture):
-        sprite_texture.flip_horizontal()
-
     def on_checked_flip_h(self, value):
         user_handler = App.get_running_app().get_user_handler()
         if value:
@@ -265,6 +340,8 @@ class SpriteWindow(Widget):
     def __init__(self, **kwargs):
         super(SpriteWindow, self).__init__(**kwargs)
         self.subloc = None
+        # Whoever's chat is being shown, to show again once their sprite is decoded
+        self.speaker = None
         self.sprite_organizer = SpriteOrganizer()
         self.center_sprite = Image(allow_stretch=True, keep_ratio=False,
                                    opacity=0, size_hint=(None, None), size=(800, 600),
@@ -284,7 +361,12 @@ class SpriteWindow(Widget):
         self.sprite_organizer.add_sprite(self.overlay)
 
     def set_sprite(self, user, display_sub=True):
-        sprite = user.get_current_sprite()
+        sprite = user.get_current_sprite(wait=False)
+        sprite_prefetcher.note_displayed(user.username, sprite)
+        if display_sub:
+            self.speaker = user
+        if sprite.is_loading():
+            sprite.when_ready(self.redraw)
         if sprite.is_cg():
             self.set_cg(sprite, user)
             return
@@ -364,10 +446,11 @@ class SpriteWindow(Widget):
 
         main_scr = App.get_running_app().get_main_screen()
         self.subloc = subloc
+        self.pin_displayed_characters(subloc)
         if subloc.o_users:
             user = subloc.get_o_user()
             if user.get_subloc() == subloc:
-                sprite = user.get_current_sprite()
+                sprite = self.get_displayed_sprite(user)
                 option = user.get_sprite_option()
                 sprite = main_scr.sprite_settings.apply_post_processing(sprite, option)
                 if sprite is not None:
@@ -392,7 +475,7 @@ class SpriteWindow(Widget):
         if subloc.c_users:
             user = subloc.get_c_user()
             if user.get_subloc() == subloc:
-                sprite = user.get_current_sprite()
+                sprite = self.get_displayed_sprite(user)
                 option = user.get_sprite_option()
                 sprite = main_scr.sprite_settings.apply_post_processing(sprite, option)
                 if sprite is not None:
@@ -414,7 +497,7 @@ class SpriteWindow(Widget):
         if subloc.l_users:
             user = subloc.get_l_user()
             if user.get_subloc() == subloc:
-                sprite = user.get_current_sprite()
+                sprite = self.get_displayed_sprite(user)
                 option = user.get_sprite_option()
                 sprite = main_scr.sprite_settings.apply_post_processing(sprite, option)
                 if sprite is not None:
@@ -433,7 +516,7 @@ class SpriteWindow(Widget):
         if subloc.r_users:
             user = subloc.get_r_user()
             if user.get_subloc() == subloc:
-                sprite = user.get_current_sprite()
+                sprite = self.get_displayed_sprite(user)
                 option = user.get_sprite_option()
                 sprite = main_scr.sprite_settings.apply_post_processing(sprite, option)
                 if sprite is not None:
@@ -449,5 +532,31 @@ class SpriteWindow(Widget):
             self.right_sprite.texture = None
             self.right_sprite.opacity = 0
 
+    def get_displayed_sprite(self, user):
+        """The user's sprite, or a placeholder that's swapped for it once its page has been decoded."""
+        sprite = user.get_current_sprite(wait=False)
+        if sprite.is_loading():
+            sprite.when_ready(self.redraw)
+        return sprite
+
+    def redraw(self):
+        """Swaps placeholders for the sprites whose page just came in. The speaker is set again
+        rather than just redisplayed, as a CG is shown differently.
+        """
+        if self.speaker is not None and self.speaker.get_subloc() == self.subloc:
+            self.set_sprite(self.speaker)
+        else:
+            self.refresh_sub()
+
+    @staticmethod
+    def pin_displayed_characters(subloc):
+        """Keeps the sprite pages of everyone on screen out of the page cache's reach."""
+        displayed = [get_user() for present, get_user in ((subloc.o_users, subloc.get_o_user),
+                                                          (subloc.c_users, subloc.get_c_user),
+                                                          (subloc.l_users, subloc.get_l_user),
+                                                          (subloc.r_users, subloc.get_r_user)) if present]
+        page_cache.set_pins('displayed', [user.get_char().sprites_path for user in displayed
+                                          if user.get_char() is not None])
+
     def refresh_sub(self):
         self.display_sub(self.subloc)
@@ -0,0 +1,117 @@
+"""Keeps the latest character, location and nullpost of every user in the channel and hands
+them to each user that joins in one snapshot, so nobody has to announce their state to them.
+
+Run it next to the channel from the repository root:
+    python -m MysteryOnline.state_keeper [--nick MOStateKeeper] [--server ...] [--port ...] [--channel ...]
+Server and channel default to the ones in irc_channel_name.ini.
+"""
+import argparse
+import os
+import time
+from configparser import ConfigParser
+
+os.environ.setdefault('KIVY_NO_ARGS', '1')
+
+import irc.client
+from kivy.logger import Logger
+
+from MysteryOnline.codec import SNAPSHOT, encode_hello, encode_snapshot
+from MysteryOnline.fragment import MAX_LINE_BYTES
+from MysteryOnline.irc_mo import IrcConnection, SNAPSHOT_TYPES
+
+FRAME = 1.0 / 60.0
+
+
+class StateKeeper:
+
+    def __init__(self, irc_connection, reconnect_delay=5):
+        self.irc_connection = irc_connection
+        # Announce everything a client does so we never hold back fragments, deltas or location channels
+        self.irc_connection.capabilities += (SNAPSHOT,)
+        self.irc_connection.on_join_handler = self.on_join
+        self.irc_connection.on_users_handler = self.on_users
+        self.irc_connection.on_disconnect_handler = self.forget
+        self.irc_connection.set_connection_manager(self)
+        self.reconnect_delay = reconnect_delay
+        self.connected = True
+        # sender -> {message type: full wire line}
+        self.states = {}
+
+    def update(self):
+        """Takes in whatever state the channel sent since the last call."""
+        msg = self.irc_connection.get_msg()
+        while msg is not None:
+            if isinstance(msg, SNAPSHOT_TYPES):
+                # Deltas have been applied by now, so this is always the full message
+                self.states.setdefault(msg.sender, {})[type(msg)] = msg.to_irc()
+            msg = self.irc_connection.get_msg()
+
+    def get_snapshot(self):
+        """(sender, line) pairs, each user's location first so the rest applies to the right place."""
+        return [(sender, state[message_type]) for sender, state in self.states.items()
+                for message_type in SNAPSHOT_TYPES if message_type in state]
+
+    def on_join(self, nick):
+        self.update()
+        connection = self.irc_connection.connection
+        connection.notice(nick, encode_hello(capabilities=self.irc_connection.capabilities))
+        notices = encode_snapshot(self.get_snapshot(), MAX_LINE_BYTES)
+        for notice in notices:
+            connection.notice(nick, notice)
+        Logger.info('StateKeeper: Sent {} the state of {} user(s) in {} notice(s)'.format(
+            nick, len(self.states), len(notices)))
+
+    def on_users(self, names):
+        pass
+
+    def forget(self, nick):
+        self.states.pop(nick, None)
+
+    def on_connection_lost(self):
+        # Everyone announces to us again when we come back, as we're a newcomer to them
+        Logger.warning('StateKeeper: Connection lost')
+        self.connected = False
+        self.states.clear()
+
+    def on_rejoined(self):
+        Logger.info('StateKeeper: Rejoined')
+        self.irc_connection.send_capabilities()
+
+    def receive_pong(self):
+        pass
+
+    def run(self):
+        while True:
+            frame_start = time.perf_counter()
+            if not self.connected:
+                self.reconnect()
+            self.irc_connection.process()
+            self.update()
+            time.sleep(max(0.0, FRAME - (time.perf_counter() - frame_start)))
+
+    def reconnect(self):
+        time.sleep(self.reconnect_delay)
+        try:
+            self.irc_connection.reconnect()
+            self.connected = True
+        except irc.client.ServerConnectionError:
+            Logger.warning('StateKeeper: Could not reconnect, retrying in {}s'.format(self.reconnect_delay))
+
+
+def main():
+    config = ConfigParser()
+    config.read('irc_channel_name.ini')
+    parser = argparse.ArgumentParser(description="Hands joining users everyone's state in one snapshot.")
+    parser.add_argument('--nick', default='MOStateKeeper')
+    parser.add_argument('--server', default=config.get('IRC Server name', 'irc_server', fallback='irc.swiftirc.net'))
+    parser.add_argument('--port', type=int, default=config.getint('IRC Server name', 'irc_server_port', fallback=6666))
+    parser.add_argument('--channel', default=config.get('Channel name', 'channel', fallback='##mysteryonlinetest'))
+    parser.add_argument('--password', default=config.get('Channel name', 'password', fallback=None))
+    args = parser.parse_args()
+    connection = IrcConnection(args.server, args.port, args.channel, args.nick, args.password, queue_depth=0,
+                               location_channels=True)
+    StateKeeper(connection).run()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,148 @@
+import threading
+import time
+from collections import deque
+
+from kivy.clock import Clock
+from kivy.logger import Logger
+
+# Record kinds
+RECEIVED = '<'
+SENT = '>'
+PRIVATE_RECEIVED = '<p'
+PRIVATE_SENT = '>p'
+
+SEPARATOR = '\t'
+
+
+class TrafficRecord:
+
+    def __init__(self, timestamp, kind, peer, line):
+        self.timestamp = timestamp
+        self.kind = kind
+        self.peer = peer
+        self.line = line
+
+
+class TrafficRecorder:
+    """Appends every raw IRC line the connection sees to a file, one per line:
+    seconds since recording started, kind, sender or target, and the line, tab separated.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, 'w', encoding='utf-8', buffering=1)
+        self.lock = threading.Lock()
+        self.start = time.monotonic()
+
+    def record(self, kind, peer, line):
+        entry = "{:.3f}{sep}{}{sep}{}{sep}{}\n".format(time.monotonic() - self.start, kind, peer, line,
+                                                      sep=SEPARATOR)
+        with self.lock:
+            self.file.write(entry)
+
+    def close(self):
+        with self.lock:
+            self.file.close()
+
+
+def read_traffic(path):
+    """Yields the TrafficRecords of a recording in order."""
+    with open(path, encoding='utf-8') as f:
+        for entry in f:
+            timestamp, kind, peer, line = entry.rstrip('\n').split(SEPARATOR, 3)
+            yield TrafficRecord(float(timestamp), kind, peer, line)
+
+
+def percentile(values, fraction):
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def summarize_frames(frame_times):
+    """Mean, p95 and worst frame time in milliseconds, and how many frames went over 1/30 s."""
+    if not frame_times:
+        return {'frames': 0, 'mean_ms': 0.0, 'p95_ms': 0.0, 'max_ms': 0.0, 'slow_frames': 0}
+    ordered = sorted(frame_times)
+    return {'frames': len(ordered), 'mean_ms': sum(ordered) / len(ordered) * 1000,
+            'p95_ms': percentile(ordered, 0.95) * 1000, 'max_ms': ordered[-1] * 1000,
+            'slow_frames': sum(1 for t in ordered if t > 1 / 30.0)}
+
+
+class TrafficReplayer:
+    """Feeds the received lines of a recording back into an IrcConnection as if they came off the network,
+    so they go through the same parsing, queueing and execute as live traffic.
+
+    speed scales the recorded gaps, 0 replays as fast as the client keeps up with. Outgoing
+    messages are muted meanwhile so the live channel doesn't see our reactions to the replay.
+    Lines are handed to the connection's network thread in batches, as live lines are decoded
+    there too. Frame times are collected until every replayed message has been executed.
+    """
+
+    MAX_BACKLOG = 100
+
+    def __init__(self, irc_connection, path, speed=1.0, on_finished=None):
+        self.irc_connection = irc_connection
+        self.speed = speed
+        self.on_finished = on_finished
+        self.records = deque(record for record in read_traffic(path)
+                             if record.kind in (RECEIVED, PRIVATE_RECEIVED))
+        self.first_timestamp = self.records[0].timestamp if self.records else 0.0
+        # handed_over is only written on the UI thread, replayed only where lines are decoded
+        self.handed_over = 0
+        self.replayed = 0
+        self.frame_times = []
+        self.started = None
+        self.frame_event = None
+
+    def start(self):
+        Logger.info('Replay: {} lines at {}'.format(len(self.records), self.describe_speed()))
+        self.irc_connection.muted = True
+        self.started = time.monotonic()
+        self.frame_event = Clock.schedule_interval(self.update, 0)
+
+    def describe_speed(self):
+        if self.speed <= 0:
+            return "max speed"
+        return "{:g}x".format(self.speed)
+
+    def update(self, dt):
+        if self.replayed:
+            self.frame_times.append(dt)
+        batch = []
+        if self.speed > 0:
+            elapsed = (time.monotonic() - self.started) * self.speed
+            while self.records and self.records[0].timestamp - self.first_timestamp <= elapsed:
+                batch.append(self.records.popleft())
+        else:
+            while self.records and self.backlog() + len(batch) < self.MAX_BACKLOG:
+                batch.append(self.records.popleft())
+        if batch:
+            self.handed_over += len(batch)
+            self.irc_connection.run_on_network(self.replay, batch)
+        if not self.records and self.backlog() == 0:
+            self.stop()
+
+    def backlog(self):
+        return self.handed_over - self.replayed + self.irc_connection.msg_q.size() + \
+            len(self.irc_connection.incoming)
+
+    def replay(self, records):
+        for record in records:
+            if record.kind == RECEIVED:
+                self.irc_connection.receive_pubmsg(record.peer, record.line)
+            else:
+                self.irc_connection.receive_privmsg(record.peer, record.line)
+            # Counted once its message is queued, so the backlog never reads empty in between
+            self.replayed += 1
+
+    def stop(self):
+        self.frame_event.cancel()
+        self.irc_connection.muted = False
+        # Whatever we said during the replay never went out, start from full messages again
+        self.irc_connection.delta_encoder.reset()
+        summary = summarize_frames(self.frame_times)
+        summary['lines'] = self.replayed
+        summary['seconds'] = time.monotonic() - self.started
+        Logger.info('Replay: {lines} lines in {seconds:.1f}s over {frames} frames, mean {mean_ms:.1f}ms, '
+                    'p95 {p95_ms:.1f}ms, max {max_ms:.1f}ms, {slow_frames} slow'.format(**summary))
+        if self.on_finished is not None:
+            self.on_finished(summary)
@@ -73,9 +73,9 @@ class User:
     def set_current_sprite(self, num):
         self.current_sprite = num
 
-    def get_current_sprite(self) -> Sprite:
+    def get_current_sprite(self, wait=True) -> Sprite:
         if self.character is not None:
-            return self.character.get_sprite(self.current_sprite)
+            return self.character.get_sprite(self.current_sprite, wait)
         else:
             red_herring = characters["RedHerring"]
             red_herring.load()
@@ -226,6 +226,8 @@ class CurrentUserHandler:
         message_factory = App.get_running_app().get_message_factory()
         message = message_factory.build_location_message(self.current_loc.name)
         self.connection_manager.send_msg(message)
+        self.connection_manager.join_location(self.current_loc.name)
+        self.connection_manager.prefetch_location()
 
     def on_current_subloc_name(self, *args):
         subloc = self.current_loc.get_sub(self.current_subloc_name)
@@ -0,0 +1,82 @@
+"""Compares the Reactor-polling and asyncio IrcConnection backends.
+
+A flooding client sends a realistic mix of lines through the loopback IRC
+server while the connection under test is serviced at 60 frames per second,
+the same way the app does it. Run from the repository root:
+    python tests/backend_benchmark.py [--count 5000]
+"""
+import argparse
+import os
+import socket
+import sys
+import time
+
+sys.path.insert(0, os.getcwd())
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+os.environ.setdefault('KIVY_NO_ARGS', '1')
+
+from MysteryOnline.irc_mo import IrcConnection, MessageFactory
+from MysteryOnline.irc_aio import AioIrcConnection
+from codec_benchmark import MIXES, generate
+from loopback_irc import LoopbackIrcServer
+
+CHANNEL = "#benchmark"
+FRAME = 1.0 / 60.0
+
+
+def connect_flooder(port):
+    sock = socket.create_connection(("127.0.0.1", port))
+    sock.sendall("NICK flooder\r\nUSER flooder 0 * :flooder\r\nJOIN {}\r\n".format(CHANNEL).encode())
+    received = b""
+    while b" 366 " not in received:
+        received += sock.recv(4096)
+    return sock
+
+
+def ignore(*args):
+    pass
+
+
+def run_backend(connection_class, lines):
+    server = LoopbackIrcServer().start()
+    connection = connection_class("127.0.0.1", server.port, CHANNEL, "reader", queue_depth=0)
+    connection.on_join_handler = connection.on_users_handler = connection.on_disconnect_handler = ignore
+    if connection.threaded:
+        connection.start_network_thread()
+    while not connection.is_connected():
+        connection.process()
+        connection.process_incoming()
+        time.sleep(0.01)
+
+    flooder = connect_flooder(server.port)
+    payload = "".join("PRIVMSG {} :{}\r\n".format(CHANNEL, line) for line in lines).encode('utf-8')
+    start = time.perf_counter()
+    flooder.sendall(payload)
+    frames = 0
+    while connection.msg_q.size() < len(lines):
+        frame_start = time.perf_counter()
+        connection.process()
+        connection.process_incoming()
+        frames += 1
+        time.sleep(max(0.0, FRAME - (time.perf_counter() - frame_start)))
+    elapsed = time.perf_counter() - start
+
+    flooder.close()
+    if connection.threaded:
+        connection.stop_network_thread()
+    server.stop()
+    return elapsed, frames
+
+
+def run(count):
+    messages, lines = generate(MessageFactory(), MIXES['roleplay'], count)
+    for name, connection_class in (("reactor", IrcConnection), ("asyncio", AioIrcConnection)):
+        elapsed, frames = run_backend(connection_class, lines)
+        print("{:<8} {:>6} msgs in {:6.2f}s over {:>4} frames  {:>9.0f} msg/s".format(
+            name, count, elapsed, frames, count / elapsed))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--count', type=int, default=5000)
+    run(parser.parse_args().count)
@@ -0,0 +1,88 @@
+"""Headless parse/encode benchmark for the wire codec.
+
+Run from the repository root:
+    python tests/codec_benchmark.py [--count 200000]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.getcwd())
+os.environ.setdefault('KIVY_NO_ARGS', '1')
+
+from MysteryOnline.irc_mo import MessageFactory
+
+LOCATIONS = ["Hakuryou", "Tomoyo", "Rokkenjima"]
+SUBLOCATIONS = ["Aqua1", "Boat", "Classroom", "Courtyard"]
+CHARACTERS = ["RedHerring", "Narrator", "Battler", "Ange", "Maria"]
+POSITIONS = ["center", "left", "right"]
+TEXT = "Just a perfectly ordinary line of roleplay, maybe with a #hashtag in it."
+
+# message kind -> weight
+MIXES = {
+    'roleplay': {'chat': 60, 'icon': 25, 'ooc': 10, 'looc': 3, 'roll': 1, 'music': 1},
+    'nullpost_spam': {'chat': 10, 'icon': 85, 'ooc': 5},
+    'join_storm': {'location': 30, 'character': 30, 'icon': 30, 'chat': 10},
+}
+
+
+def build(factory, kind, rng):
+    loc = rng.choice(LOCATIONS)
+    sub = rng.choice(SUBLOCATIONS)
+    char = rng.choice(CHARACTERS)
+    sprite = str(rng.randint(1, 120))
+    pos = rng.choice(POSITIONS)
+    if kind == 'chat':
+        return factory.build_chat_message(content=TEXT, location=loc, sublocation=sub, character=char, sprite=sprite,
+                                          position=pos, color_id=rng.randint(0, 6), sprite_option=rng.choice([0, 1]),
+                                          sfx_name=None)
+    if kind == 'icon':
+        return factory.build_icon_message(location=loc, sublocation=sub, character=char, sprite=sprite, position=pos,
+                                          sprite_option=rng.choice([0, 1]), dance=False)
+    if kind == 'ooc':
+        return factory.build_ooc_message(TEXT)
+    if kind == 'looc':
+        return factory.build_looc_message(loc, TEXT)
+    if kind == 'roll':
+        return factory.build_roll_message("2d6: 3 + 4 = 7")
+    if kind == 'music':
+        return factory.build_music_message("Track", "https://example.com/track.mp3")
+    if kind == 'location':
+        return factory.build_location_message(loc)
+    return factory.build_character_message(char, "no link", "1.0")
+
+
+def generate(factory, mix, count, seed=0):
+    rng = random.Random(seed)
+    kinds = list(mix.keys())
+    weights = list(mix.values())
+    messages = [build(factory, kind, rng) for kind in rng.choices(kinds, weights, k=count)]
+    lines = [m.to_irc() for m in messages]
+    return messages, lines
+
+
+def run(count):
+    factory = MessageFactory()
+    for name, mix in MIXES.items():
+        messages, lines = generate(factory, mix, count)
+
+        start = time.perf_counter()
+        for line in lines:
+            factory.build_from_irc(line, "sender")
+        decode_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        for message in messages:
+            message.to_irc()
+        encode_time = time.perf_counter() - start
+
+        print("{:<14} decode {:>10.0f} msg/s   encode {:>10.0f} msg/s".format(
+            name, count / decode_time, count / encode_time))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--count', type=int, default=200000)
+    run(parser.parse_args().count)
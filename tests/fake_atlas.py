@@ -0,0 +1,48 @@
+"""Stand-ins for an Icarus atlas and its textures, for tests that don't need a window."""
+
+
+class FakeAtlas:
+
+    def __init__(self, filename, pages=None):
+        self.filename = filename
+        # sprite name -> page
+        self.index = pages or {}
+        self.loaded_pages = set()
+        self.waiting = {}
+        self.unloaded = []
+
+    def get_page(self, key=None):
+        if key is None:
+            return next(iter(self.index.values()))
+        return self.index.get(key)
+
+    def is_page_loaded(self, page):
+        return page in self.loaded_pages
+
+    def when_page_loaded(self, page, callback):
+        self.waiting.setdefault(page, []).append(callback)
+
+    def finish(self, page):
+        self.loaded_pages.add(page)
+        for callback in self.waiting.pop(page):
+            callback()
+
+    def unload_page(self, page):
+        self.unloaded.append(page)
+        self.loaded_pages.discard(page)
+
+
+class FakeTexture:
+    """Keeps track of which GPU texture it's a region of and whether it's mirrored, like a kivy Texture."""
+
+    def __init__(self, owner=None, flipped=False):
+        self.owner = owner
+        self.flipped = flipped
+        self.width = 64
+        self.height = 128
+
+    def get_region(self, x, y, width, height):
+        return FakeTexture(self.owner or self, self.flipped)
+
+    def flip_horizontal(self):
+        self.flipped = not self.flipped
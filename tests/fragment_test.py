@@ -0,0 +1,69 @@
+import unittest
+from MysteryOnline.fragment import Fragmenter, Reassembler, is_fragment, split_chunks
+from MysteryOnline.exceptions import MessageTooLongError
+
+
+class FragmentTests(unittest.TestCase):
+
+    def setUp(self):
+        self.fragmenter = Fragmenter(max_bytes=60)
+        self.reassembler = Reassembler()
+
+    def reassemble(self, lines, sender="sender"):
+        result = None
+        for line in lines:
+            result = self.reassembler.add(sender, line)
+        return result
+
+    def test_short_lines_pass_through(self):
+        self.assertEqual(["OOC#hi"], self.fragmenter.split("OOC#hi"))
+
+    def test_long_line_round_trip(self):
+        line = "i#" + "#".join("field {}".format(i) for i in range(40))
+        fragments = self.fragmenter.split(line)
+        self.assertGreater(len(fragments), 1)
+        self.assertTrue(all(is_fragment(f) and len(f.encode('utf-8')) <= 60 for f in fragments))
+        self.assertEqual(line, self.reassemble(fragments))
+
+    def test_out_of_order_and_interleaved_senders(self):
+        first = self.fragmenter.split("a" * 150)
+        second = self.fragmenter.split("b" * 150)
+        self.assertIsNone(self.reassembler.add("x", first[1]))
+        self.assertIsNone(self.reassembler.add("y", second[0]))
+        self.assertIsNone(self.reassembler.add("x", first[2]))
+        self.assertEqual("a" * 150, self.reassemble([first[0]] + first[3:], "x"))
+        self.assertEqual("b" * 150, self.reassemble(second[1:], "y"))
+
+    def test_multibyte_characters_are_not_split(self):
+        text = "é" * 50
+        chunks = split_chunks(text, 7)
+        self.assertEqual(text, "".join(chunks))
+        self.assertTrue(all(len(chunk.encode('utf-8')) <= 7 for chunk in chunks))
+
+    def test_buffer_is_bounded(self):
+        reassembler = Reassembler(max_pending=2)
+        for i in range(3):
+            reassembler.add("x", "f#{}#0#2#part".format(i))
+        stats = reassembler.get_stats()
+        self.assertEqual(2, stats['pending'])
+        self.assertEqual(1, stats['expired'])
+        self.assertIsNone(reassembler.add("x", "f#0#1#2#part"))
+
+    def test_stale_fragments_time_out(self):
+        reassembler = Reassembler(timeout=0)
+        reassembler.add("x", "f#0#0#2#part")
+        self.assertIsNone(reassembler.add("x", "f#0#1#2#part"))
+        self.assertEqual(1, reassembler.get_stats()['expired'])
+
+    def test_malformed_fragments_are_rejected(self):
+        self.assertIsNone(self.reassembler.add("x", "f#0#5#2#part"))
+        self.assertIsNone(self.reassembler.add("x", "f#0#zero#2#part"))
+        self.assertEqual(2, self.reassembler.get_stats()['rejected'])
+
+    def test_too_many_fragments(self):
+        with self.assertRaises(MessageTooLongError):
+            self.fragmenter.split("a" * 10000)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,10 +1,14 @@
 from MysteryOnline.icarus import Icarus
+from MysteryOnline.page_cache import PageCache
+from fake_atlas import FakeTexture
 from kivy.app import App
 from kivy.uix.button import Button
 from kivy.clock import Clock
+from unittest import mock
 import json
 import os
 import random
+import tempfile
 import unittest
 
 
@@ -120,5 +124,56 @@ class IcarusTests(unittest.TestCase):
         return meta, subs
 
 
+class IcarusIndexTests(unittest.TestCase):
+    """Index and page bookkeeping, with fake textures so no window is needed."""
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        path = os.path.join(self.directory.name, "sprites.atlas")
+        with open(path, 'w') as fd:
+            json.dump({"sprites-0.png": {"1": [0, 0, 10, 10], "2": [10, 0, 10, 10]},
+                       "sprites-1.png": {"2": [0, 0, 10, 10], "3": [10, 0, 10, 10]}}, fd)
+        self.first = os.path.join(self.directory.name, "sprites-0.png")
+        self.second = os.path.join(self.directory.name, "sprites-1.png")
+        self.atlas = Icarus(path)
+        self.cache = PageCache(budget=10 ** 9)
+        patcher = mock.patch('MysteryOnline.icarus.page_cache', self.cache)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_index_lookup(self):
+        self.assertEqual(self.first, self.atlas.get_page())
+        self.assertEqual(self.first, self.atlas.get_page("1"))
+        # A name on several pages comes from the last one
+        self.assertEqual(self.second, self.atlas.get_page("2"))
+        self.assertIsNone(self.atlas.get_page("4"))
+        self.assertEqual(["1"], self.atlas.get_page_names(self.first))
+
+    def test_missing_atlas_has_no_pages(self):
+        self.assertIsNone(Icarus(os.path.join(self.directory.name, "icons.atlas")).get_page("1"))
+
+    def test_add_page(self):
+        texture = FakeTexture()
+        self.atlas.load_index()
+        self.atlas.add_page(self.first, texture)
+        self.assertTrue(self.atlas.is_page_loaded(self.first))
+        self.assertFalse(self.atlas.is_page_loaded(self.second))
+        self.assertEqual({"1"}, set(self.atlas.textures))
+        self.assertIs(texture, self.atlas.get_sprite("1").texture.owner)
+        self.assertEqual(texture.width * texture.height * 4, self.cache.size)
+
+    def test_unload_page(self):
+        self.atlas.load_index()
+        self.atlas.add_page(self.first, FakeTexture())
+        self.atlas.add_page(self.second, FakeTexture())
+        self.atlas.unload_page(self.second)
+        self.assertEqual({"1"}, set(self.atlas.textures))
+        self.assertFalse(self.atlas.is_page_loaded(self.second))
+        self.assertTrue(self.atlas.is_page_loaded(self.first))
+
+
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,40 @@
+import time
+import unittest
+
+import irc.client
+
+from MysteryOnline.irc_aio import AioIrcConnection
+from loopback_irc import LoopbackIrcServer
+
+
+class AioIrcConnectionTests(unittest.TestCase):
+
+    def setUp(self):
+        self.server = LoopbackIrcServer().start()
+        self.connection = AioIrcConnection("127.0.0.1", self.server.port, "#test", "tester")
+        self.connection.on_join_handler = self.connection.on_users_handler = lambda *args: None
+
+    def tearDown(self):
+        self.connection.stop_network_thread()
+        self.server.stop()
+
+    def wait_until(self, condition):
+        deadline = time.monotonic() + 5
+        while not condition() and time.monotonic() < deadline:
+            self.connection.process_incoming()
+            time.sleep(0.01)
+        self.assertTrue(condition())
+
+    def test_sending_after_a_disconnect_raises(self):
+        self.wait_until(self.connection.is_connected)
+        server_connection = self.connection.connection
+        server_connection.privmsg("#test", "OOC#hi")
+        self.connection.close()
+        self.wait_until(lambda: server_connection.transport.is_closing())
+        # The send queue puts the message back and reconnects on this
+        with self.assertRaises(irc.client.ServerNotConnectedError):
+            server_connection.privmsg("#test", "OOC#lost")
+
+
+if __name__ == '__main__':
+    unittest.main()
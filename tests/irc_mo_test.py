@@ -0,0 +1,616 @@
+import sys
+import threading
+import time
+import tracemalloc
+import unittest
+from kivy.clock import Clock
+from MysteryOnline.irc_mo import MessageFactory, ChatMessage, IconMessage, CharacterMessage, OOCMessage, \
+    LOOCMessage, MusicMessage, ItemMessage, ChoiceReturnMessage, IncorrectMessageTypeError, MessageQueue, \
+    ClearMessage, IrcConnection, ConnectionManager, LocationMessage, TokenBucket, OutboundQueue, location_channel_name
+from MysteryOnline.codec import PeerCapabilities, FRAGMENTS, ROOMS, CAPABILITIES, encode_hello, decode_hello, \
+    DeltaEncoder
+from MysteryOnline.irc_mo import message_codec
+from loopback_irc import LoopbackIrcServer, ScriptedClient
+from codec_benchmark import MIXES, generate
+
+
+class MessageCodecTests(unittest.TestCase):
+
+    def setUp(self):
+        self.factory = MessageFactory()
+
+    def round_trip(self, message):
+        return self.factory.build_from_irc(message.to_irc(), "sender")
+
+    def test_chat_message_round_trip(self):
+        message = self.factory.build_chat_message(content="Hello #1", location="Hakuryou", sublocation="Aqua1",
+                                                  character="RedHerring", sprite="3", position="left",
+                                                  color_id=2, sprite_option=0, sfx_name=None)
+        result = self.round_trip(message)
+        self.assertIsInstance(result, ChatMessage)
+        self.assertEqual("Hakuryou", result.location)
+        self.assertEqual("Hello #1", result.content)
+        self.assertEqual("2", result.color_id)
+        self.assertIsNone(result.sfx_name)
+        self.assertEqual("sender", result.sender)
+
+    def test_icon_message_with_and_without_dance(self):
+        message = self.factory.build_icon_message(location="Hakuryou", sublocation="Aqua1", character="RedHerring",
+                                                  sprite="3", position="center", sprite_option=1, dance=True)
+        result = self.round_trip(message)
+        self.assertIsInstance(result, IconMessage)
+        self.assertEqual("True", result.dance)
+        result = self.factory.build_from_irc("sc#Hakuryou#Aqua1#RedHerring#3#center#1", "sender")
+        self.assertFalse(result.dance)
+        self.assertEqual("1", result.sprite_option)
+
+    def test_prefixed_types(self):
+        self.assertIsInstance(self.factory.build_from_irc("c#RedHerring#no link#1.0", "s"), CharacterMessage)
+        self.assertIsInstance(self.factory.build_from_irc("LOOC#Hakuryou#hi", "s"), LOOCMessage)
+        self.assertIsInstance(self.factory.build_from_irc("i#Key#A key#url#owner", "s"), ItemMessage)
+        self.assertIsInstance(self.factory.build_from_irc("ch2#asker#True#yes", "s"), ChoiceReturnMessage)
+
+    def test_optional_fields(self):
+        result = self.factory.build_from_irc("c#RedHerring", "s")
+        self.assertEqual("RedHerring", result.character)
+        self.assertEqual("", result.version)
+        result = self.factory.build_from_irc("m#stop", "s")
+        self.assertEqual("stop", result.track_name)
+        self.assertIsNone(result.url)
+
+    def test_music_none_is_sent_as_zero(self):
+        message = self.factory.build_music_message(None, None)
+        self.assertEqual("m#0#0", message.to_irc())
+        result = self.round_trip(message)
+        self.assertIsInstance(result, MusicMessage)
+        self.assertIsNone(result.track_name)
+
+    def test_prefix_wins_over_field_count(self):
+        result = self.factory.build_from_irc("OOC#a#b#c#d#e#f#g#h#i", "s")
+        self.assertIsInstance(result, OOCMessage)
+        self.assertEqual("a#b#c#d#e#f#g#h#i", result.content)
+
+    def test_unknown_line_is_ooc(self):
+        result = self.factory.build_from_irc("just talking", "s")
+        self.assertIsInstance(result, OOCMessage)
+        self.assertEqual("just talking", result.content)
+
+    def test_received_messages_have_every_attribute(self):
+        lines = ("Hakuryou#Aqua1#RedHerring#3#left#0#0#0#Hi", "sc#Hakuryou#Aqua1#RedHerring#3#center#1",
+                 "ch#Text#Options#everyone", "ch2#asker#True#yes", "c#RedHerring", "l#Hakuryou", "OOC#hi",
+                 "LOOC#Hakuryou#hi", "m#stop", "r#2d6", "i#Key#A key#url#owner", "cl#Hakuryou")
+        for line in lines:
+            result = self.factory.build_from_irc(line, "sender")
+            for name in type(result).__slots__ + ('sender',):
+                getattr(result, name)
+
+    def test_truncated_message_is_rejected(self):
+        with self.assertRaises(IncorrectMessageTypeError):
+            self.factory.build_from_irc("sc#Hakuryou#Aqua1", "s")
+
+
+class PlainRecord:
+    """What a decoded message used to cost: an attribute dict and its own copy of every value."""
+
+    def __init__(self, sender, fields, values):
+        self.sender = sender
+        for name, value in zip(fields, values):
+            setattr(self, name, value)
+
+
+class MessageMemoryTests(unittest.TestCase):
+
+    def setUp(self):
+        self.factory = MessageFactory()
+        messages, self.lines = generate(self.factory, MIXES['roleplay'], 10000)
+
+    def bytes_per_message(self, build):
+        tracemalloc.start()
+        try:
+            before = tracemalloc.get_traced_memory()[0]
+            messages = [build(line) for line in self.lines]
+            retained = tracemalloc.get_traced_memory()[0] - before
+        finally:
+            tracemalloc.stop()
+        return retained / len(messages)
+
+    def build_plain(self, line):
+        schema, values = message_codec.decode(line)
+        return PlainRecord("sender", schema.fields, [value[:1] + value[1:] for value in values])
+
+    def build_interned(self, line):
+        message = self.factory.build_from_irc(line, "sender")
+        message.intern_fields()
+        return message
+
+    def test_slotted_interned_messages_are_smaller(self):
+        compact = self.bytes_per_message(self.build_interned)
+        plain = self.bytes_per_message(self.build_plain)
+        self.assertLess(compact, plain * 0.6)
+
+    def test_identifiers_are_shared_in_a_backlog(self):
+        queue = MessageQueue(share_depth=1)
+        first = self.factory.build_from_irc("Hakuryou#Aqua1#RedHerring#3#center#0#1#0#Hi", "a")
+        second = self.factory.build_from_irc("sc#Hakuryou#Aqua1#RedHerring#3#center#1#False", "b")
+        third = self.factory.build_from_irc("sc#Hakuryou#Aqua1#RedHerring#4#center#1#False", "c")
+        for message in (first, second, third):
+            queue.enqueue(message)
+        # Only the message that had to wait behind another one is interned
+        self.assertIsNot(first.location, third.location)
+        self.assertIs(third.location, sys.intern("Hakuryou"))
+        self.assertIs(third.character, sys.intern("RedHerring"))
+        self.assertFalse(hasattr(first, '__dict__'))
+
+
+class DeltaEncodingTests(unittest.TestCase):
+
+    def setUp(self):
+        self.factory = MessageFactory()
+        self.encoder = DeltaEncoder(message_codec, keyframe_interval=2)
+
+    def send(self, message, sender="sender"):
+        line = self.encoder.encode(message.schema, message.get_fields())
+        self.encoder.commit()
+        return line, self.factory.build_from_irc(line, sender)
+
+    def chat(self, sprite, content, sfx_name=None):
+        return self.factory.build_chat_message(content=content, location="Hakuryou", sublocation="Aqua1",
+                                               character="RedHerring", sprite=sprite, position="left", color_id=0,
+                                               sprite_option=0, sfx_name=sfx_name)
+
+    def test_unchanged_fields_are_left_out(self):
+        line, first = self.send(self.chat("1", "Hello"))
+        self.assertEqual("Hakuryou#Aqua1#RedHerring#1#left#0#0#0#Hello", line)
+        line, second = self.send(self.chat("2", "Bye #2", sfx_name="boom"))
+        self.assertEqual("dc#1#8#2#boom#Bye #2", line)
+        self.assertIsInstance(second, ChatMessage)
+        self.assertEqual(("Hakuryou", "2", "Bye #2", "boom"),
+                         (second.location, second.sprite, second.content, second.sfx_name))
+        line, third = self.send(self.chat("2", "Again"))
+        self.assertIsNone(third.sfx_name)
+
+    def test_keyframes(self):
+        lines = [self.send(self.chat("1", str(i)))[0] for i in range(4)]
+        self.assertEqual([False, True, True, False], [line.startswith("dc#") for line in lines])
+        self.encoder.reset()
+        lines = [self.send(self.chat("1", str(i)))[0] for i in range(4)]
+        self.assertEqual([False, True, True, False], [line.startswith("dc#") for line in lines])
+
+    def test_lines_that_did_not_go_out_are_not_remembered(self):
+        self.send(self.chat("1", "Hello"))
+        dropped = self.chat("2", "Too long")
+        self.encoder.encode(dropped.schema, dropped.get_fields())
+        line, result = self.send(self.chat("1", "Bye"))
+        self.assertEqual("dc#1#0#0#Bye", line)
+        self.assertEqual("1", result.sprite)
+
+    def test_icon_delta(self):
+        message = self.factory.build_icon_message(location="Hakuryou", sublocation="Aqua1", character="RedHerring",
+                                                  sprite="3", position="center", sprite_option=1, dance=False)
+        self.send(message)
+        message.sprite = "4"
+        line, result = self.send(message)
+        self.assertEqual("ds#1#8#4", line)
+        self.assertIsInstance(result, IconMessage)
+        self.assertEqual(("4", "center", "False"), (result.sprite, result.position, result.dance))
+
+    def test_delta_without_state_is_rejected(self):
+        self.send(self.chat("1", "Hello"))
+        line, result = self.send(self.chat("2", "Hello"))
+        with self.assertRaises(IncorrectMessageTypeError):
+            self.factory.build_from_irc(line, "someone else")
+        self.factory.forget_sender("sender")
+        with self.assertRaises(IncorrectMessageTypeError):
+            self.factory.build_from_irc(line, "sender")
+
+    def test_delta_after_a_missed_line_waits_for_the_next_keyframe(self):
+        self.send(self.chat("1", "Hello"))
+        missed = self.chat("2", "Missed")
+        self.encoder.encode(missed.schema, missed.get_fields())
+        self.encoder.commit()
+        line = self.encoder.encode(missed.schema, self.chat("2", "Stale").get_fields())
+        self.encoder.commit()
+        with self.assertRaises(IncorrectMessageTypeError):
+            self.factory.build_from_irc(line, "sender")
+        line, result = self.send(self.chat("3", "Keyframe"))
+        self.assertFalse(line.startswith("dc#"))
+        line, result = self.send(self.chat("3", "Back in step"))
+        self.assertTrue(line.startswith("dc#"))
+        self.assertEqual(("3", "Back in step"), (result.sprite, result.content))
+
+
+class MessageQueueTests(unittest.TestCase):
+
+    def test_fifo_within_lane(self):
+        queue = MessageQueue()
+        first, second = OOCMessage("a", "1"), OOCMessage("b", "2")
+        queue.enqueue(first)
+        queue.enqueue(second)
+        self.assertIs(first, queue.dequeue())
+        self.assertIs(second, queue.dequeue())
+        self.assertIsNone(queue.dequeue())
+        self.assertTrue(queue.is_empty())
+
+    def test_lanes_are_served_by_priority(self):
+        queue = MessageQueue()
+        chat = ChatMessage("a", content="hi")
+        icon = IconMessage("b")
+        ooc = OOCMessage("a", "hi")
+        clear = ClearMessage("c", "Hakuryou")
+        for msg in (chat, icon, ooc, clear):
+            queue.enqueue(msg)
+        self.assertEqual([clear, ooc, icon, chat], [queue.dequeue() for _ in range(4)])
+
+    def test_state_waits_for_earlier_chat_of_its_sender(self):
+        queue = MessageQueue()
+        chat = ChatMessage("a", content="hi", sprite="1")
+        nullpost = IconMessage("a", sprite="2")
+        other = IconMessage("b", sprite="3")
+        for msg in (chat, nullpost, other):
+            queue.enqueue(msg)
+        # The text box is busy, chat stays queued and so does the nullpost after it
+        self.assertIs(other, queue.dequeue(MessageQueue.NON_CHAT_LANES))
+        self.assertIsNone(queue.dequeue(MessageQueue.NON_CHAT_LANES))
+        self.assertFalse(queue.has_messages(MessageQueue.NON_CHAT_LANES))
+        self.assertEqual(2, queue.size())
+        shown = queue.dequeue()
+        queue.put_back(shown)
+        self.assertIsNone(queue.dequeue(MessageQueue.NON_CHAT_LANES))
+        # Once the chat is shown, the nullpost is next and the sender ends on its sprite
+        sprites = [msg.sprite for msg in iter(queue.dequeue, None)]
+        self.assertEqual(["1", "2"], sprites)
+        self.assertTrue(queue.is_empty())
+
+    def test_put_back_goes_to_the_head_of_its_lane(self):
+        queue = MessageQueue()
+        first, second = ChatMessage("a", content="1"), ChatMessage("a", content="2")
+        queue.enqueue(first)
+        queue.enqueue(second)
+        msg = queue.dequeue()
+        queue.put_back(msg)
+        self.assertIs(first, queue.dequeue())
+
+    def test_chat_put_back_can_be_taken_again(self):
+        queue = MessageQueue()
+        chat = ChatMessage("a", content="hi", sprite="1")
+        queue.enqueue(chat)
+        queue.put_back(queue.dequeue())
+        self.assertIs(chat, queue.dequeue())
+        self.assertTrue(queue.is_empty())
+        # A nullpost queued behind later chat still waits for it
+        later, nullpost = ChatMessage("a", content="2", sprite="2"), IconMessage("a", sprite="3")
+        queue.enqueue(later)
+        queue.enqueue(nullpost)
+        queue.put_back(chat)
+        self.assertIsNone(queue.dequeue(MessageQueue.NON_CHAT_LANES))
+        self.assertIs(chat, queue.dequeue())
+        self.assertIsNone(queue.dequeue(MessageQueue.NON_CHAT_LANES))
+        self.assertEqual([later, nullpost], list(iter(queue.dequeue, None)))
+
+    def test_drop_oldest_on_overflow(self):
+        queue = MessageQueue(max_depth=2)
+        messages = [OOCMessage("a", str(i)) for i in range(3)]
+        for msg in messages:
+            queue.enqueue(msg)
+        self.assertEqual(2, queue.size())
+        self.assertIs(messages[1], queue.dequeue())
+        stats = queue.get_stats()['ooc']
+        self.assertEqual(1, stats['dropped'])
+        self.assertEqual(2, stats['high_water'])
+
+    def test_drop_newest_on_overflow(self):
+        queue = MessageQueue(max_depth=2, overflow=MessageQueue.DROP_NEWEST)
+        messages = [OOCMessage("a", str(i)) for i in range(3)]
+        for msg in messages:
+            queue.enqueue(msg)
+        self.assertIs(messages[0], queue.dequeue())
+        self.assertIs(messages[1], queue.dequeue())
+        self.assertIsNone(queue.dequeue())
+
+    def test_superseded_nullposts_are_elided_per_sender(self):
+        queue = MessageQueue()
+        old, other, new = IconMessage("a", sprite="1"), IconMessage("b", sprite="1"), IconMessage("a", sprite="2")
+        for msg in (old, other, new):
+            queue.enqueue(msg)
+        self.assertEqual([other, new], [queue.dequeue(), queue.dequeue()])
+        self.assertIsNone(queue.dequeue())
+        self.assertEqual(1, queue.get_stats()['icon']['elided'])
+
+    def test_superseded_location_is_elided(self):
+        queue = MessageQueue()
+        old, new = LocationMessage("a", "Hakuryou"), LocationMessage("a", "Aqua")
+        queue.enqueue(old)
+        queue.enqueue(new)
+        self.assertIs(new, queue.dequeue())
+        self.assertEqual(1, queue.get_stats()['control']['elided'])
+
+
+class OutboundQueueTests(unittest.TestCase):
+
+    def test_token_bucket_allows_a_burst_then_waits(self):
+        bucket = TokenBucket(rate=1, burst=3)
+        self.assertEqual([True, True, True, False], [bucket.take() for _ in range(4)])
+        self.assertTrue(0 < bucket.wait_time() <= 1)
+
+    def test_zero_rate_is_unlimited(self):
+        bucket = TokenBucket(rate=0, burst=1)
+        self.assertTrue(all(bucket.take() for _ in range(10)))
+        self.assertEqual(0, bucket.wait_time())
+
+    def test_newest_coalescing_message_survives(self):
+        queue = OutboundQueue()
+        old_icon, new_icon = IconMessage("a", sprite="1"), IconMessage("a", sprite="2")
+        chat = ChatMessage("a", content="hi")
+        for msg in (old_icon, chat, new_icon):
+            queue.put(msg)
+        self.assertEqual([chat, new_icon], [queue.get()[0] for _ in range(2)])
+        self.assertIsNone(queue.get())
+        self.assertEqual(1, queue.get_stats()['coalesced'])
+
+    def test_plain_messages_are_not_coalesced(self):
+        queue = OutboundQueue()
+        messages = [OOCMessage("a", str(i)) for i in range(3)]
+        for msg in messages:
+            queue.put(msg)
+        self.assertEqual(messages, [queue.get()[0] for _ in range(3)])
+
+    def test_put_back_is_dropped_when_superseded(self):
+        queue = OutboundQueue()
+        queue.put(LocationMessage("a", "Hakuryou"))
+        entry = queue.get()
+        newer = LocationMessage("a", "Aqua")
+        queue.put(newer)
+        queue.put_back(entry)
+        self.assertIs(newer, queue.get()[0])
+        self.assertTrue(queue.is_empty())
+
+    def test_latency_is_recorded(self):
+        queue = OutboundQueue()
+        queue.put(OOCMessage("a", "hi"))
+        queue.record_sent(queue.get())
+        stats = queue.get_stats()
+        self.assertEqual(1, stats['sent'])
+        self.assertGreaterEqual(stats['max_latency_ms'], stats['avg_latency_ms'])
+
+
+class CapabilityTests(unittest.TestCase):
+
+    def test_hello_round_trip(self):
+        self.assertEqual((2, frozenset([FRAGMENTS])), decode_hello(encode_hello(2, [FRAGMENTS])))
+        self.assertEqual((3, frozenset()), decode_hello(encode_hello(3, [])))
+        self.assertIsNone(decode_hello("just a notice"))
+        self.assertIsNone(decode_hello("MO two fragments"))
+
+    def test_silent_peers_fall_back_to_the_text_format(self):
+        peers = PeerCapabilities()
+        peers.add("alice")
+        peers.add("bob")
+        self.assertFalse(peers.channel_supports(FRAGMENTS))
+        peers.set_listed()
+        peers.update("alice", 2, [FRAGMENTS, "unknown"])
+        self.assertTrue(peers.peer_supports("alice", FRAGMENTS))
+        self.assertFalse(peers.peer_supports("alice", "unknown"))
+        self.assertEqual(1, peers.get_version("bob"))
+        self.assertFalse(peers.channel_supports(FRAGMENTS))
+        peers.update("bob", 2, [FRAGMENTS])
+        self.assertTrue(peers.channel_supports(FRAGMENTS))
+        peers.remove("bob")
+        self.assertTrue(peers.channel_supports(FRAGMENTS))
+
+    def test_capabilities_are_exchanged_on_join(self):
+        server = LoopbackIrcServer().start()
+        self.addCleanup(server.stop)
+        peer = ScriptedClient(server.port, "peer")
+        self.addCleanup(peer.close)
+        peer.join("#test")
+        connection = IrcConnection("127.0.0.1", server.port, "#test", "tester")
+        connection.on_join_handler = connection.on_users_handler = lambda *args: None
+        deadline = time.monotonic() + 5
+        while not connection.is_connected() and time.monotonic() < deadline:
+            connection.process()
+        self.assertEqual(encode_hello(), peer.wait_for("NOTICE #test").split(" :", 1)[1])
+        self.assertFalse(connection.peers.channel_supports(FRAGMENTS))
+        peer.send("NOTICE #test :" + encode_hello())
+        while not connection.peers.channel_supports(FRAGMENTS) and time.monotonic() < deadline:
+            connection.process()
+        self.assertTrue(connection.peers.channel_supports(FRAGMENTS))
+
+
+class LocationChannelTests(unittest.TestCase):
+
+    def test_channel_names(self):
+        self.assertEqual("##mo-mansion_hall", location_channel_name("##mo", "Mansion Hall"))
+        self.assertEqual("##mo-kitchen", location_channel_name("##mo", "Kitchen!"))
+        self.assertEqual(50, len(location_channel_name("##mo", "x" * 100)))
+
+    def test_scoped_messages_follow_the_location(self):
+        server = LoopbackIrcServer().start()
+        self.addCleanup(server.stop)
+        peer = ScriptedClient(server.port, "peer")
+        self.addCleanup(peer.close)
+        peer.join("#test")
+        connection = IrcConnection("127.0.0.1", server.port, "#test", "tester", location_channels=True)
+        connection.on_join_handler = connection.on_users_handler = lambda *args: None
+        connection.join_location("Mansion Hall")
+        deadline = time.monotonic() + 5
+        while connection.location_channel is None and time.monotonic() < deadline:
+            connection.process()
+        self.assertEqual(["tester"], server.names("#test-mansion_hall"))
+        looc = LOOCMessage("tester", "Mansion Hall", "hi")
+        self.assertEqual("#test", connection.get_target(looc))
+        peer.send("NOTICE #test :" + encode_hello(capabilities=CAPABILITIES + (ROOMS,)))
+        while not connection.peers.channel_supports(ROOMS) and time.monotonic() < deadline:
+            connection.process()
+        self.assertEqual("#test-mansion_hall", connection.get_target(looc))
+        self.assertEqual("#test", connection.get_target(LocationMessage("tester", "Mansion Hall")))
+        connection.join_location("Kitchen")
+        while connection.location_channel is None and time.monotonic() < deadline:
+            connection.process()
+        self.assertEqual("#test-kitchen", connection.location_channel)
+        self.assertEqual([], server.names("#test-mansion_hall"))
+
+
+class ConnectionEvents:
+
+    def __init__(self):
+        self.lost = 0
+        self.rejoined = 0
+
+    def on_connection_lost(self):
+        self.lost += 1
+
+    def on_rejoined(self):
+        self.rejoined += 1
+
+    def receive_pong(self):
+        pass
+
+
+class ReconnectTests(unittest.TestCase):
+
+    def setUp(self):
+        self.server = LoopbackIrcServer().start()
+        self.connection = IrcConnection("127.0.0.1", self.server.port, "#test", "tester")
+        self.connection.on_join_handler = self.connection.on_users_handler = lambda *args: None
+
+    def tearDown(self):
+        self.server.stop()
+
+    def process_until(self, condition):
+        deadline = time.monotonic() + 5
+        while not condition() and time.monotonic() < deadline:
+            self.connection.process()
+        self.assertTrue(condition())
+
+    def test_reconnect_rejoins_the_channel(self):
+        events = ConnectionEvents()
+        self.connection.set_connection_manager(events)
+        self.process_until(self.connection.is_connected)
+        self.connection.close()
+        self.assertEqual(1, events.lost)
+        self.assertFalse(self.connection.is_connected())
+        self.connection.reconnect()
+        self.process_until(self.connection.is_connected)
+        self.assertEqual(1, events.rejoined)
+        self.assertEqual(["tester"], self.server.names("#test"))
+
+    def test_reconnect_holds_the_reactor(self):
+        self.connection.set_connection_manager(ConnectionEvents())
+        self.process_until(self.connection.is_connected)
+        self.connection.close()
+        server_connection = self.connection.connection
+        held = []
+        original = server_connection.reconnect
+
+        def reconnect():
+            held.append(self.connection.reactor.mutex._is_owned())
+            original()
+        server_connection.reconnect = reconnect
+        worker = threading.Thread(target=self.connection.reconnect)
+        worker.start()
+        worker.join(5)
+        self.assertEqual([True], held)
+        self.process_until(self.connection.is_connected)
+
+    def test_processing_skips_a_frame_while_the_reactor_is_held(self):
+        self.process_until(self.connection.is_connected)
+        held, release = threading.Event(), threading.Event()
+
+        def hold():
+            with self.connection.reactor.mutex:
+                held.set()
+                release.wait(5)
+        worker = threading.Thread(target=hold)
+        worker.start()
+        self.addCleanup(worker.join)
+        self.addCleanup(release.set)
+        held.wait(5)
+        started = time.monotonic()
+        self.connection.process()
+        self.assertLess(time.monotonic() - started, 1)
+
+    def test_backoff_grows_with_jitter_up_to_the_cap(self):
+        manager = ConnectionManager(self.connection, reconnect_delay_min=1, reconnect_delay_max=8)
+        for expected in (1, 2, 4, 8, 8):
+            manager.schedule_reconnect()
+            self.assertTrue(expected / 2 <= manager.reconnect_event.timeout <= expected)
+            manager.reconnect_event.cancel()
+        manager.watchdog_event.cancel()
+
+    def test_outbox_keeps_the_newest_messages(self):
+        manager = ConnectionManager(self.connection, outbox_size=2)
+        manager.reconnecting = True
+        messages = [OOCMessage("tester", str(i)) for i in range(3)]
+        for msg in messages:
+            manager.send_msg(msg)
+        self.assertEqual(messages[1:], list(manager.outbox))
+        manager.watchdog_event.cancel()
+
+    def test_too_long_for_an_older_client_is_reported(self):
+        old = ScriptedClient(self.server.port, "old")
+        self.addCleanup(old.close)
+        old.join("#test")
+        manager = ConnectionManager(self.connection)
+        self.addCleanup(manager.watchdog_event.cancel)
+        reported = []
+        manager.report_too_long = reported.append
+        self.process_until(lambda: self.connection.peers.listed)
+        item = ItemMessage("tester", "x" * 600)
+        manager.send_msg(item)
+        self.assertEqual([item], reported)
+
+    def test_watchdog_pings_when_idle_and_measures_the_round_trip(self):
+        manager = ConnectionManager(self.connection)
+        self.addCleanup(manager.watchdog_event.cancel)
+        self.process_until(self.connection.is_connected)
+        manager.check_liveness(0)
+        self.assertIsNone(manager.ping_sent_at)
+        manager.last_activity -= manager.PING_INTERVAL
+        manager.check_liveness(0)
+        self.assertIsNotNone(manager.ping_sent_at)
+        self.process_until(lambda: manager.round_trip_time is not None)
+        self.assertIsNone(manager.ping_sent_at)
+        self.assertGreaterEqual(manager.get_round_trip_ms(), 0)
+
+    def test_unanswered_ping_counts_as_lost(self):
+        manager = ConnectionManager(self.connection)
+        self.addCleanup(manager.watchdog_event.cancel)
+        manager.not_again_flag = True
+        manager.ping_sent_at = time.monotonic() - manager.PONG_TIMEOUT
+        manager.check_liveness(0)
+        self.assertTrue(manager.reconnecting)
+        manager.reconnect_event.cancel()
+
+
+class PrivateMessageTests(unittest.TestCase):
+
+    def test_arrivals_are_delivered_together(self):
+        server = LoopbackIrcServer().start()
+        self.addCleanup(server.stop)
+        connection = IrcConnection("127.0.0.1", server.port, "#test", "tester")
+        connection.on_join_handler = connection.on_users_handler = lambda *args: None
+        delivered = []
+
+        def deliver():
+            pm = connection.get_pm()
+            while pm is not None:
+                delivered.append(pm.msg)
+                pm = connection.get_pm()
+        connection.on_private_message_handler = deliver
+        peer = ScriptedClient(server.port, "peer")
+        self.addCleanup(peer.close)
+        deadline = time.monotonic() + 5
+        while not connection.is_connected() and time.monotonic() < deadline:
+            connection.process()
+        Clock.tick()
+        self.assertEqual([], delivered)
+        for i in range(3):
+            peer.privmsg("tester", "hi {}".format(i))
+        while connection.p_msg_q.size() < 3 and time.monotonic() < deadline:
+            connection.process()
+        Clock.tick()
+        self.assertEqual(["hi 0", "hi 1", "hi 2"], delivered)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,56 @@
+import json
+import os
+import tempfile
+import unittest
+from MysteryOnline.latency import LatencyTracker, RollingHistogram
+
+
+class RollingHistogramTests(unittest.TestCase):
+
+    def test_percentiles_use_bucket_bounds(self):
+        histogram = RollingHistogram()
+        for _ in range(90):
+            histogram.add(0.0003)
+        for _ in range(10):
+            histogram.add(0.02)
+        stats = histogram.get_stats()
+        self.assertEqual(0.5, stats['p50_ms'])
+        self.assertEqual(25, stats['p95_ms'])
+        self.assertAlmostEqual(20, stats['max_ms'])
+        self.assertEqual({'<=0.5ms': 90, '<=25ms': 10}, stats['buckets'])
+
+    def test_old_samples_roll_out(self):
+        histogram = RollingHistogram(window=10)
+        for _ in range(10):
+            histogram.add(0.2)
+        for _ in range(10):
+            histogram.add(0.001)
+        stats = histogram.get_stats()
+        self.assertEqual(20, stats['total'])
+        self.assertEqual(10, stats['window'])
+        self.assertAlmostEqual(1, stats['mean_ms'])
+        self.assertEqual({'<=1ms': 10}, stats['buckets'])
+
+    def test_slowest_bucket_reports_the_worst_sample(self):
+        histogram = RollingHistogram()
+        histogram.add(3)
+        self.assertAlmostEqual(3000, histogram.get_stats()['p99_ms'])
+
+
+class LatencyTrackerTests(unittest.TestCase):
+
+    def test_dump(self):
+        tracker = LatencyTracker()
+        tracker.record('ChatMessage', 0.004)
+        tracker.record('OOCMessage', 0.0001)
+        path = os.path.join(tempfile.mkdtemp(), 'stats.json')
+        tracker.dump(path)
+        with open(path) as f:
+            stats = json.load(f)
+        self.assertEqual(['ChatMessage', 'OOCMessage'], sorted(stats))
+        self.assertEqual(1, stats['ChatMessage']['total'])
+        self.assertTrue(tracker.format_table().splitlines()[1].startswith('ChatMessage'))
+
+
+if __name__ == '__main__':
+    unittest.main()
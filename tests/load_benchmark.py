@@ -0,0 +1,100 @@
+"""End-to-end load test against the loopback IRC server.
+
+Scripted clients join the channel and each post OOC lines at a fixed rate,
+stamped with the time they were sent. The IrcConnection under test is
+serviced at 60 frames per second like in the app and drains its queue every
+frame, so the latency reported covers the server hop, parsing and queueing.
+Run from the repository root:
+    python tests/load_benchmark.py [--clients 50] [--messages 20] [--rate 2] [--backend reactor]
+"""
+import argparse
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.getcwd())
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+os.environ.setdefault('KIVY_NO_ARGS', '1')
+
+from MysteryOnline.irc_mo import IrcConnection, OOCMessage
+from MysteryOnline.irc_aio import AioIrcConnection
+from loopback_irc import LoopbackIrcServer, spawn_clients
+
+CHANNEL = "#load"
+FRAME = 1.0 / 60.0
+BACKENDS = {'reactor': IrcConnection, 'asyncio': AioIrcConnection}
+
+
+def ignore(*args):
+    pass
+
+
+def post(clients, messages, rate):
+    """Every client posts messages lines, rate lines per second each, round robin."""
+    interval = 1.0 / rate
+    for i in range(messages):
+        round_start = time.perf_counter()
+        for client in clients:
+            client.privmsg(CHANNEL, "OOC#{!r} {}".format(time.perf_counter(), i))
+        time.sleep(max(0.0, interval - (time.perf_counter() - round_start)))
+
+
+def percentile(values, fraction):
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def run(client_count, messages, rate, backend):
+    server = LoopbackIrcServer().start()
+    connection = BACKENDS[backend]("127.0.0.1", server.port, CHANNEL, "reader", queue_depth=0)
+    connection.on_join_handler = connection.on_users_handler = connection.on_disconnect_handler = ignore
+    if connection.threaded:
+        connection.start_network_thread()
+    while not connection.is_connected():
+        connection.process()
+        connection.process_incoming()
+        time.sleep(0.01)
+
+    clients = spawn_clients(server.port, client_count, CHANNEL)
+    expected = client_count * messages
+    poster = threading.Thread(target=post, args=(clients, messages, rate), daemon=True)
+    latencies = []
+    start = time.perf_counter()
+    poster.start()
+    deadline = start + messages / rate + 30
+    while len(latencies) < expected and time.perf_counter() < deadline:
+        frame_start = time.perf_counter()
+        connection.process()
+        connection.process_incoming()
+        msg = connection.get_msg()
+        while msg is not None:
+            if isinstance(msg, OOCMessage):
+                sent_at = float(msg.content.split(' ', 1)[0])
+                latencies.append(time.perf_counter() - sent_at)
+            msg = connection.get_msg()
+        time.sleep(max(0.0, FRAME - (time.perf_counter() - frame_start)))
+    elapsed = time.perf_counter() - start
+
+    for client in clients:
+        client.quit()
+    if connection.threaded:
+        connection.stop_network_thread()
+    server.stop()
+
+    latencies.sort()
+    print("{} backend, {} clients x {} msgs at {}/s".format(backend, client_count, messages, rate))
+    print("received {:>6}/{} in {:6.2f}s  {:>8.0f} msg/s".format(len(latencies), expected, elapsed,
+                                                                 len(latencies) / elapsed))
+    if latencies:
+        print("latency  p50 {:7.1f}ms  p95 {:7.1f}ms  max {:7.1f}ms".format(
+            percentile(latencies, 0.5) * 1000, percentile(latencies, 0.95) * 1000, latencies[-1] * 1000))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--clients', type=int, default=50)
+    parser.add_argument('--messages', type=int, default=20)
+    parser.add_argument('--rate', type=float, default=2)
+    parser.add_argument('--backend', choices=sorted(BACKENDS), default='reactor')
+    args = parser.parse_args()
+    run(args.clients, args.messages, args.rate, args.backend)
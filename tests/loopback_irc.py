@@ -0,0 +1,292 @@
+"""A tiny in-process IRC server for local tests and benchmarks.
+
+It only speaks as much of the protocol as MysteryOnline uses and keeps
+everything in memory, so clients can connect to 127.0.0.1 without a network.
+ScriptedClient drives it from a plain socket to stand in for other users.
+"""
+import socket
+import socketserver
+import threading
+import time
+from collections import deque
+
+SERVER_NAME = "loopback.irc"
+
+
+class LoopbackClient(socketserver.StreamRequestHandler):
+
+    def setup(self):
+        super(LoopbackClient, self).setup()
+        self.nick = None
+        self.registered = False
+        self.send_lock = threading.Lock()
+
+    @property
+    def prefix(self):
+        return "{0}!{0}@127.0.0.1".format(self.nick)
+
+    def send(self, line):
+        data = (line + "\r\n").encode('utf-8')
+        with self.send_lock:
+            try:
+                self.wfile.write(data)
+            except OSError:
+                pass
+
+    def reply(self, code, *params):
+        self.send(":{} {} {} {}".format(SERVER_NAME, code, self.nick or "*", " ".join(params)))
+
+    def handle(self):
+        try:
+            for raw in self.rfile:
+                self.handle_line(raw.decode('utf-8', 'replace').rstrip('\r\n'))
+        except ConnectionResetError:
+            pass
+
+    def handle_line(self, line):
+        if not line:
+            return
+        command, params = self.parse(line)
+        handler = getattr(self, "irc_" + command.upper(), None)
+        if handler is not None:
+            handler(params)
+
+    def finish(self):
+        self.quit("Connection closed")
+        super(LoopbackClient, self).finish()
+
+    def quit(self, message):
+        # Everyone sharing a channel hears about it once, whether or not the client sent QUIT
+        line = ":{} QUIT :{}".format(self.prefix, message)
+        for member in self.server.remove_client(self):
+            member.send(line)
+
+    @staticmethod
+    def parse(line):
+        if line.startswith(':'):
+            line = line.split(' ', 1)[1]
+        trailing = None
+        if ' :' in line:
+            line, trailing = line.split(' :', 1)
+        params = line.split()
+        command = params.pop(0)
+        if trailing is not None:
+            params.append(trailing)
+        return command, params
+
+    def irc_NICK(self, params):
+        if self.server.rename_client(self, params[0]):
+            self.nick = params[0]
+        else:
+            self.send(":{} 433 * {} :Nickname is already in use".format(SERVER_NAME, params[0]))
+
+    def irc_USER(self, params):
+        if self.nick is not None and not self.registered:
+            self.registered = True
+            self.reply("001", ":Welcome to the loopback network {}".format(self.nick))
+
+    def irc_PING(self, params):
+        self.send(":{0} PONG {0} :{1}".format(SERVER_NAME, params[0] if params else SERVER_NAME))
+
+    def irc_JOIN(self, params):
+        for channel in params[0].split(','):
+            members = self.server.join(self, channel)
+            line = ":{} JOIN {}".format(self.prefix, channel)
+            for member in members:
+                member.send(line)
+            self.send_names(channel)
+
+    def irc_PART(self, params):
+        for channel in params[0].split(','):
+            line = ":{} PART {}".format(self.prefix, channel)
+            for member in self.server.part(self, channel):
+                member.send(line)
+
+    def irc_NAMES(self, params):
+        for channel in params[0].split(','):
+            self.send_names(channel)
+
+    def irc_QUIT(self, params):
+        self.quit(params[0] if params else "Quit")
+        self.send("ERROR :Closing link")
+        try:
+            self.request.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+    def send_names(self, channel):
+        names = " ".join(self.server.names(channel))
+        self.reply("353", "=", channel, ":" + names)
+        self.reply("366", channel, ":End of /NAMES list.")
+
+    def irc_PRIVMSG(self, params, command="PRIVMSG"):
+        target, text = params[0], params[1]
+        line = ":{} {} {} :{}".format(self.prefix, command, target, text)
+        if target.startswith('#'):
+            for member in self.server.members(target):
+                if member is not self:
+                    member.send(line)
+        else:
+            recipient = self.server.clients.get(target)
+            if recipient is not None:
+                recipient.send(line)
+
+    def irc_NOTICE(self, params):
+        self.irc_PRIVMSG(params, "NOTICE")
+
+
+class LoopbackIrcServer(socketserver.ThreadingTCPServer):
+    """Run with start() and stop(); the port is picked by the OS unless given."""
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, host="127.0.0.1", port=0):
+        super(LoopbackIrcServer, self).__init__((host, port), LoopbackClient)
+        self.lock = threading.Lock()
+        self.clients = {}
+        self.channels = {}
+        self.thread = None
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    def start(self):
+        self.thread = threading.Thread(target=self.serve_forever, name="loopback-irc", daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def rename_client(self, client, nick):
+        with self.lock:
+            if nick in self.clients:
+                return False
+            if client.nick is not None:
+                self.clients.pop(client.nick, None)
+            self.clients[nick] = client
+            return True
+
+    def remove_client(self, client):
+        """Forgets client, returns the other members of its channels."""
+        with self.lock:
+            if client.nick is not None and self.clients.get(client.nick) is client:
+                del self.clients[client.nick]
+            peers = set()
+            for members in self.channels.values():
+                if client in members:
+                    members.discard(client)
+                    peers.update(members)
+            return list(peers)
+
+    def join(self, client, channel):
+        with self.lock:
+            members = self.channels.setdefault(channel, set())
+            members.add(client)
+            return list(members)
+
+    def part(self, client, channel):
+        """Removes client from channel, returns who was in it including client."""
+        with self.lock:
+            members = self.channels.get(channel, set())
+            if client not in members:
+                return []
+            result = list(members)
+            members.discard(client)
+            return result
+
+    def members(self, channel):
+        with self.lock:
+            return list(self.channels.get(channel, ()))
+
+    def names(self, channel):
+        return sorted(member.nick for member in self.members(channel))
+
+
+class ScriptedClient:
+    """A bare socket client that registers, joins and sends raw lines on a test's behalf.
+
+    Everything it receives is read on its own thread so the server never blocks on it;
+    lines are kept in received as (time.perf_counter(), line) unless record is False.
+    """
+
+    def __init__(self, port, nick, host="127.0.0.1", record=True):
+        self.nick = nick
+        self.record = record
+        self.received = deque()
+        self.condition = threading.Condition()
+        self.joined = threading.Event()
+        self.sock = socket.create_connection((host, port))
+        self.reader = threading.Thread(target=self.read_lines, name="scripted-" + nick, daemon=True)
+        self.reader.start()
+        self.send("NICK {}".format(nick))
+        self.send("USER {0} 0 * :{0}".format(nick))
+
+    def read_lines(self):
+        try:
+            for raw in self.sock.makefile('rb'):
+                self.handle_line(raw.decode('utf-8', 'replace').rstrip('\r\n'))
+        except (OSError, ValueError):
+            # The socket was closed under us
+            pass
+
+    def handle_line(self, line):
+        if " 366 " in line:
+            self.joined.set()
+        if line.startswith("PING"):
+            self.send("PONG" + line[4:])
+        if self.record:
+            with self.condition:
+                self.received.append((time.perf_counter(), line))
+                self.condition.notify_all()
+
+    def send(self, line):
+        self.sock.sendall((line + "\r\n").encode('utf-8'))
+
+    def join(self, channel, timeout=5):
+        self.joined.clear()
+        self.send("JOIN {}".format(channel))
+        if not self.joined.wait(timeout):
+            raise TimeoutError("{} couldn't join {}".format(self.nick, channel))
+
+    def privmsg(self, target, text):
+        self.send("PRIVMSG {} :{}".format(target, text))
+
+    def wait_for(self, text, timeout=5):
+        """Blocks until a received line contains text and returns it, lines before it are consumed."""
+        deadline = time.monotonic() + timeout
+        with self.condition:
+            while True:
+                while self.received:
+                    received_at, line = self.received.popleft()
+                    if text in line:
+                        return line
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or not self.condition.wait(remaining):
+                    raise TimeoutError("{} never received {!r}".format(self.nick, text))
+
+    def quit(self, message="Bye"):
+        try:
+            self.send("QUIT :{}".format(message))
+        except OSError:
+            pass
+        self.close()
+
+    def close(self):
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.sock.close()
+
+
+def spawn_clients(port, count, channel=None, prefix="bot", record=False):
+    """Connects count scripted clients named prefix0, prefix1... and joins them to channel."""
+    clients = [ScriptedClient(port, "{}{}".format(prefix, i), record=record) for i in range(count)]
+    if channel is not None:
+        for client in clients:
+            client.join(channel)
+    return clients
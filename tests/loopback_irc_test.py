@@ -0,0 +1,59 @@
+import unittest
+from loopback_irc import LoopbackIrcServer, ScriptedClient, spawn_clients
+
+
+class LoopbackIrcServerTests(unittest.TestCase):
+
+    def setUp(self):
+        self.server = LoopbackIrcServer().start()
+        self.clients = []
+
+    def tearDown(self):
+        for client in self.clients:
+            client.close()
+        self.server.stop()
+
+    def connect(self, nick):
+        client = ScriptedClient(self.server.port, nick)
+        self.clients.append(client)
+        return client
+
+    def test_join_and_privmsg_reach_other_members(self):
+        alice, bob = self.connect("alice"), self.connect("bob")
+        alice.join("#test")
+        bob.join("#test")
+        alice.wait_for(":bob!bob@127.0.0.1 JOIN #test")
+        bob.privmsg("#test", "OOC#hello")
+        self.assertTrue(alice.wait_for("PRIVMSG #test").endswith(":OOC#hello"))
+        bob.privmsg("alice", "psst")
+        self.assertIn("PRIVMSG alice :psst", alice.wait_for("psst"))
+
+    def test_names(self):
+        alice, bob = self.connect("alice"), self.connect("bob")
+        alice.join("#test")
+        bob.join("#test")
+        alice.wait_for(":bob!bob@127.0.0.1 JOIN #test")
+        alice.send("NAMES #test")
+        self.assertTrue(alice.wait_for(" 353 ").endswith(":alice bob"))
+
+    def test_quit_and_dropped_connections_are_announced(self):
+        alice, bob, carol = self.connect("alice"), self.connect("bob"), self.connect("carol")
+        for client in (alice, bob, carol):
+            client.join("#test")
+        bob.quit("Leaving")
+        self.assertTrue(alice.wait_for(":bob!bob@127.0.0.1 QUIT").endswith(":Leaving"))
+        carol.close()
+        alice.wait_for(":carol!carol@127.0.0.1 QUIT")
+        self.assertEqual(["alice"], self.server.names("#test"))
+
+    def test_nickname_in_use(self):
+        self.connect("alice")
+        self.connect("alice").wait_for(" 433 ")
+
+    def test_spawn_many_clients(self):
+        self.clients = spawn_clients(self.server.port, 20, "#load")
+        self.assertEqual(20, len(self.server.names("#load")))
+
+
+if __name__ == '__main__':
+    unittest.main()
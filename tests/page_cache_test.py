@@ -0,0 +1,42 @@
+import unittest
+from MysteryOnline.page_cache import PageCache
+from fake_atlas import FakeAtlas
+
+
+class PageCacheTests(unittest.TestCase):
+
+    def setUp(self):
+        self.cache = PageCache(budget=300)
+        self.alice = FakeAtlas("characters/Alice/sprites.atlas")
+        self.bob = FakeAtlas("characters/Bob/sprites.atlas")
+
+    def test_least_recently_used_page_goes_first(self):
+        self.cache.add(self.alice, "sprites-0.png", 100)
+        self.cache.add(self.alice, "sprites-1.png", 100)
+        self.cache.add(self.bob, "sprites-0.png", 100)
+        self.cache.touch(self.alice, "sprites-0.png")
+        self.cache.add(self.bob, "sprites-1.png", 100)
+        self.assertEqual(["sprites-1.png"], self.alice.unloaded)
+        self.assertEqual(300, self.cache.size)
+        self.assertEqual(1, self.cache.get_stats()['evicted'])
+
+    def test_pinned_atlases_are_kept(self):
+        self.cache.set_pins('user', [self.alice.filename])
+        self.cache.add(self.alice, "sprites-0.png", 200)
+        self.cache.add(self.bob, "sprites-0.png", 100)
+        self.cache.add(self.bob, "sprites-1.png", 100)
+        self.assertEqual([], self.alice.unloaded)
+        self.assertEqual(["sprites-0.png"], self.bob.unloaded)
+        self.cache.set_pins('user', [])
+        self.cache.set_budget(100)
+        self.assertEqual(["sprites-0.png"], self.alice.unloaded)
+
+    def test_a_page_over_budget_on_its_own_stays_loaded(self):
+        self.cache.add(self.alice, "sprites-0.png", 500)
+        self.assertEqual([], self.alice.unloaded)
+        self.cache.add(self.bob, "sprites-0.png", 10)
+        self.assertEqual(["sprites-0.png"], self.alice.unloaded)
+
+
+if __name__ == '__main__':
+    unittest.main()
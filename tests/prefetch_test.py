@@ -0,0 +1,52 @@
+import unittest
+from MysteryOnline.prefetch import SpritePrefetcher
+from fake_atlas import FakeAtlas
+
+
+class FakeSprite:
+
+    def __init__(self, loading):
+        self.loading = loading
+
+    def is_loading(self):
+        return self.loading
+
+
+class SpritePrefetcherTests(unittest.TestCase):
+
+    def setUp(self):
+        self.prefetcher = SpritePrefetcher(max_in_flight=1)
+        self.alice = FakeAtlas("characters/Alice/sprites.atlas", {'1': 'a-0.png', '30': 'a-1.png'})
+        self.bob = FakeAtlas("characters/Bob/sprites.atlas", {'1': 'b-0.png'})
+
+    def test_pages_start_one_at_a_time(self):
+        self.prefetcher.want("alice", self.alice, '30')
+        self.prefetcher.want("bob", self.bob)
+        self.prefetcher.update()
+        self.assertEqual(['a-1.png'], list(self.alice.waiting))
+        self.assertEqual({}, self.bob.waiting)
+        self.alice.finish('a-1.png')
+        self.prefetcher.update()
+        self.assertEqual(['b-0.png'], list(self.bob.waiting))
+        self.assertEqual(1, self.prefetcher.get_stats()['completed'])
+
+    def test_loaded_pages_are_not_queued(self):
+        self.alice.loaded_pages.add('a-0.png')
+        self.prefetcher.want("alice", self.alice, '1')
+        self.prefetcher.update()
+        self.assertEqual(0, self.prefetcher.started)
+
+    def test_hit_rate_counts_first_posts(self):
+        self.prefetcher.want("alice", self.alice, '1')
+        self.prefetcher.want("bob", self.bob, '1')
+        self.prefetcher.note_displayed("alice", FakeSprite(loading=False))
+        self.prefetcher.note_displayed("alice", FakeSprite(loading=True))
+        self.prefetcher.note_displayed("bob", FakeSprite(loading=True))
+        self.prefetcher.note_displayed("carol", FakeSprite(loading=True))
+        stats = self.prefetcher.get_stats()
+        self.assertEqual((1, 1), (stats['hits'], stats['misses']))
+        self.assertEqual(0.5, stats['hit_rate'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,82 @@
+"""Sprite lookup benchmark for Icarus.
+
+Generates a character whose sprites are spread over several atlas pages and
+flips through all of them, one page after another, the way someone cycling
+through a big character's sprites does. The first pass decodes the pages, the
+passes after it show what repeated lookups cost. Run from the repository root:
+    python tests/sprite_benchmark.py [--pages 5] [--sprites 20] [--passes 3]
+"""
+import argparse
+import json
+import os
+import struct
+import sys
+import tempfile
+import time
+import zlib
+
+sys.path.insert(0, os.getcwd())
+os.environ.setdefault('KIVY_NO_ARGS', '1')
+
+# Textures need a GL context
+from kivy.core.window import Window  # noqa: F401
+from MysteryOnline.icarus import Icarus
+
+SPRITE_SIZE = 256
+COLUMNS = 4
+
+
+def write_png(path, width, height, rgb):
+    """A solid colour RGB PNG, so the benchmark doesn't need an imaging library."""
+    def chunk(tag, data):
+        return struct.pack('>I', len(data)) + tag + data + struct.pack('>I', zlib.crc32(tag + data) & 0xffffffff)
+    row = b'\x00' + bytes(rgb) * width
+    with open(path, 'wb') as f:
+        f.write(b'\x89PNG\r\n\x1a\n')
+        f.write(chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0)))
+        f.write(chunk(b'IDAT', zlib.compress(row * height)))
+        f.write(chunk(b'IEND', b''))
+
+
+def generate_character(directory, pages, sprites_per_page):
+    """Writes sprites.atlas and its pages, returns the atlas path and the sprite names page by page."""
+    rows = (sprites_per_page + COLUMNS - 1) // COLUMNS
+    meta = {}
+    names = []
+    for page in range(pages):
+        page_name = "sprites-{}.png".format(page)
+        write_png(os.path.join(directory, page_name), COLUMNS * SPRITE_SIZE, rows * SPRITE_SIZE,
+                  (40 * page % 256, 80, 160))
+        ids = {}
+        for i in range(sprites_per_page):
+            name = str(page * sprites_per_page + i + 1)
+            ids[name] = [i % COLUMNS * SPRITE_SIZE, i // COLUMNS * SPRITE_SIZE, SPRITE_SIZE, SPRITE_SIZE]
+            names.append(name)
+        meta[page_name] = ids
+    path = os.path.join(directory, "sprites.atlas")
+    with open(path, 'w') as f:
+        json.dump(meta, f)
+    return path, names
+
+
+def run(pages, sprites_per_page, passes):
+    directory = tempfile.mkdtemp()
+    path, names = generate_character(directory, pages, sprites_per_page)
+    sprites = Icarus(path)
+    print("{} pages x {} sprites".format(pages, sprites_per_page))
+    for i in range(passes):
+        start = time.perf_counter()
+        for name in names:
+            sprites[name]
+        elapsed = time.perf_counter() - start
+        print("pass {}  {:8.1f}ms total  {:7.3f}ms per sprite  {} page(s) decoded".format(
+            i + 1, elapsed * 1000, elapsed * 1000 / len(names), len(sprites.loaded_pages)))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--pages', type=int, default=5)
+    parser.add_argument('--sprites', type=int, default=20)
+    parser.add_argument('--passes', type=int, default=3)
+    args = parser.parse_args()
+    run(args.pages, args.sprites, args.passes)
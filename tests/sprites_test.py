@@ -1,5 +1,7 @@
 import unittest
+from MysteryOnline.sprite import FlippedSprite, LoadingSprite, Sprite
 from MysteryOnline.sprite_organizer import SpriteOrganizer
+from fake_atlas import FakeTexture
 
 
 class MockSprite:
@@ -43,5 +45,45 @@ class SpriteTest(unittest.TestCase):
         self.assertIs(ms2, self.so.get_sprites()[2])
 
 
+
+class LoadingSpriteTest(unittest.TestCase):
+
+    def test_flags_are_kept_until_the_page_is_in(self):
+        sprite = LoadingSprite("7", None, "sprites-1.png")
+        self.assertFalse(sprite.is_cg())
+        sprite.set_cg()
+        sprite.set_nsfw()
+        self.assertTrue(sprite.is_cg())
+        self.assertTrue(sprite.is_nsfw())
+        sprite.unset_nsfw()
+        self.assertFalse(sprite.is_nsfw())
+        self.assertTrue(sprite.is_loading())
+
+
+class FlippedSpriteTest(unittest.TestCase):
+
+    def setUp(self):
+        self.texture = FakeTexture()
+        self.sprite = Sprite("1", self.texture)
+
+    def test_flipping_leaves_other_users_of_the_sprite_alone(self):
+        alice = FlippedSprite(self.sprite)
+        bob = self.sprite
+        self.assertTrue(alice.get_texture().flipped)
+        self.assertIs(self.texture, bob.get_texture())
+        self.assertFalse(self.texture.flipped)
+
+    def test_flipping_twice_gives_the_original(self):
+        flipped = FlippedSprite(self.sprite)
+        self.assertIs(self.texture, flipped.get_texture(flipped=True))
+        self.assertFalse(flipped.get_texture(flipped=True).flipped)
+
+    def test_flipped_texture_is_a_shared_region(self):
+        flipped = self.sprite.get_flipped_texture()
+        self.assertIs(self.texture, flipped.owner)
+        self.assertIs(flipped, FlippedSprite(self.sprite).get_texture())
+        self.assertIs(flipped, FlippedSprite(self.sprite).get_texture())
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,131 @@
+import os
+import subprocess
+import sys
+import time
+import unittest
+from MysteryOnline.codec import SNAPSHOT, encode_snapshot, decode_snapshot, encode_hello
+from MysteryOnline.irc_mo import IrcConnection, CharacterMessage, LocationMessage, OOCMessage, ChatMessage
+from MysteryOnline.state_keeper import StateKeeper
+from loopback_irc import LoopbackIrcServer, ScriptedClient
+
+
+def ignore(*args):
+    pass
+
+
+class SnapshotEncodingTests(unittest.TestCase):
+
+    def test_round_trip_splits_at_the_line_limit(self):
+        entries = [("user{}".format(i), "c#Character {}#link#1".format(i)) for i in range(20)]
+        notices = encode_snapshot(entries, 100)
+        self.assertGreater(len(notices), 1)
+        self.assertTrue(all(len(notice.encode('utf-8')) <= 100 for notice in notices))
+        decoded = [entry for notice in notices for entry in decode_snapshot(notice)]
+        self.assertEqual(entries, decoded)
+
+    def test_other_notices_are_not_snapshots(self):
+        self.assertIsNone(decode_snapshot("*** Looking up your hostname"))
+        self.assertIsNone(decode_snapshot("MOS\tonly_a_sender"))
+
+
+class StateKeeperTests(unittest.TestCase):
+
+    def setUp(self):
+        self.server = LoopbackIrcServer().start()
+        self.connections = []
+        self.keeper = None
+
+    def tearDown(self):
+        for connection in self.connections:
+            connection.close()
+        self.server.stop()
+
+    def connect(self, nick):
+        connection = IrcConnection("127.0.0.1", self.server.port, "#test", nick, queue_depth=0, state_keeper="keeper")
+        connection.on_join_handler = connection.on_users_handler = connection.on_disconnect_handler = ignore
+        self.connections.append(connection)
+        return connection
+
+    def process_until(self, condition):
+        deadline = time.monotonic() + 5
+        while not condition() and time.monotonic() < deadline:
+            for connection in self.connections:
+                connection.process()
+            if self.keeper is not None:
+                self.keeper.update()
+        self.assertTrue(condition())
+
+    def join(self, nick):
+        client = ScriptedClient(self.server.port, nick)
+        self.addCleanup(client.close)
+        client.join("#test")
+        return client
+
+    def send_snapshot(self, client, target, entries):
+        client.send("NOTICE {} :{}".format(target, encode_hello(capabilities=(SNAPSHOT,))))
+        for notice in encode_snapshot(entries, 400):
+            client.send("NOTICE {} :{}".format(target, notice))
+
+    def test_joining_user_gets_everyones_state(self):
+        self.keeper = StateKeeper(self.connect("keeper"))
+        self.process_until(self.keeper.irc_connection.is_connected)
+        alice = ScriptedClient(self.server.port, "alice")
+        self.addCleanup(alice.close)
+        alice.join("#test")
+        alice.privmsg("#test", LocationMessage("alice", "Mansion").to_irc())
+        alice.privmsg("#test", CharacterMessage("alice", "Sherlock", "link", "1").to_irc())
+        alice.privmsg("#test", CharacterMessage("alice", "Watson", "link", "2").to_irc())
+        self.process_until(lambda: len(self.keeper.get_snapshot()) == 2)
+
+        bob = self.connect("bob")
+        self.process_until(lambda: bob.msg_q.size() == 2)
+        self.assertEqual(["keeper"], bob.peers.providers(SNAPSHOT))
+        received = [bob.get_msg(), bob.get_msg()]
+        self.assertEqual([LocationMessage, CharacterMessage], [type(msg) for msg in received])
+        self.assertEqual("Watson", received[1].character)
+        self.assertEqual("alice", received[1].sender)
+
+    def test_only_the_configured_keeper_is_taken_in(self):
+        alice = self.join("alice")
+        bob = self.connect("bob")
+        self.process_until(bob.is_connected)
+        mallory = self.join("mallory")
+        forged = [("alice", OOCMessage("alice", "I'm alice").to_irc()),
+                  ("alice", ChatMessage("alice", content="Me too", location="Mansion", sublocation="Hall",
+                                        character="Sherlock", sprite="1", position="center", color_id=0,
+                                        sprite_option=0, sfx_name=None).to_irc())]
+        self.send_snapshot(mallory, "bob", forged)
+        mallory.privmsg("#test", LocationMessage("mallory", "Mansion").to_irc())
+        self.process_until(lambda: bob.msg_q.size() == 1)
+        self.assertEqual("mallory", bob.get_msg().sender)
+        self.assertEqual([], bob.peers.providers(SNAPSHOT))
+        self.assertFalse(bob.has_state_keeper())
+
+    def test_snapshot_only_carries_state_of_present_users(self):
+        alice = self.join("alice")
+        keeper = self.join("keeper")
+        bob = self.connect("bob")
+        self.process_until(bob.is_connected)
+        self.send_snapshot(keeper, "bob", [("alice", OOCMessage("alice", "I'm alice").to_irc()),
+                                           ("ghost", LocationMessage("ghost", "Attic").to_irc()),
+                                           ("alice", LocationMessage("alice", "Mansion").to_irc())])
+        keeper.privmsg("#test", OOCMessage("keeper", "done").to_irc())
+        self.process_until(lambda: bob.msg_q.size() == 2)
+        received = [bob.get_msg(), bob.get_msg()]
+        self.assertEqual({("keeper", OOCMessage), ("alice", LocationMessage)},
+                         {(msg.sender, type(msg)) for msg in received})
+        self.assertTrue(bob.has_state_keeper())
+
+
+class HeadlessTests(unittest.TestCase):
+
+    def test_keeper_starts_without_a_window(self):
+        code = "import sys, MysteryOnline.state_keeper; sys.exit('kivy.core.window' in sys.modules)"
+        env = dict(os.environ, KIVY_NO_ARGS='1')
+        root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        self.assertEqual(0, subprocess.call([sys.executable, '-c', code], cwd=root, env=env,
+                                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,82 @@
+import os
+import tempfile
+import threading
+import time
+import unittest
+from MysteryOnline.irc_mo import IrcConnection
+from MysteryOnline.traffic import TrafficRecorder, TrafficReplayer, read_traffic, summarize_frames, RECEIVED, SENT
+from loopback_irc import LoopbackIrcServer
+
+
+class TrafficRecorderTests(unittest.TestCase):
+
+    def setUp(self):
+        handle, self.path = tempfile.mkstemp()
+        os.close(handle)
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def test_round_trip(self):
+        recorder = TrafficRecorder(self.path)
+        recorder.record(RECEIVED, "alice", "OOC#tabs\tand #hashes")
+        recorder.record(SENT, "#channel", "l#Hakuryou")
+        recorder.close()
+        records = list(read_traffic(self.path))
+        self.assertEqual([RECEIVED, SENT], [r.kind for r in records])
+        self.assertEqual("alice", records[0].peer)
+        self.assertEqual("OOC#tabs\tand #hashes", records[0].line)
+        self.assertLessEqual(records[0].timestamp, records[1].timestamp)
+
+    def test_frame_summary(self):
+        summary = summarize_frames([0.01] * 19 + [0.1])
+        self.assertEqual(20, summary['frames'])
+        self.assertEqual(1, summary['slow_frames'])
+        self.assertAlmostEqual(100, summary['max_ms'])
+        self.assertAlmostEqual(14.5, summary['mean_ms'])
+
+    def test_empty_frame_summary(self):
+        self.assertEqual(0, summarize_frames([])['frames'])
+
+
+class TrafficReplayerTests(unittest.TestCase):
+
+    def test_lines_are_decoded_on_the_network_thread(self):
+        handle, path = tempfile.mkstemp()
+        os.close(handle)
+        self.addCleanup(os.remove, path)
+        recorder = TrafficRecorder(path)
+        for i in range(3):
+            recorder.record(RECEIVED, "alice", "OOC#{}".format(i))
+        recorder.close()
+        server = LoopbackIrcServer().start()
+        self.addCleanup(server.stop)
+        connection = IrcConnection("127.0.0.1", server.port, "#test", "tester", threaded=True, queue_depth=0)
+        connection.on_join_handler = connection.on_users_handler = lambda *args: None
+        connection.start_network_thread()
+        self.addCleanup(connection.stop_network_thread)
+        threads = set()
+        receive_pubmsg = connection.receive_pubmsg
+
+        def record_thread(nick, msg):
+            threads.add(threading.current_thread().name)
+            receive_pubmsg(nick, msg)
+        connection.receive_pubmsg = record_thread
+        finished = []
+        replayer = TrafficReplayer(connection, path, speed=0, on_finished=finished.append)
+        replayer.start()
+        deadline = time.monotonic() + 5
+        while not finished and time.monotonic() < deadline:
+            connection.process_incoming()
+            while connection.get_msg() is not None:
+                pass
+            replayer.update(0.01)
+            time.sleep(0.01)
+        self.assertEqual(1, len(finished))
+        self.assertEqual(3, replayer.replayed)
+        self.assertEqual({"irc-reactor"}, threads)
+        self.assertFalse(connection.muted)
+
+
+if __name__ == '__main__':
+    unittest.main()